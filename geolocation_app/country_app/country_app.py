@@ -1,31 +1,109 @@
-from fastapi import Depends, HTTPException, FastAPI
+from datetime import date
+from typing import Optional
+
+from fastapi import Depends, HTTPException, FastAPI, Query
 from sqlalchemy.orm import Session
 
 from geolocation_app.utils.consts import HOST
-from geolocation_app.utils.db_handler import GeolocationRequestModel, get_db
+from geolocation_app.utils.countries import country_code, suggest_countries
+from geolocation_app.utils.db_handler import get_db
+from geolocation_app.utils.geo_rollup import geo_rollup, geo_rollup_range
+from geolocation_app.utils.location_index import domains_in_location, suggest_regions
+from geolocation_app.utils.logging_setup import use_structured_logging
+from geolocation_app.utils.snapshot import get_read_db, use_read_snapshot
+from geolocation_app.utils.startup import report_startup_time
 
 app = FastAPI()
 
 
+def resolve_country(country_name: str):
+    """
+    Resolve a country name, alias or ISO code, raising 404 if it is unknown.
+    """
+    code = country_code(country_name)
+    if not code:
+        raise HTTPException(status_code=404, detail=f"Unknown country: {country_name}")
+    return code
+
+
 @app.get("/get_domains_by_country/{country_name}", response_model=list[str])
 async def get_domains_by_country(
-    country_name: str, db: Session = Depends(get_db)
+    country_name: str,
+    region: Optional[str] = None,
+    region_prefix: bool = False,
+    db: Session = Depends(get_read_db),
 ):
     """
-    Retrieve domains associated with a specific country.
+    Retrieve domains associated with a specific country, optionally within one of its regions.
+
+    The country may be given by name, alias or ISO code ("United States", "USA", "us"), and regions
+    are matched case-insensitively, so "Niger" never matches Nigeria.
     """
-    country_records = (
-        db.query(GeolocationRequestModel)
-        .filter(GeolocationRequestModel.locations.contains(country_name))
-        .all()
-    )
+    code = resolve_country(country_name)
+    domains = domains_in_location(db, code, region, region_prefix)
 
-    if country_records:
-        return [record.domains for record in country_records]
+    if domains:
+        return domains
     else:
         raise HTTPException(status_code=404, detail=f"No records found for country: {country_name}")
 
 
+@app.get("/countries/rollup", response_model=list[dict])
+async def get_country_rollup(
+    country: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    regions: bool = True,
+    db: Session = Depends(get_read_db),
+):
+    """
+    Count the domains and distinct servers hosted per country and region.
+
+    Served from rollup counters kept up to date by the resolver: the whole world over all time, or any single
+    day of resolution (since == until), in one lookup. Longer slices count distinct values over the daily
+    memberships and are read from the database file.
+    """
+    code = resolve_country(country) if country else None
+    if since is None and until is None:
+        return geo_rollup(db, code, regions=regions)
+
+    since = since or date.min
+    until = until or date.today()
+    if since > until:
+        raise HTTPException(status_code=400, detail="since must not be after until")
+    if since == until:
+        return geo_rollup(db, code, since, regions)
+
+    disk_db = next(get_db())
+    try:
+        return geo_rollup_range(disk_db, since, until, code, regions)
+    finally:
+        disk_db.close()
+
+
+@app.get("/countries/suggest", response_model=list[dict])
+async def get_country_suggestions(prefix: str, limit: int = Query(10, gt=0, le=100)):
+    """
+    Autocomplete country names and aliases by prefix.
+    """
+    return suggest_countries(prefix, limit)
+
+
+@app.get("/countries/{country_name}/regions/suggest", response_model=list[str])
+async def get_region_suggestions(
+    country_name: str, prefix: str = "", limit: int = Query(10, gt=0, le=100), db: Session = Depends(get_read_db)
+):
+    """
+    Autocomplete the known regions of a country by prefix.
+    """
+    return suggest_regions(db, resolve_country(country_name), prefix, limit)
+
+
+use_structured_logging(app, "country_app")
+use_read_snapshot(app)
+report_startup_time(app, "country_app")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=HOST, port=8007)
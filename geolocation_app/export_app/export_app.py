@@ -0,0 +1,85 @@
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Query
+from starlette.responses import StreamingResponse
+
+from geolocation_app.utils.consts import HOST
+from geolocation_app.export_app.exporter import (
+    DEFAULT_CHUNK_SIZE,
+    GZIP_MEDIA_TYPE,
+    MEDIA_TYPES,
+    check_format,
+    export_stream,
+    next_watermark,
+)
+from geolocation_app.utils.logging_setup import use_structured_logging
+from geolocation_app.utils.startup import report_startup_time
+
+app = FastAPI()
+
+
+@app.get("/export")
+def export_requests(
+    format: str = "ndjson",
+    compression: str = "none",
+    status: Optional[List[str]] = Query(None),
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    since: Optional[datetime] = None,
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, gt=0, le=50000),
+):
+    """
+    Stream the geolocation requests table as NDJSON, CSV or Parquet.
+
+    Args:
+        format (str): Output format, one of "ndjson", "csv" or "parquet".
+        compression (str): "none" or "gzip" (parquet always uses its own internal compression).
+        status (list[str], optional): Only export rows with one of these statuses.
+        created_from (datetime, optional): Inclusive lower bound on `created_at`.
+        created_to (datetime, optional): Exclusive upper bound on `created_at`.
+        since (datetime, optional): Incremental mode, only rows changed after this watermark.
+        chunk_size (int): Number of rows read from the database per chunk.
+
+    Returns:
+        StreamingResponse: The export. The `X-Export-Watermark` header holds the value to pass
+        as `since` on the next incremental export.
+    """
+    try:
+        check_format(format, compression)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    watermark = next_watermark()
+    content = export_stream(
+        export_format=format,
+        compression=compression,
+        chunk_size=chunk_size,
+        statuses=status,
+        created_from=created_from,
+        created_to=created_to,
+        since=since,
+        until=watermark if since else None,
+    )
+
+    extension = "csv" if format == "csv" else "parquet" if format == "parquet" else "ndjson"
+    filename = f"geolocation_requests.{extension}"
+    media_type = MEDIA_TYPES[format]
+    if compression == "gzip" and format != "parquet":
+        filename += ".gz"
+        media_type = GZIP_MEDIA_TYPE
+    headers = {
+        "X-Export-Watermark": watermark.isoformat(),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+
+    return StreamingResponse(content, media_type=media_type, headers=headers)
+
+
+use_structured_logging(app, "export_app")
+report_startup_time(app, "export_app")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=HOST, port=8010)
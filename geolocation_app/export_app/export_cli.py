@@ -0,0 +1,66 @@
+import argparse
+import sys
+from datetime import datetime
+
+from geolocation_app.export_app.exporter import (
+    DEFAULT_CHUNK_SIZE,
+    EXPORT_COMPRESSIONS,
+    EXPORT_FORMATS,
+    export_stream,
+    next_watermark,
+)
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments of the export CLI.
+
+    Args:
+        argv (list[str], optional): Arguments, defaults to `sys.argv[1:]`.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Export geolocation requests as NDJSON, CSV or Parquet.")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--compression", choices=EXPORT_COMPRESSIONS, default="none")
+    parser.add_argument("--status", action="append", help="Only export this status, may be repeated.")
+    parser.add_argument("--created-from", type=datetime.fromisoformat, help="Inclusive lower bound on created_at.")
+    parser.add_argument("--created-to", type=datetime.fromisoformat, help="Exclusive upper bound on created_at.")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="Incremental mode: only rows changed after this watermark.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--output", "-o", help="Output file, defaults to stdout.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Run the export and print the watermark for the next incremental export to stderr.
+    """
+    args = parse_args(argv)
+    watermark = next_watermark()
+    content = export_stream(
+        export_format=args.format,
+        compression=args.compression,
+        chunk_size=args.chunk_size,
+        statuses=args.status,
+        created_from=args.created_from,
+        created_to=args.created_to,
+        since=args.since,
+        until=watermark if args.since else None,
+    )
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for block in content:
+            output.write(block)
+    finally:
+        if args.output:
+            output.close()
+
+    print(f"watermark: {watermark.isoformat()}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine import make_url
+
+from geolocation_app.utils.db_handler import DATABASE_URL, GeolocationRequestModel
+
+EXPORT_COLUMNS = ("id", "domain", "created_at", "updated_at", "locations", "servers", "status")
+EXPORT_FORMATS = ("ndjson", "csv", "parquet")
+EXPORT_COMPRESSIONS = ("none", "gzip")
+DEFAULT_CHUNK_SIZE = 1000
+
+# Rows committed by a writer that stamped `updated_at` just before the export started may not be
+# visible yet, so the incremental watermark trails the wall clock by this much.
+WATERMARK_LAG = timedelta(seconds=5)
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+# A gzip export is a .gz file, not an encoding of the response, or clients would save it decompressed.
+GZIP_MEDIA_TYPE = "application/gzip"
+
+_readonly_engine = None
+
+
+def get_readonly_engine():
+    """
+    Return an engine whose connections open the SQLite file read-only.
+
+    Returns:
+        Engine: Read-only SQLAlchemy engine for the shared database.
+    """
+    global _readonly_engine
+    if _readonly_engine is None:
+        url = make_url(DATABASE_URL)
+        _readonly_engine = create_engine(
+            f"sqlite:///file:{url.database}?mode=ro&uri=true",
+            connect_args={"check_same_thread": False},
+        )
+    return _readonly_engine
+
+
+def next_watermark(now: datetime = None):
+    """
+    Compute the upper bound to use for an incremental export started now.
+
+    Args:
+        now (datetime, optional): Current UTC time.
+
+    Returns:
+        datetime: Watermark to pass as `since` on the next incremental export.
+    """
+    return (now or datetime.utcnow()) - WATERMARK_LAG
+
+
+def build_export_query(statuses=None, created_from=None, created_to=None, since=None, until=None):
+    """
+    Build the SELECT statement for an export.
+
+    Args:
+        statuses (list[str], optional): Only export rows with one of these statuses.
+        created_from (datetime, optional): Inclusive lower bound on `created_at`.
+        created_to (datetime, optional): Exclusive upper bound on `created_at`.
+        since (datetime, optional): Incremental mode, only rows changed after this watermark.
+        until (datetime, optional): Incremental mode, only rows changed up to this watermark.
+
+    Returns:
+        Select: SQLAlchemy select statement.
+    """
+    table = GeolocationRequestModel.__table__
+    query = select(*(table.c[name] for name in EXPORT_COLUMNS))
+
+    if statuses:
+        query = query.where(table.c.status.in_(statuses))
+    if created_from:
+        query = query.where(table.c.created_at >= created_from)
+    if created_to:
+        query = query.where(table.c.created_at < created_to)
+    # Rows written before `updated_at` existed have none, their creation time stands in for it.
+    changed_at = func.coalesce(table.c.updated_at, table.c.created_at)
+    if since:
+        query = query.where(changed_at > since)
+    if until:
+        query = query.where(changed_at <= until)
+
+    if since or until:
+        return query.order_by(changed_at, table.c.id)
+    return query.order_by(table.c.created_at, table.c.id)
+
+
+def iter_row_chunks(query, chunk_size: int = DEFAULT_CHUNK_SIZE, engine=None):
+    """
+    Stream the rows of a query in chunks from a single read-only transaction.
+
+    Only one chunk is held in memory at a time, and since the database runs in WAL mode the
+    read transaction does not block writers.
+
+    Args:
+        query (Select): Statement built by `build_export_query`.
+        chunk_size (int): Number of rows per chunk.
+        engine (Engine, optional): Engine to read from, defaults to the read-only engine.
+
+    Yields:
+        list[dict]: Chunk of rows keyed by column name.
+    """
+    engine = engine or get_readonly_engine()
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.mappings().fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [dict(row) for row in rows]
+
+
+def _serialize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_ndjson(chunks):
+    """
+    Encode row chunks as newline-delimited JSON.
+
+    Args:
+        chunks (Iterable[list[dict]]): Row chunks.
+
+    Yields:
+        bytes: One encoded block per chunk.
+    """
+    for chunk in chunks:
+        lines = [json.dumps({key: _serialize(value) for key, value in row.items()}) for row in chunk]
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def encode_csv(chunks):
+    """
+    Encode row chunks as CSV with a header row.
+
+    Args:
+        chunks (Iterable[list[dict]]): Row chunks.
+
+    Yields:
+        bytes: Header, then one encoded block per chunk.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    yield buffer.getvalue().encode()
+
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows({key: _serialize(value) for key, value in row.items()} for row in chunk)
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file object that hands back whatever was written since the last drain.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def encode_parquet(chunks):
+    """
+    Encode row chunks as a Parquet file, one row group per chunk.
+
+    Requires the optional `pyarrow` dependency.
+
+    Args:
+        chunks (Iterable[list[dict]]): Row chunks.
+
+    Yields:
+        bytes: Encoded file content, flushed after every row group.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.string()),
+        ("domain", pa.string()),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+        ("locations", pa.string()),
+        ("servers", pa.string()),
+        ("status", pa.string()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def gzip_stream(blocks):
+    """
+    Gzip-compress a stream of byte blocks incrementally.
+
+    Args:
+        blocks (Iterable[bytes]): Uncompressed blocks.
+
+    Yields:
+        bytes: Compressed blocks.
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def check_format(export_format: str, compression: str = "none"):
+    """
+    Validate the requested format and compression.
+
+    Args:
+        export_format (str): One of `EXPORT_FORMATS`.
+        compression (str): One of `EXPORT_COMPRESSIONS`.
+
+    Raises:
+        ValueError: If the combination is not supported in this environment.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format: {export_format}")
+    if compression not in EXPORT_COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+    if export_format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError("The parquet format requires the optional 'pyarrow' package")
+
+
+def export_stream(export_format: str = "ndjson", compression: str = "none",
+                  chunk_size: int = DEFAULT_CHUNK_SIZE, engine=None, **filters):
+    """
+    Stream an encoded export of the geolocation requests table.
+
+    Args:
+        export_format (str): One of `EXPORT_FORMATS`.
+        compression (str): One of `EXPORT_COMPRESSIONS`, ignored for parquet which compresses internally.
+        chunk_size (int): Number of rows read per chunk.
+        engine (Engine, optional): Engine to read from, defaults to the read-only engine.
+        **filters: Keyword arguments passed to `build_export_query`.
+
+    Returns:
+        Iterator[bytes]: Encoded export content.
+    """
+    check_format(export_format, compression)
+    chunks = iter_row_chunks(build_export_query(**filters), chunk_size, engine)
+
+    if export_format == "parquet":
+        return encode_parquet(chunks)
+
+    blocks = encode_ndjson(chunks) if export_format == "ndjson" else encode_csv(chunks)
+    if compression == "gzip":
+        return gzip_stream(blocks)
+    return blocks
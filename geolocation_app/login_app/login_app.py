@@ -1,24 +1,38 @@
 from fastapi import FastAPI, HTTPException, Depends, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
+from functools import cache
 
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from starlette.responses import HTMLResponse
 
+from geolocation_app.utils.consts import TOKEN_ALGORITHM, TOKEN_SECRET_KEY
 from geolocation_app.utils.db_handler import User, get_db
+from geolocation_app.utils.logging_setup import use_structured_logging
+from geolocation_app.utils.startup import report_startup_time
 
 app = FastAPI()
 
-SECRET_KEY = "secret-key"
-ALGORITHM = "HS256"
+SECRET_KEY = TOKEN_SECRET_KEY
+ALGORITHM = TOKEN_ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-app.password_hasher = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+@cache
+def get_password_hasher():
+    """
+    Get the password hasher, importing passlib and loading bcrypt on first use.
+
+    Returns:
+        CryptContext: Password hashing context.
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 class Token(BaseModel):
@@ -41,6 +55,8 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     Returns:
         str: Generated access token.
     """
+    from jose import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -62,6 +78,8 @@ def verify_token(token: str, credentials_exception=HTTPException(status_code=401
     Returns:
         TokenData: Decoded token data.
     """
+    from jose import JWTError, jwt
+
     credentials_exception = credentials_exception
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -88,7 +106,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         Token: Generated access token.
     """
     user = db.query(User).filter(User.username == form_data.username).first()
-    if user and app.password_hasher.verify(form_data.password, user.password):
+    if user and get_password_hasher().verify(form_data.password, user.password):
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(data={"sub": form_data.username}, expires_delta=access_token_expires)
         return {"access_token": access_token, "token_type": "bearer"}
@@ -109,7 +127,7 @@ async def register(username: str = Form(...), password: str = Form(...), db: Ses
     Returns:
         str: HTML response indicating successful registration.
     """
-    hashed_password = app.password_hasher.hash(password)
+    hashed_password = get_password_hasher().hash(password)
     new_user = User(username=username, password=hashed_password)
     db.add(new_user)
     db.commit()
@@ -167,7 +185,7 @@ async def login(username: str = Form(...), password: str = Form(...), db: Sessio
         str: HTML response indicating login success or failure.
     """
     user = db.query(User).filter(User.username == username).first()
-    if user and app.password_hasher.verify(password, user.password):
+    if user and get_password_hasher().verify(password, user.password):
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(data={"sub": username}, expires_delta=access_token_expires)
         return """
@@ -197,6 +215,10 @@ async def login(username: str = Form(...), password: str = Form(...), db: Sessio
         """
 
 
+use_structured_logging(app, "login_app")
+report_startup_time(app, "login_app")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8009)
@@ -1,60 +1,144 @@
-import re
+from typing import Optional
+
 from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy import func, desc
+from sqlalchemy import desc, func, select, union_all
 from sqlalchemy.orm import Session
 
-from geolocation_app.utils.consts import HOST
-from geolocation_app.utils.db_handler import GeolocationRequestModel, get_db
+from geolocation_app.utils.consts import HEAVY_HITTERS_ENABLED, HOST
+from geolocation_app.utils.db_handler import ArchivedCountModel, GeolocationRequestModel
+from geolocation_app.utils.heavy_hitters import HeavyHitterReader
+from geolocation_app.utils.ip_index import parse_servers
+from geolocation_app.utils.logging_setup import use_structured_logging
+from geolocation_app.utils.popularity_buckets import DOMAIN, SERVER, most_popular, parse_window
+from geolocation_app.utils.snapshot import get_read_db, use_read_snapshot
+from geolocation_app.utils.startup import report_startup_time
 
 app = FastAPI()
 
+heavy_hitters = {DOMAIN: HeavyHitterReader(DOMAIN), SERVER: HeavyHitterReader(SERVER)}
+
+
+def get_window(window: Optional[str] = None):
+    """
+    Parse the optional `window` query parameter.
+
+    Args:
+        window (str, optional): Window expression such as "hour", "day", "week" or "6h".
+
+    Returns:
+        timedelta | None: Length of the window, None for all time.
+    """
+    if window is None:
+        return None
+    try:
+        return parse_window(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def approximate_most_popular(kind: str, label: str, n: int, window):
+    """
+    Get the N most popular keys from the heavy-hitters summaries.
+
+    Args:
+        kind (str): DOMAIN or SERVER.
+        label (str): Name of the key field in the response entries.
+        n (int): Number of keys to retrieve.
+        window (timedelta, optional): Must be None, summaries cover all time.
+
+    Returns:
+        list: List of dictionaries with the key, "request_count" (estimate) and "error" (max overestimation).
+    """
+    if window is not None:
+        raise HTTPException(status_code=400, detail="approx=true cannot be combined with window")
+    if not HEAVY_HITTERS_ENABLED:
+        raise HTTPException(status_code=400, detail="Approximate popularity tracking is disabled")
+
+    sketch = heavy_hitters[kind].get()
+    if sketch is None:
+        raise HTTPException(status_code=404, detail="No data found")
+
+    return [{label: key, "request_count": count, "error": error} for key, count, error in sketch.top(n)]
+
 
 @app.get("/most_popular_domains/", response_model=list)
-async def get_most_popular_domains(n: int = 5, db: Session = Depends(get_db)):
+async def get_most_popular_domains(
+    n: int = 5, window=Depends(get_window), approx: bool = False, db: Session = Depends(get_read_db)
+):
     """
-    Get the N most popular domains.
+    Get the N most popular domains, over all time or over a trailing window.
 
     Args:
         n (int): Number of domains to retrieve.
+        window (timedelta, optional): Trailing window answered from the bucketed counters.
+        approx (bool): Answer from the bounded-memory heavy-hitters summary, adding an "error" key
+            with the maximum overestimation of each count.
         db (Session): SQLAlchemy database session.
 
     Returns:
         list: List of dictionaries with "domain" and "request_count" keys.
     """
-    most_popular_domains = db.query(
-        GeolocationRequestModel.domain,
-        func.count(GeolocationRequestModel.domain).label("request_count")
-    ).group_by(GeolocationRequestModel.domain).order_by(
-        desc("request_count")
-    ).limit(n).all()
+    if approx:
+        return approximate_most_popular(DOMAIN, "domain", n, window)
+
+    if window is not None:
+        return [{"domain": domain, "request_count": hits} for domain, hits in most_popular(db, DOMAIN, window, n)]
+
+    # Requests moved to the archive are counted from their folded counters.
+    counts = union_all(
+        select(
+            GeolocationRequestModel.domain.label("domain"),
+            func.count(GeolocationRequestModel.domain).label("request_count"),
+        ).group_by(GeolocationRequestModel.domain),
+        select(ArchivedCountModel.key, ArchivedCountModel.requests).where(ArchivedCountModel.kind == DOMAIN),
+    ).subquery()
+    most_popular_domains = db.execute(
+        select(counts.c.domain, func.sum(counts.c.request_count).label("request_count"))
+        .group_by(counts.c.domain)
+        .order_by(desc("request_count"))
+        .limit(n)
+    ).all()
 
     return [{"domain": domain, "request_count": request_count} for domain, request_count in most_popular_domains]
 
 
 @app.get("/most_popular_servers/", response_model=list)
-async def get_most_popular_servers(n: int = 3, db: Session = Depends(get_db)):
+async def get_most_popular_servers(
+    n: int = 3, window=Depends(get_window), approx: bool = False, db: Session = Depends(get_read_db)
+):
     """
-    Get the N most popular servers.
+    Get the N most popular servers, over all time or over a trailing window.
 
     Args:
         n (int): Number of servers to retrieve.
+        window (timedelta, optional): Trailing window answered from the bucketed counters.
+        approx (bool): Answer from the bounded-memory heavy-hitters summary, adding an "error" key
+            with the maximum overestimation of each count.
         db (Session): SQLAlchemy database session.
 
     Returns:
         list: List of dictionaries with "server" and "request_count" keys.
     """
-    ip_pattern = re.compile(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b')
+    if approx:
+        return approximate_most_popular(SERVER, "server", n, window)
+
+    if window is not None:
+        return [{"server": server, "request_count": hits} for server, hits in most_popular(db, SERVER, window, n)]
 
     result = db.query(GeolocationRequestModel.servers).filter(GeolocationRequestModel.servers != '').all()
+    # Requests moved to the archive are counted from their folded counters.
+    archived = db.query(ArchivedCountModel.key, ArchivedCountModel.requests).filter(
+        ArchivedCountModel.kind == SERVER
+    ).all()
 
-    if not result:
+    if not result and not archived:
         raise HTTPException(status_code=404, detail="No data found")
 
-    servers_count = {}
+    servers_count = dict(archived)
 
     for row in result:
-        servers = re.findall(ip_pattern, row.servers)
-        for server in servers:
+        # IPv6 servers too, since the resolver looks up AAAA records.
+        for server in parse_servers(row.servers):
             servers_count[server] = servers_count.get(server, 0) + 1
 
     sorted_servers = sorted(servers_count.items(), key=lambda x: x[1], reverse=True)[:n]
@@ -62,6 +146,11 @@ async def get_most_popular_servers(n: int = 3, db: Session = Depends(get_db)):
     return [{"server": server, "request_count": count} for server, count in sorted_servers]
 
 
+use_structured_logging(app, "popularity_app")
+use_read_snapshot(app)
+report_startup_time(app, "popularity_app")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=HOST, port=8006)
\ No newline at end of file
@@ -1,25 +1,124 @@
 from datetime import datetime
+from functools import cache
 import hashlib
+from typing import Optional
 
-from fastapi import FastAPI, Depends, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, status
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from starlette.responses import JSONResponse
 
-from geolocation_app.utils.consts import HOST
-from geolocation_app.utils.db_handler import GeolocationRequestModel, get_db
-from geolocation_app.utils.models import GeolocationResponse, GeolocationRequestParams
+from geolocation_app.utils.auth import token_subject
+from geolocation_app.utils.callbacks import (
+    check_callback_url,
+    delete_subscription,
+    get_subscription,
+    set_subscription,
+)
+from geolocation_app.utils.consts import (
+    BACKPRESSURE_RETRY_AFTER_SECONDS,
+    HEAVY_HITTERS_ENABLED,
+    HOST,
+    PENDING_BACKLOG_LIMIT,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_PER_SECOND,
+    RATE_LIMIT_SHARED,
+)
+from geolocation_app.utils.db_handler import GeolocationRequestModel, get_db, get_session
+from geolocation_app.utils.logging_setup import use_structured_logging
+from geolocation_app.utils.models import CallbackSubscriptionParams, GeolocationResponse, GeolocationRequestParams
+from geolocation_app.utils.heavy_hitters import HeavyHitterTracker
+from geolocation_app.utils.popularity_buckets import DOMAIN, record_hits
+from geolocation_app.utils.rate_limit import (
+    AdmissionStats,
+    PendingBacklogGauge,
+    SharedTokenBucketLimiter,
+    TokenBucketLimiter,
+    client_key,
+    retry_after_header,
+)
+from geolocation_app.utils.startup import report_startup_time
 
 app = FastAPI()
 
+if RATE_LIMIT_SHARED:
+    rate_limiter = SharedTokenBucketLimiter(get_session, RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+else:
+    rate_limiter = TokenBucketLimiter(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+pending_backlog = PendingBacklogGauge()
+admission_stats = AdmissionStats()
 
-def create_geolocation_request(db: Session, params: GeolocationRequestParams):
+
+@cache
+def get_domain_heavy_hitters():
+    """
+    Get the domain heavy-hitters tracker, loaded from its checkpoint on first use.
+    """
+    return HeavyHitterTracker(DOMAIN) if HEAVY_HITTERS_ENABLED else None
+
+
+def admission_control(request: Request, authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """
+    Admit a request creation, or reject it when the resolver is backlogged or the client is over its rate.
+
+    Args:
+        request (Request): Incoming request.
+        authorization (str, optional): Authorization header, identifies API-token clients.
+        db (Session): SQLAlchemy database session.
+
+    Returns:
+        str: Key of the admitted client, counted as accepted once its request is created.
+
+    Raises:
+        HTTPException: 503 when the Pending backlog is over its limit, 429 when the client is over its rate,
+            both with a Retry-After header.
+    """
+    client = client_key(authorization, request.client.host if request.client else None)
+
+    if pending_backlog.get(db) >= PENDING_BACKLOG_LIMIT:
+        admission_stats.record("backpressure", client)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many pending requests, try again later",
+            headers=retry_after_header(BACKPRESSURE_RETRY_AFTER_SECONDS),
+        )
+
+    allowed, retry_after = rate_limiter.acquire(client)
+    if not allowed:
+        admission_stats.record("rate_limited", client)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers=retry_after_header(retry_after),
+        )
+
+    return client
+
+
+def validate_callback_url(url):
+    """
+    Refuse callback URLs that do not point to a public address.
+
+    The host name is resolved with a blocking call, so this must not run on the event loop: the endpoints
+    calling it are plain functions, run in the thread pool.
+
+    Raises:
+        HTTPException: 422 with the reason.
+    """
+    try:
+        check_callback_url(str(url))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+
+def create_geolocation_request(db: Session, params: GeolocationRequestParams, client: str = ""):
     """
     Create a geolocation request and return the request ID.
 
     Args:
         db (Session): SQLAlchemy database session.
         params (GeolocationRequestParams): Geolocation request parameters.
+        client (str): Key of the submitting client, the resolver is fair between clients of the same priority.
 
     Returns:
         str: Request ID.
@@ -29,32 +128,143 @@ def create_geolocation_request(db: Session, params: GeolocationRequestParams):
         data_to_hash = f"{params.domain}{timestamp}"
 
         request_id = hashlib.sha256(data_to_hash.encode()).hexdigest()
-        db_request = GeolocationRequestModel(id=request_id, domain=params.domain, servers="")
+        db_request = GeolocationRequestModel(
+            id=request_id, domain=params.domain, servers="", priority=params.priority, client_id=client,
+            callback_url=str(params.callback_url) if params.callback_url else None,
+        )
         db.add(db_request)
+        record_hits(db, DOMAIN, [params.domain])
         db.commit()
     except IntegrityError:
         db.rollback()
         error_message = {"error": "Domain already exists"}
         return JSONResponse(content=error_message, status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
+    domain_heavy_hitters = get_domain_heavy_hitters()
+    if domain_heavy_hitters:
+        domain_heavy_hitters.add([params.domain])
+
     return request_id
 
 
 @app.post("/geolocation/request", response_model=GeolocationResponse, status_code=status.HTTP_200_OK)
-async def geolocation_request(params: GeolocationRequestParams = Depends()):
+def geolocation_request(params: GeolocationRequestParams = Depends(), client: str = Depends(admission_control)):
     """
     Endpoint to create a geolocation request.
 
+    Interactive requests (the default) are resolved ahead of bulk ones, pass `priority=bulk` for batch loads.
+    With `callback_url`, the result is also POSTed there once resolved.
+
     Args:
         params (GeolocationRequestParams): Geolocation request parameters.
+        client (str): Key of the admitted client.
 
     Returns:
         GeolocationResponse: Response containing the request ID.
     """
-    response = create_geolocation_request(next(get_db()), params)
+    if params.callback_url:
+        validate_callback_url(params.callback_url)
+    response = create_geolocation_request(next(get_db()), params, client)
+    if isinstance(response, JSONResponse):
+        return response
+    admission_stats.record("accepted")
     return GeolocationResponse(request_id=response)
 
 
+def subscription_client(authorization: Optional[str] = Header(None)):
+    """
+    Identify the user a subscription belongs to, from the access token issued by the login service.
+
+    Requests created with the same token are attributed to the same client key, so they are delivered to the
+    subscription. Clients identified by address only may share it with others and cannot subscribe.
+
+    Raises:
+        HTTPException: 401 without a valid access token.
+    """
+    if token_subject(authorization) is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="A valid access token is required to manage subscriptions",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return client_key(authorization)
+
+
+@app.put("/geolocation/subscription", response_model=dict)
+def put_subscription(params: CallbackSubscriptionParams, client: str = Depends(subscription_client),
+                           db: Session = Depends(get_db)):
+    """
+    Subscribe to the results of all the client's requests, replacing its previous subscription.
+
+    Results are POSTed to the URL in batches, as {"results": [...]}, and retried until accepted with a 2xx.
+
+    Args:
+        params (CallbackSubscriptionParams): Destination URL.
+        client (str): Key of the client.
+        db (Session): SQLAlchemy database session.
+
+    Returns:
+        dict: The subscription.
+    """
+    validate_callback_url(params.url)
+    set_subscription(db, client, str(params.url))
+    return {"url": str(params.url)}
+
+
+@app.get("/geolocation/subscription", response_model=dict)
+async def read_subscription(client: str = Depends(subscription_client), db: Session = Depends(get_db)):
+    """
+    Get the client's subscription.
+
+    Returns:
+        dict: The subscription.
+
+    Raises:
+        HTTPException: 404 when the client is not subscribed.
+    """
+    url = get_subscription(db, client)
+    if url is None:
+        raise HTTPException(status_code=404, detail="No subscription")
+    return {"url": url}
+
+
+@app.delete("/geolocation/subscription", status_code=status.HTTP_204_NO_CONTENT)
+async def remove_subscription(client: str = Depends(subscription_client), db: Session = Depends(get_db)):
+    """
+    Unsubscribe the client. Requests submitted with their own `callback_url` are still delivered there.
+
+    Raises:
+        HTTPException: 404 when the client is not subscribed.
+    """
+    if not delete_subscription(db, client):
+        raise HTTPException(status_code=404, detail="No subscription")
+
+
+@app.get("/geolocation/admission/stats", response_model=dict)
+async def get_admission_stats():
+    """
+    Get the counters of admitted and rejected request creations.
+
+    Returns:
+        dict: Accepted and rejected counts, and the clients with the most rejections.
+    """
+    return {**admission_stats.snapshot(), "pending_backlog": pending_backlog.last}
+
+
+def shutdown_event():
+    """
+    Checkpoint the heavy-hitters summary on shutdown.
+    """
+    domain_heavy_hitters = get_domain_heavy_hitters()
+    if domain_heavy_hitters:
+        domain_heavy_hitters.close()
+
+
+app.add_event_handler("shutdown", shutdown_event)
+use_structured_logging(app, "request_app")
+report_startup_time(app, "request_app")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=HOST, port=8001)
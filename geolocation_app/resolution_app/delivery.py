@@ -0,0 +1,345 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam, delete, func, select, update
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from geolocation_app.utils.consts import (
+    CALLBACK_BACKOFF_BASE_SECONDS,
+    CALLBACK_BACKOFF_CAP_SECONDS,
+    CALLBACK_BATCH_SIZE,
+    CALLBACK_CONCURRENCY,
+    CALLBACK_FETCH_SIZE,
+    CALLBACK_GIVEN_UP_RETENTION_DAYS,
+    CALLBACK_MAX_ATTEMPTS,
+    CALLBACK_POLL_SECONDS,
+    CALLBACK_TIMEOUT_SECONDS,
+)
+from geolocation_app.utils.callbacks import check_callback_address, check_callback_url
+from geolocation_app.utils.db_handler import CallbackOutboxModel, get_session
+
+_PURGE_INTERVAL_SECONDS = 3600
+
+_outbox = CallbackOutboxModel.__table__
+_RESCHEDULE = (
+    update(_outbox)
+    .where(_outbox.c.id == bindparam("row_id"))
+    .values(
+        attempts=bindparam("attempts"),
+        next_attempt_at=bindparam("next_attempt_at"),
+        last_error=bindparam("last_error"),
+    )
+)
+_POSTPONE = (
+    update(_outbox)
+    .where(_outbox.c.id == bindparam("row_id"))
+    .values(next_attempt_at=bindparam("next_attempt_at"))
+)
+
+
+class _PublicPeerConnection:
+    """
+    Refuses a connection whose peer is not a public address, after connecting and before sending anything.
+
+    The callback host may resolve to another address when connecting than when its URL was checked
+    (DNS rebinding), so the address actually connected to is checked.
+    """
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        try:
+            check_callback_address(self.host, self.port, sock.getpeername()[0])
+        except ValueError as e:
+            sock.close()
+            raise NewConnectionError(self, str(e))
+        return sock
+
+
+class _PublicPeerHTTPConnection(_PublicPeerConnection, HTTPConnection):
+    pass
+
+
+class _PublicPeerHTTPSConnection(_PublicPeerConnection, HTTPSConnection):
+    pass
+
+
+class _PublicPeerHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicPeerHTTPConnection
+
+
+class _PublicPeerHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicPeerHTTPSConnection
+
+
+class PublicPeerAdapter(HTTPAdapter):
+    """
+    HTTP adapter whose connections are only to public addresses, or to allowed callback hosts.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _PublicPeerHTTPConnectionPool,
+            "https": _PublicPeerHTTPSConnectionPool,
+        }
+
+
+def retry_delay(attempts: int, base: float = CALLBACK_BACKOFF_BASE_SECONDS, cap: float = CALLBACK_BACKOFF_CAP_SECONDS):
+    """
+    Delay before the next delivery attempt: exponential backoff with full jitter.
+
+    Args:
+        attempts (int): Failed attempts so far.
+        base (float): Delay after the first failure, before jitter.
+        cap (float): Maximum delay.
+
+    Returns:
+        timedelta: Delay.
+    """
+    return timedelta(seconds=random.uniform(0, min(cap, base * 2 ** (attempts - 1))))
+
+
+class CallbackDeliveryWorker:
+    """
+    Delivers the completion callbacks queued in the outbox table.
+
+    Due notifications are grouped by destination, and each destination is delivered on its own, in parallel
+    with the others, over one keep-alive connection pool per host: its notifications are POSTed as
+    {"results": [...]} in batches of up to `batch_size`, and the outcome is written as soon as they are done,
+    so a slow destination never holds up the others. A destination has at most one delivery in flight.
+    A delivered batch is deleted from the outbox; a failed one is retried with exponential backoff, and given
+    up after `max_attempts` (kept in the outbox with no next attempt for `given_up_retention`); the batches of
+    the destination that were not sent after it are retried with it, without counting an attempt. Since the
+    outbox is written in the same transaction as the results, nothing is lost across restarts; a batch may be
+    delivered twice if the process stops between the POST and the delete, so receivers should deduplicate
+    by request_id.
+    """
+
+    def __init__(self, batch_size: int = CALLBACK_BATCH_SIZE, fetch_size: int = CALLBACK_FETCH_SIZE,
+                 concurrency: int = CALLBACK_CONCURRENCY, poll_interval: float = CALLBACK_POLL_SECONDS,
+                 timeout: float = CALLBACK_TIMEOUT_SECONDS, max_attempts: int = CALLBACK_MAX_ATTEMPTS,
+                 given_up_retention: timedelta = timedelta(days=CALLBACK_GIVEN_UP_RETENTION_DAYS)):
+        self.batch_size = batch_size
+        self.fetch_size = fetch_size
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.given_up_retention = given_up_retention
+        self.counters = Counter()
+        self.session = requests.Session()
+        adapter = PublicPeerAdapter(pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="callback")
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._purged_at = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="callback-delivery", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0):
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        # Deliveries in flight finish and record their outcome, those not started stay due in the outbox.
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def wake(self):
+        """
+        Look for due notifications now instead of at the next poll, called after results are written.
+        """
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if self._purged_at is None or time.monotonic() - self._purged_at >= _PURGE_INTERVAL_SECONDS:
+                    self._purged_at = time.monotonic()
+                    purged = self.purge_given_up()
+                    if purged:
+                        logging.info(f"Purged {purged} given-up completion callbacks.")
+                self.deliver_due()
+            except Exception as e:
+                logging.error(f"Failed to deliver completion callbacks: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def deliver_due(self):
+        """
+        Start delivering the due notifications of every destination that has no delivery in flight.
+
+        Returns:
+            list[Future]: One delivery per destination, each resolving to its number of delivered notifications.
+        """
+        with self._lock:
+            busy = list(self._in_flight)
+        query = (
+            select(_outbox.c.id, _outbox.c.destination, _outbox.c.payload, _outbox.c.attempts)
+            .where(_outbox.c.next_attempt_at <= datetime.utcnow())
+            .order_by(_outbox.c.next_attempt_at, _outbox.c.id)
+            .limit(self.fetch_size)
+        )
+        if busy:
+            query = query.where(_outbox.c.destination.not_in(busy))
+        db = get_session()
+        try:
+            rows = db.execute(query).all()
+        finally:
+            db.close()
+
+        by_destination = {}
+        for row in rows:
+            by_destination.setdefault(row.destination, []).append(row)
+        with self._lock:
+            self._in_flight.update(by_destination)
+        return [
+            self._pool.submit(self._deliver_destination, destination, destination_rows)
+            for destination, destination_rows in by_destination.items()
+        ]
+
+    def _deliver_destination(self, destination: str, rows):
+        """
+        POST the notifications of one destination batch by batch, then record the outcome.
+
+        Returns:
+            int: Number of notifications delivered.
+        """
+        try:
+            delivered = []
+            failed = []
+            postponed = []
+            sent = 0
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                error = self._post(destination, batch)
+                sent += 1
+                if error is None:
+                    delivered += [row.id for row in batch]
+                    continue
+                # The destination is failing: the batch is charged an attempt, and the rest of its notifications,
+                # not sent, are retried along with it without being charged.
+                next_attempt_at = datetime.utcnow() + retry_delay(max(row.attempts for row in batch) + 1)
+                failed = [
+                    {
+                        "row_id": row.id,
+                        "attempts": row.attempts + 1,
+                        "next_attempt_at": next_attempt_at if row.attempts + 1 < self.max_attempts else None,
+                        "last_error": error[:500],
+                    }
+                    for row in batch
+                ]
+                postponed = [
+                    {"row_id": row.id, "next_attempt_at": next_attempt_at}
+                    for row in rows[start + self.batch_size:]
+                ]
+                break
+
+            db = get_session()
+            try:
+                if delivered:
+                    db.execute(delete(_outbox).where(_outbox.c.id.in_(delivered)))
+                if failed:
+                    db.execute(_RESCHEDULE, failed)
+                if postponed:
+                    db.execute(_POSTPONE, postponed)
+                db.commit()
+            finally:
+                db.close()
+
+            with self._lock:
+                self.counters["batches"] += sent
+                self.counters["delivered"] += len(delivered)
+                self.counters["failed_attempts"] += len(failed)
+                self.counters["postponed"] += len(postponed)
+                self.counters["given_up"] += sum(1 for row in failed if row["next_attempt_at"] is None)
+            return len(delivered)
+        except Exception as e:
+            logging.error(f"Failed to deliver completion callbacks to {destination}: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.discard(destination)
+            self._wakeup.set()
+
+    def _post(self, destination: str, rows):
+        """
+        POST one batch to its destination.
+
+        The destination is checked again first, as the address its host resolves to may have changed, and the
+        address connected to is checked by the adapter. Redirects are not followed, they could lead anywhere,
+        and count as a failed delivery.
+
+        Returns:
+            str | None: Error message, None when the destination accepted the batch.
+        """
+        try:
+            check_callback_url(destination)
+        except ValueError as e:
+            return str(e)
+        body = '{"results": [' + ", ".join(row.payload for row in rows) + "]}"
+        try:
+            response = self.session.post(
+                destination, data=body, headers={"Content-Type": "application/json"}, timeout=self.timeout,
+                allow_redirects=False,
+            )
+        except requests.RequestException as e:
+            return f"{type(e).__name__}: {e}"
+        if 200 <= response.status_code < 300:
+            return None
+        return f"HTTP {response.status_code}: {response.text[:200]}"
+
+    def purge_given_up(self, now: datetime = None):
+        """
+        Delete the given-up notifications older than `given_up_retention`.
+
+        Returns:
+            int: Number of notifications deleted.
+        """
+        cutoff = (now or datetime.utcnow()) - self.given_up_retention
+        db = get_session()
+        try:
+            purged = db.execute(
+                delete(_outbox).where(_outbox.c.next_attempt_at.is_(None), _outbox.c.created_at < cutoff)
+            ).rowcount
+            db.commit()
+        finally:
+            db.close()
+        return purged
+
+    def stats(self):
+        """
+        Get the delivery counters and the state of the outbox.
+
+        Returns:
+            dict: Delivered notifications, failed and given-up attempts, batches sent, destinations being
+                delivered, and the outbox backlog.
+        """
+        given_up = _outbox.c.next_attempt_at.is_(None)
+        db = get_session()
+        try:
+            backlog = dict(db.execute(select(given_up, func.count()).group_by(given_up)).all())
+        finally:
+            db.close()
+        with self._lock:
+            counters = dict(self.counters)
+            in_flight = len(self._in_flight)
+        return {
+            **counters,
+            "in_flight": in_flight,
+            "outbox": backlog.get(False, 0),
+            "outbox_given_up": backlog.get(True, 0),
+        }
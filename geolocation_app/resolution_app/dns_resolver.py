@@ -0,0 +1,291 @@
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import dns.exception
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+
+from geolocation_app.utils.consts import (
+    DNS_CACHE_SIZE,
+    DNS_HEDGE_DELAY_SECONDS,
+    DNS_MAX_TTL_SECONDS,
+    DNS_NAMESERVERS,
+    DNS_NEGATIVE_TTL_SECONDS,
+    DNS_SERVFAIL_TTL_SECONDS,
+    DNS_TIMEOUT_SECONDS,
+)
+
+ADDRESS_TYPES = (dns.rdatatype.A, dns.rdatatype.AAAA)
+
+# Outcomes of a lookup that are not an answer.
+NXDOMAIN = "NXDOMAIN"
+SERVFAIL = "SERVFAIL"
+TIMEOUT = "TIMEOUT"
+
+
+class DnsResolutionError(Exception):
+    """
+    The domain does not resolve (NXDOMAIN, no address records, or SERVFAIL from every nameserver).
+    """
+
+
+class DnsUnavailable(Exception):
+    """
+    No nameserver answered before the deadline; retry later.
+    """
+
+
+def system_nameservers():
+    """
+    Nameservers from the system resolver configuration (/etc/resolv.conf).
+    """
+    import dns.resolver
+
+    return dns.resolver.Resolver().nameservers
+
+
+def negative_ttl(response, default: float):
+    """
+    TTL of a negative answer, from the SOA record in its authority section (RFC 2308).
+
+    Args:
+        response (dns.message.Message): NXDOMAIN or NODATA response.
+        default (float): TTL when the response carries no SOA record.
+
+    Returns:
+        float: Seconds to cache the negative answer.
+    """
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return min(rrset.ttl, rrset[0].minimum)
+    return default
+
+
+class HedgedResolver:
+    """
+    Stub resolver that looks up A and AAAA records in parallel, with hedged queries and TTL-aware caching.
+
+    Each record type is first asked of one nameserver. If no answer arrives within `hedge_delay` seconds
+    (or the nameserver fails), the same query is sent to the next nameserver, and the first answer wins.
+    Answers are cached up to their TTL, NXDOMAIN and empty answers up to their SOA negative TTL, and
+    SERVFAIL for `servfail_ttl` seconds, so failing domains are not retried at full cost.
+    """
+
+    def __init__(self, nameservers=None, hedge_delay: float = DNS_HEDGE_DELAY_SECONDS,
+                 timeout: float = DNS_TIMEOUT_SECONDS, negative_ttl: float = DNS_NEGATIVE_TTL_SECONDS,
+                 servfail_ttl: float = DNS_SERVFAIL_TTL_SECONDS, max_ttl: float = DNS_MAX_TTL_SECONDS,
+                 cache_size: int = DNS_CACHE_SIZE, port: int = 53):
+        import dns.query
+
+        self._query = dns.query.udp_with_fallback
+        self.nameservers = list(nameservers or DNS_NAMESERVERS or system_nameservers())
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self.servfail_ttl = servfail_ttl
+        self.max_ttl = max_ttl
+        self.cache_size = cache_size
+        self.port = port
+        self.counters = Counter()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="dns")
+
+    def resolve(self, domain: str):
+        """
+        Resolve a domain to all its IPv4 and IPv6 addresses.
+
+        Args:
+            domain (str): Domain name.
+
+        Returns:
+            list[str]: IPv4 addresses followed by IPv6 addresses.
+
+        Raises:
+            DnsResolutionError: If the domain does not resolve.
+            DnsUnavailable: If no nameserver answered in time.
+        """
+        try:
+            name = dns.name.from_text(domain)
+        except dns.exception.DNSException as e:
+            raise DnsResolutionError(f"Invalid domain {domain}: {e}")
+
+        results = {}
+        missing = []
+        for rdtype in ADDRESS_TYPES:
+            cached = self._cached(name, rdtype)
+            if cached is None:
+                missing.append(rdtype)
+            else:
+                results[rdtype] = cached
+        if missing:
+            results.update(self._lookup(name, missing))
+
+        addresses = [
+            address for rdtype in ADDRESS_TYPES if isinstance(results[rdtype], list) for address in results[rdtype]
+        ]
+        if addresses:
+            return addresses
+        outcomes = {result for result in results.values() if not isinstance(result, list)}
+        if TIMEOUT in outcomes:
+            raise DnsUnavailable(f"No nameserver answered for {domain}")
+        raise DnsResolutionError(f"{domain}: {', '.join(sorted(outcomes)) or 'no address records'}")
+
+    def _cached(self, name, rdtype):
+        with self._lock:
+            entry = self._cache.get((name, rdtype))
+            if entry is None:
+                self.counters["cache_misses"] += 1
+                return None
+            expires, result = entry
+            if expires <= time.monotonic():
+                del self._cache[(name, rdtype)]
+                self.counters["cache_misses"] += 1
+                return None
+            self._cache.move_to_end((name, rdtype))
+            self.counters["negative_hits" if not isinstance(result, list) or not result else "cache_hits"] += 1
+            return result
+
+    def _store(self, name, rdtype, result, ttl: float):
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._cache[(name, rdtype)] = (time.monotonic() + ttl, result)
+            self._cache.move_to_end((name, rdtype))
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _send(self, query, nameserver: str):
+        response, _ = self._query(query, nameserver, timeout=self.timeout, port=self.port)
+        return response
+
+    def _lookup(self, name, rdtypes):
+        """
+        Query the record types in parallel, hedging each across the nameservers.
+
+        Returns:
+            dict: Per record type, the list of addresses, or NXDOMAIN, SERVFAIL or TIMEOUT.
+        """
+        deadline = time.monotonic() + self.timeout
+        queries = {rdtype: dns.message.make_query(name, rdtype) for rdtype in rdtypes}
+        sent = {rdtype: 0 for rdtype in rdtypes}
+        last_sent = {}
+        running = {}
+        results = {}
+
+        def send(rdtype):
+            nameserver = self.nameservers[sent[rdtype]]
+            sent[rdtype] += 1
+            last_sent[rdtype] = time.monotonic()
+            running[self._pool.submit(self._send, queries[rdtype], nameserver)] = rdtype
+            with self._lock:
+                self.counters["queries"] += 1
+                if sent[rdtype] > 1:
+                    self.counters["hedged_queries"] += 1
+
+        for rdtype in rdtypes:
+            send(rdtype)
+
+        while len(results) < len(rdtypes):
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            next_hedge = min(
+                (last_sent[rdtype] + self.hedge_delay for rdtype in rdtypes
+                 if rdtype not in results and sent[rdtype] < len(self.nameservers)),
+                default=deadline,
+            )
+            done, _ = wait(list(running), timeout=max(0.0, min(next_hedge, deadline) - now),
+                           return_when=FIRST_COMPLETED)
+
+            for future in done:
+                rdtype = running.pop(future)
+                if rdtype in results:
+                    continue
+                result, ttl = self._outcome(future, name, rdtype)
+                if result in (SERVFAIL, TIMEOUT):
+                    if sent[rdtype] < len(self.nameservers):
+                        # Do not wait for the hedge delay, this nameserver is not going to answer.
+                        send(rdtype)
+                        continue
+                    if rdtype in running.values():
+                        continue
+                results[rdtype] = result
+                if result == SERVFAIL:
+                    self._store(name, rdtype, result, self.servfail_ttl)
+                elif result != TIMEOUT:
+                    self._store(name, rdtype, result, ttl)
+
+            now = time.monotonic()
+            for rdtype in rdtypes:
+                if (rdtype not in results and sent[rdtype] < len(self.nameservers)
+                        and now - last_sent[rdtype] >= self.hedge_delay):
+                    send(rdtype)
+
+        for future in running:
+            future.cancel()
+        for rdtype in rdtypes:
+            results.setdefault(rdtype, TIMEOUT)
+        return results
+
+    def _outcome(self, future, name, rdtype):
+        """
+        Interpret the outcome of one query: network failures count as TIMEOUT, so the nameserver is retried
+        later, and malformed responses as SERVFAIL. Anything else is a bug, logged and counted as SERVFAIL so
+        the request fails instead of being retried forever.
+
+        Returns:
+            tuple: The addresses (or NXDOMAIN, SERVFAIL or TIMEOUT), and the TTL to cache them for.
+        """
+        try:
+            return self._answer(future.result(), rdtype)
+        except (dns.exception.Timeout, OSError, EOFError):
+            return TIMEOUT, None
+        except dns.exception.DNSException as e:
+            with self._lock:
+                self.counters["malformed_responses"] += 1
+            logging.warning(f"Malformed DNS response for {name} {dns.rdatatype.to_text(rdtype)}: {e}")
+            return SERVFAIL, None
+        except Exception:
+            logging.exception(f"Unexpected error resolving {name} {dns.rdatatype.to_text(rdtype)}")
+            return SERVFAIL, None
+
+    def _answer(self, response, rdtype):
+        """
+        Interpret a response.
+
+        Returns:
+            tuple: The addresses (or NXDOMAIN or SERVFAIL), and the TTL to cache them for (None for SERVFAIL).
+        """
+        rcode = response.rcode()
+        if rcode == dns.rcode.NXDOMAIN:
+            return NXDOMAIN, negative_ttl(response, self.negative_ttl)
+        if rcode != dns.rcode.NOERROR:
+            return SERVFAIL, None
+
+        addresses = []
+        ttl = None
+        for rrset in response.answer:
+            # The answer may start with a CNAME chain, its TTLs bound the TTL of the addresses too.
+            ttl = rrset.ttl if ttl is None else min(ttl, rrset.ttl)
+            if rrset.rdtype == rdtype:
+                addresses += [rdata.address for rdata in rrset]
+        if not addresses:
+            return [], negative_ttl(response, self.negative_ttl)
+        return addresses, ttl
+
+    def stats(self):
+        """
+        Get the resolver counters.
+
+        Returns:
+            dict: Cache hits and misses, negative cache hits, queries and hedged queries sent, cache size.
+        """
+        with self._lock:
+            return {**self.counters, "cached": len(self._cache), "nameservers": self.nameservers}
@@ -1,132 +1,404 @@
 import logging
-import socket
+from datetime import datetime
+from functools import cache
 
-import requests
-from fastapi import FastAPI
-from sqlalchemy.exc import InvalidRequestError
-from sqlalchemy.orm import Session
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+from fastapi import FastAPI, HTTPException
 
-from geolocation_app.utils.db_handler import GeolocationRequestModel, get_db
-from geolocation_app.utils.status import GeolocationStatus
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] - %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("geolocation_resolve_app.log"),
-    ],
+from geolocation_app.resolution_app.delivery import CallbackDeliveryWorker
+from geolocation_app.resolution_app.dns_resolver import DnsResolutionError, DnsUnavailable, HedgedResolver
+from geolocation_app.resolution_app.refresh import RefreshQueue
+from geolocation_app.resolution_app.scanner import PendingScanner
+from geolocation_app.resolution_app.upstream import GeoUpstreamClient, UpstreamUnavailable
+from geolocation_app.resolution_app.writer import ResolutionResult, ResultWriter
+from geolocation_app.utils.consts import (
+    CALLBACKS_ENABLED,
+    HEAVY_HITTERS_ENABLED,
+    LATENCY_DEFAULT_WINDOW,
+    LATENCY_RETENTION_MINUTES,
+    MAINTENANCE_INTERVAL_MINUTES,
+    REFRESH_ENABLED,
+    RETENTION_ENABLED,
+    RETENTION_INTERVAL_MINUTES,
 )
+from geolocation_app.utils.countries import country_code
+from geolocation_app.utils.db_handler import get_db
+from geolocation_app.utils.geo_rollup import backfill_geo_rollups, prune_geo_rollups
+from geolocation_app.utils.heavy_hitters import HeavyHitterTracker
+from geolocation_app.utils.ip_index import backfill_server_addresses
+from geolocation_app.utils.latency import CLAIMED, CREATED, DNS_DONE, GEO_DONE, LatencyHistograms
+from geolocation_app.utils.location_index import backfill_location_index
+from geolocation_app.utils.logging_setup import log_context, use_structured_logging
+from geolocation_app.utils.popularity_buckets import SERVER, parse_window, rollup_buckets
+from geolocation_app.utils.retention import archive_old_requests, compact_database, expire_segments
+from geolocation_app.utils.startup import report_startup_time
+from geolocation_app.utils.status import GeolocationStatus
 
 app = FastAPI()
 
-# Set up a background scheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
+_scheduler = None
+
+
+def get_scheduler():
+    """
+    Get the background scheduler, importing and starting it on first use.
+
+    Returns:
+        BackgroundScheduler: Running scheduler.
+    """
+    global _scheduler
+    if _scheduler is None:
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        _scheduler = BackgroundScheduler()
+        _scheduler.start()
+    return _scheduler
+
+
+@cache
+def get_upstream():
+    """
+    Get the upstream geolocation client, created on first use.
+    """
+    return GeoUpstreamClient()
+
+
+@cache
+def get_dns_resolver():
+    """
+    Get the DNS resolver, created on first use.
+    """
+    return HedgedResolver()
+
+
+@cache
+def get_server_heavy_hitters():
+    """
+    Get the server heavy-hitters tracker, loaded from its checkpoint on first use.
+    """
+    return HeavyHitterTracker(SERVER) if HEAVY_HITTERS_ENABLED else None
+
+
+@cache
+def get_latency():
+    """
+    Get the rolling latency histograms of the request lifecycle stages.
+    """
+    return LatencyHistograms()
+
+
+@cache
+def get_delivery():
+    """
+    Get the completion callback delivery worker, started on first use.
+    """
+    return CallbackDeliveryWorker().start() if CALLBACKS_ENABLED else None
+
+
+@cache
+def get_writer():
+    """
+    Get the result writer, started on first use.
+    """
+    server_heavy_hitters = get_server_heavy_hitters()
+    latency = get_latency()
+    delivery = get_delivery()
+
+    def on_flush(batch):
+        if server_heavy_hitters:
+            server_heavy_hitters.add(server for result in batch if not result.refresh for server in result.servers)
+        for result in batch:
+            latency.record(result.timings)
+        if delivery:
+            delivery.wake()
 
+    def on_done(batch):
+        get_scanner().release(result.request_id for result in batch)
 
-def resolve_geolocation(db: Session, request_id: str, domain: str):
+    return ResultWriter(on_flush=on_flush, on_done=on_done).start()
+
+
+@cache
+def get_scanner():
     """
-    Resolve geolocation information for a given domain and update the database.
+    Get the scanner that feeds pending requests, and stale ones to refresh, to `resolve_geolocation`.
+    """
+    return PendingScanner(resolve_geolocation, refresh=RefreshQueue() if REFRESH_ENABLED else None)
+
+
+def resolve_geolocation(request_id: str, domain: str, refresh: bool = False, created_at: datetime = None):
+    """
+    Resolve geolocation information for a given domain and hand the result to the writer.
+
+    If DNS or the upstream is unavailable the request is left as it was (Pending, or its current
+    version for a refresh), to be retried later. Records logged meanwhile carry the request ID.
 
     Args:
-        db (Session): SQLAlchemy database session.
         request_id (str): Unique ID of the geolocation request.
         domain (str): Domain for which geolocation is to be resolved.
+        refresh (bool): Whether this re-resolves an already resolved request, as a new version.
+        created_at (datetime): Creation time of the request, None for a refresh.
+
+    Returns:
+        bool: Whether a result was handed to the writer.
     """
+    with log_context(request_id):
+        return _resolve_geolocation(request_id, domain, refresh, created_at)
+
+
+def _resolve_geolocation(request_id: str, domain: str, refresh: bool, created_at: datetime):
     locations = set()
+    location_keys = set()
     servers = set()
+    server_locations = set()
+    timings = {CREATED: created_at, CLAIMED: datetime.utcnow()}
 
     try:
-        ip_addresses = socket.gethostbyname_ex(domain)[2]
+        ip_addresses = get_dns_resolver().resolve(domain)
+    except DnsResolutionError as e:
+        logging.error(f"Unable to resolve the domain: {e}")
+        timings[DNS_DONE] = datetime.utcnow()
+        get_writer().submit(
+            ResolutionResult(request_id, domain, GeolocationStatus.ERROR, refresh=refresh, timings=timings)
+        )
+        return True
+    except DnsUnavailable as e:
+        logging.warning(f"Leaving request {request_id} as is, DNS unavailable: {e}")
+        return False
+    timings[DNS_DONE] = datetime.utcnow()
 
-        for ip_address in ip_addresses:
-            try:
-                response = requests.get(f"http://ip-api.com/json/{ip_address}")
-                data = response.json()
+    for ip_address in ip_addresses:
+        try:
+            data = get_upstream().lookup(ip_address)
 
-                # Get location information
-                country = data.get('country', 'N/A')
-                region = data.get('regionName', 'N/A')
-                locations.add(f"{country}/{region}")
-                servers.add(ip_address)
+            # Get location information
+            country = data.get('country', 'N/A')
+            region = data.get('regionName', 'N/A')
+            locations.add(f"{country}/{region}")
+            servers.add(ip_address)
 
-            except Exception as e:
-                logging.error(f"Error getting location for IP {ip_address}: {e}")
+            code = data.get('countryCode') or country_code(country)
+            if code:
+                location_keys.add((code, region))
+                server_locations.add((ip_address, code, region))
 
-        status = GeolocationStatus.RESOLVED if locations else GeolocationStatus.ERROR
+        except UpstreamUnavailable as e:
+            logging.warning(f"Leaving request {request_id} as is, upstream unavailable: {e}")
+            return False
+        except Exception as e:
+            logging.error(f"Error getting location for IP {ip_address}: {e}")
 
-        try:
-            with db.begin_nested():
-                db.query(GeolocationRequestModel).filter(GeolocationRequestModel.id == request_id).update(
-                    {"status": status, "locations": ", ".join(locations), "servers": str(list(servers))}
-                )
-
-                if db.is_active:
-                    db.commit()
-        except InvalidRequestError:
-            logging.warning("Transaction already in progress. Skipping update.")
-
-    except socket.gaierror:
-        logging.error(f"Unable to resolve the domain: {domain}")
-        db.query(GeolocationRequestModel).filter(GeolocationRequestModel.id == request_id).update(
-            {"status": GeolocationStatus.ERROR}
+    timings[GEO_DONE] = datetime.utcnow()
+    status = GeolocationStatus.RESOLVED if locations else GeolocationStatus.ERROR
+    get_writer().submit(
+        ResolutionResult(
+            request_id, domain, status, sorted(locations), sorted(location_keys), sorted(servers), refresh, timings,
+            sorted(server_locations),
         )
+    )
+    return True
+
+
+def rollup_popularity_buckets():
+    """
+    Roll up old popularity buckets into coarser ones and prune expired buckets.
+    """
+    db = next(get_db())
+    try:
+        rollup_buckets(db)
+    finally:
+        db.close()
+
+
+def prune_rollups():
+    """
+    Delete the daily geographic rollup slices older than their retention period.
+    """
+    db = next(get_db())
+    try:
+        pruned = prune_geo_rollups(db)
+        if pruned:
+            logging.info(f"Pruned {pruned} daily geographic rollup slices.")
     finally:
-        db.commit()
+        db.close()
 
 
-def process_pending_requests_closure():
+def backfill_indexes():
     """
-       Closure to create a function to process pending geolocation requests.
-       """
-    def process_pending_requests(db: Session = next(get_db())):
-        """
-        Process pending geolocation requests from the database.
+    Index the servers and locations of requests resolved before the indexes existed, and build the
+    geographic rollups unless their backfill already completed.
+    """
+    db = next(get_db())
+    try:
+        indexed = backfill_server_addresses(db)
+        if indexed:
+            logging.info(f"Indexed server addresses of {indexed} previously resolved requests.")
+        indexed = backfill_location_index(db)
+        if indexed:
+            logging.info(f"Indexed locations of {indexed} previously resolved requests.")
+        indexed = backfill_geo_rollups(db)
+        if indexed:
+            logging.info(f"Built the geographic rollups of {indexed} previously resolved requests.")
+    finally:
+        db.close()
 
-        Args:
-            db (Session): SQLAlchemy database session.
-        """
-        pending_requests = (
-            db.query(GeolocationRequestModel)
-            .filter(GeolocationRequestModel.status == GeolocationStatus.PENDING)
-            .all()
-        )
 
-        # Process each pending request in the background
-        for request in pending_requests:
-            scheduler.add_job(
-                resolve_geolocation,
-                args=[db, request.id, request.domain],
-                id=request.id,
-                misfire_grace_time=60,  # Allow jobs to be delayed by at most 60 seconds
-            )
-            logging.info(f"Scheduled resolution for request ID {request.id}")
+def archive_requests():
+    """
+    Archive the requests older than the retention period, and delete the expired archive segments.
+    """
+    db = next(get_db())
+    try:
+        archived = archive_old_requests(db)
+        if archived:
+            logging.info(f"Archived {archived} requests older than the retention period.")
+        expired = expire_segments(db)
+        if expired:
+            logging.info(f"Deleted the expired archive segments {', '.join(expired)}.")
+    finally:
+        db.close()
 
-    return process_pending_requests
+
+def compact():
+    """
+    Return the pages freed by archiving to the file system and refresh the planner statistics.
+    """
+    db = next(get_db())
+    try:
+        freed = compact_database(db)
+        logging.info(f"Compacted the database, {freed} pages freed.")
+    finally:
+        db.close()
 
 
 def startup_event():
     """
-     Schedule background task to process pending geolocation requests on startup.
+     Start processing pending geolocation requests and schedule the maintenance tasks on startup.
      """
-    trigger = IntervalTrigger(minutes=1)
-    scheduler.add_job(process_pending_requests_closure(), trigger)
-    logging.info("Scheduled background task to process pending geolocation requests.")
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    get_scanner().start()
+    logging.info("Started processing pending geolocation requests.")
+    scheduler = get_scheduler()
+    scheduler.add_job(rollup_popularity_buckets, IntervalTrigger(minutes=5))
+    logging.info("Scheduled background task to roll up popularity buckets.")
+    scheduler.add_job(backfill_indexes)
+    scheduler.add_job(prune_rollups, IntervalTrigger(minutes=60))
+    if RETENTION_ENABLED:
+        scheduler.add_job(archive_requests, IntervalTrigger(minutes=RETENTION_INTERVAL_MINUTES))
+        logging.info("Scheduled background task to archive old requests.")
+    scheduler.add_job(compact, IntervalTrigger(minutes=MAINTENANCE_INTERVAL_MINUTES))
 
 
 def shutdown_event():
     """
      Shut down the background scheduler on shutdown.
      """
-    scheduler.shutdown()
-    logging.info("Shutting down the background scheduler.")
+    if _scheduler is not None:
+        _scheduler.shutdown()
+        logging.info("Shutting down the background scheduler.")
+    get_scanner().stop()
+    get_writer().stop()
+    delivery = get_delivery()
+    if delivery:
+        delivery.stop()
+    server_heavy_hitters = get_server_heavy_hitters()
+    if server_heavy_hitters:
+        server_heavy_hitters.close()
+
+
+@app.get("/upstream/stats", response_model=dict)
+async def get_upstream_stats():
+    """
+    Get the state of the upstream geolocation client.
+
+    Returns:
+        dict: Concurrency limit, calls in flight, circuit state and rate-limit wait.
+    """
+    return get_upstream().stats()
+
+
+@app.get("/scanner/stats", response_model=dict)
+async def get_scanner_stats():
+    """
+    Get the counters of the pending-request scanner.
+
+    Returns:
+        dict: Requests in the window, fetched and processed so far, and the scan cursor.
+    """
+    return get_scanner().stats()
+
+
+@app.get("/dns/stats", response_model=dict)
+async def get_dns_stats():
+    """
+    Get the counters of the DNS resolver.
+
+    Returns:
+        dict: Cache hits and misses, negative cache hits, queries and hedged queries sent, cache size.
+    """
+    return get_dns_resolver().stats()
+
+
+@app.get("/latency", response_model=dict)
+async def get_latency_stats(window: str = LATENCY_DEFAULT_WINDOW, percentiles: str = "50,90,99"):
+    """
+    Get the latency of each request lifecycle stage over a trailing window.
+
+    Stages are queue (created to claimed by a worker), dns, geo (upstream lookups), write (to persisted)
+    and end_to_end (created to persisted). Refreshes have no queue or end_to_end time.
+
+    Args:
+        window (str): Window such as "5m", "1h" or "day", at most the histogram retention.
+        percentiles (str): Comma-separated percentiles to report.
+
+    Returns:
+        dict: Per stage, the request count, mean, percentiles and maximum in milliseconds.
+    """
+    try:
+        length = parse_window(window)
+        wanted = [float(percentile) for percentile in percentiles.split(",")]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if length.total_seconds() > LATENCY_RETENTION_MINUTES * 60:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Window {window} is longer than the latency retention of {LATENCY_RETENTION_MINUTES} minutes",
+        )
+    if any(not 0 < percentile <= 100 for percentile in wanted):
+        raise HTTPException(status_code=400, detail="Percentiles must be in (0, 100]")
+
+    return {"window_seconds": length.total_seconds(), "stages": get_latency().summary(length, wanted)}
+
+
+@app.get("/callbacks/stats", response_model=dict)
+async def get_callback_stats():
+    """
+    Get the counters of the completion callback delivery.
+
+    Returns:
+        dict: Delivered notifications, failed and given-up attempts, batches sent and the outbox backlog.
+    """
+    delivery = get_delivery()
+    if delivery is None:
+        raise HTTPException(status_code=404, detail="Completion callbacks are disabled")
+    return delivery.stats()
+
+
+@app.get("/writer/stats", response_model=dict)
+async def get_writer_stats():
+    """
+    Get the counters of the result writer.
+
+    Returns:
+        dict: Queued results, flushed batches and flushed results.
+    """
+    return get_writer().stats()
 
 
+use_structured_logging(app, "geolocation_resolve_app")
 app.add_event_handler("startup", startup_event)
 app.add_event_handler("shutdown", shutdown_event)
+report_startup_time(app, "resolution_app")
 
 
 if __name__ == "__main__":
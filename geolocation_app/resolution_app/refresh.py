@@ -0,0 +1,139 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from geolocation_app.utils.consts import (
+    REFRESH_CANDIDATES,
+    REFRESH_MIN_AGE_HOURS,
+    REFRESH_POPULARITY_WINDOW,
+    REFRESH_RELOAD_SECONDS,
+    RETENTION_DAYS,
+    RETENTION_ENABLED,
+)
+from geolocation_app.utils.db_handler import GeolocationRequestModel, get_session
+from geolocation_app.utils.popularity_buckets import DOMAIN, most_popular, parse_window
+from geolocation_app.utils.status import GeolocationStatus
+
+
+def refresh_priority(staleness: timedelta, hits: int):
+    """
+    Priority of re-resolving a domain: how stale it is, weighted by how often it is asked for.
+
+    Args:
+        staleness (timedelta): Time since the domain was last resolved.
+        hits (int): Requests for the domain over the popularity window.
+
+    Returns:
+        float: Priority, higher first.
+    """
+    return staleness.total_seconds() * (1 + hits)
+
+
+def stale_candidates(db, now: datetime, min_age: timedelta, window: timedelta, limit: int):
+    """
+    Find domains last resolved more than `min_age` ago worth re-resolving, highest priority first.
+
+    Each submission has its own request row, so candidates are grouped by domain: a domain is as stale as
+    its latest resolution, and only that latest request is re-resolved. Candidates are the stalest domains
+    among the most popular over `window`, plus the stalest domains overall, so unpopular domains are still
+    refreshed eventually.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        now (datetime): Current time (UTC).
+        min_age (timedelta): Domains resolved more recently than this are not refreshed.
+        window (timedelta): Popularity window.
+        limit (int): Maximum number of candidates.
+
+    Returns:
+        list[tuple[float, str, str]]: (priority, request_id, domain) triples, one per domain, highest priority
+            first.
+    """
+    hits = dict(most_popular(db, DOMAIN, window, limit, now))
+    resolved = (GeolocationRequestModel.status.in_([GeolocationStatus.RESOLVED, GeolocationStatus.ERROR]),)
+    if RETENTION_ENABLED:
+        # Requests about to be archived are not worth an upstream call.
+        resolved += (GeolocationRequestModel.created_at >= now - timedelta(days=RETENTION_DAYS - 1),)
+    # Requests written before `updated_at` existed have none, their creation time stands in for it.
+    last_resolved = func.max(func.coalesce(GeolocationRequestModel.updated_at, GeolocationRequestModel.created_at))
+    # SQLite takes the bare `id` column from the row holding the max(), i.e. the latest request of the domain.
+    latest = (
+        select(GeolocationRequestModel.id, GeolocationRequestModel.domain, last_resolved)
+        .where(*resolved)
+        .group_by(GeolocationRequestModel.domain)
+        .having(last_resolved < now - min_age)
+        .order_by(last_resolved)
+        .limit(limit)
+    )
+
+    rows = db.execute(latest).all()
+    if hits:
+        rows += db.execute(latest.where(GeolocationRequestModel.domain.in_(hits))).all()
+
+    candidates = {
+        domain: (refresh_priority(now - updated_at, hits.get(domain, 0)), request_id, domain)
+        for request_id, domain, updated_at in rows
+    }
+    return heapq.nlargest(limit, candidates.values())
+
+
+class RefreshQueue:
+    """
+    Priority queue of stale domains to re-resolve, ordered by staleness x popularity.
+
+    The queue is reloaded from the database once it is drained, at most every `reload_interval` seconds.
+    """
+
+    def __init__(self, min_age: timedelta = timedelta(hours=REFRESH_MIN_AGE_HOURS),
+                 window: timedelta = parse_window(REFRESH_POPULARITY_WINDOW), candidates: int = REFRESH_CANDIDATES,
+                 reload_interval: float = REFRESH_RELOAD_SECONDS):
+        self.min_age = min_age
+        self.window = window
+        self.candidates = candidates
+        self.reload_interval = reload_interval
+        self.loaded_at = None
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Replace the queue with the current highest-priority stale domains.
+        """
+        db = get_session()
+        try:
+            candidates = stale_candidates(db, datetime.utcnow(), self.min_age, self.window, self.candidates)
+        finally:
+            db.close()
+
+        heap = [(-priority, request_id, domain) for priority, request_id, domain in candidates]
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+            self.loaded_at = time.monotonic()
+        if heap:
+            logging.info(f"Queued {len(heap)} stale domains for refresh.")
+
+    def take(self, n: int):
+        """
+        Pop up to `n` requests to refresh, highest priority first.
+
+        Args:
+            n (int): Maximum number of requests.
+
+        Returns:
+            list[tuple[str, str]]: (request_id, domain) pairs.
+        """
+        if n <= 0:
+            return []
+        if not self._heap and (self.loaded_at is None or time.monotonic() - self.loaded_at >= self.reload_interval):
+            self.load()
+        with self._lock:
+            taken = [heapq.heappop(self._heap) for _ in range(min(n, len(self._heap)))]
+        return [(request_id, domain) for _, request_id, domain in taken]
+
+    def __len__(self):
+        return len(self._heap)
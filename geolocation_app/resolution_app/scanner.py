@@ -0,0 +1,370 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sqlalchemy import select, text, tuple_
+
+from geolocation_app.utils.consts import (
+    REFRESH_SHARE,
+    RESOLVER_PAGE_SIZE,
+    RESOLVER_POLL_SECONDS,
+    RESOLVER_RESCAN_SECONDS,
+    RESOLVER_WEIGHT_BULK,
+    RESOLVER_WEIGHT_INTERACTIVE,
+    RESOLVER_WEIGHT_REFRESH,
+    RESOLVER_WINDOW,
+    RESOLVER_WORKERS,
+)
+from geolocation_app.utils.db_handler import GeolocationRequestModel, get_session
+from geolocation_app.utils.status import GeolocationStatus, RequestPriority
+
+# Walks the distinct clients of a lane with one index seek per client instead of scanning the backlog.
+_PENDING_CLIENTS = """
+WITH RECURSIVE clients(client_id) AS (
+    SELECT MIN(client_id) FROM geolocation_requests
+    WHERE status = :status AND priority = :priority AND client_id {first} :after
+    UNION ALL
+    SELECT (
+        SELECT MIN(client_id) FROM geolocation_requests
+        WHERE status = :status AND priority = :priority AND client_id > clients.client_id
+    )
+    FROM clients WHERE clients.client_id IS NOT NULL
+)
+SELECT client_id FROM clients WHERE client_id IS NOT NULL LIMIT :limit
+"""
+_CLIENTS_FROM_START = text(_PENDING_CLIENTS.format(first=">="))
+_CLIENTS_AFTER = text(_PENDING_CLIENTS.format(first=">"))
+
+
+def pending_clients(db, priority: str, after: str = None, limit: int = RESOLVER_PAGE_SIZE):
+    """
+    List the clients with Pending requests in a lane, in client order.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        priority (str): Lane of the requests.
+        after (str, optional): Only list clients after this one.
+        limit (int): Maximum number of clients.
+
+    Returns:
+        list[str]: Client keys.
+    """
+    query = _CLIENTS_FROM_START if after is None else _CLIENTS_AFTER
+    params = {"status": GeolocationStatus.PENDING.value, "priority": priority, "after": after or "", "limit": limit}
+    return db.execute(query, params).scalars().all()
+
+
+def next_pending_page(db, priority: str, client: str, cursor, limit: int):
+    """
+    Fetch the next page of a client's Pending requests in a lane, in (created_at, id) order.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        priority (str): Lane of the requests.
+        client (str): Client key.
+        cursor (tuple | None): (created_at, id) of the last request already seen, or None to start from the oldest.
+        limit (int): Maximum number of requests to return.
+
+    Returns:
+        list[Row]: Rows of (id, domain, created_at).
+    """
+    query = (
+        select(GeolocationRequestModel.id, GeolocationRequestModel.domain, GeolocationRequestModel.created_at)
+        .where(
+            GeolocationRequestModel.status == GeolocationStatus.PENDING,
+            GeolocationRequestModel.priority == priority,
+            GeolocationRequestModel.client_id == client,
+        )
+        .order_by(GeolocationRequestModel.created_at, GeolocationRequestModel.id)
+        .limit(limit)
+    )
+    if cursor is not None:
+        query = query.where(tuple_(GeolocationRequestModel.created_at, GeolocationRequestModel.id) > tuple_(*cursor))
+    return db.execute(query).all()
+
+
+class Lane:
+    """
+    Requests of one priority class waiting for a worker, served round-robin across clients.
+    """
+
+    def __init__(self, name: str, weight: float, window: int, limit: int = None):
+        self.name = name
+        self.weight = weight
+        self.window = window
+        self.limit = limit
+        self.running = 0
+        self.dispatched = 0
+        # Virtual finish time of the lane's last dispatch, for weighted fair scheduling across lanes.
+        self.finish = 0.0
+        self.size = 0
+        self._clients = OrderedDict()
+        # Keyset state of the Pending scan: per-client cursors and the client to continue after.
+        self.cursors = {}
+        self.last_client = None
+        self.pass_started = time.monotonic()
+        self.idle_until = 0.0
+
+    @property
+    def in_flight(self):
+        return self.size + self.running
+
+    @property
+    def ready(self):
+        return self.size > 0 and (self.limit is None or self.running < self.limit)
+
+    def push(self, client: str, item):
+        self._clients.setdefault(client, deque()).append(item)
+        self.size += 1
+
+    def pop(self):
+        client, items = next(iter(self._clients.items()))
+        item = items.popleft()
+        del self._clients[client]
+        if items:
+            self._clients[client] = items
+        self.size -= 1
+        return item
+
+    def clear(self):
+        items = [item for items in self._clients.values() for item in items]
+        self._clients.clear()
+        self.size = 0
+        return items
+
+    def stats(self):
+        return {
+            "weight": self.weight,
+            "queued": self.size,
+            "running": self.running,
+            "clients": len(self._clients),
+            "dispatched": self.dispatched,
+        }
+
+
+class PendingScanner:
+    """
+    Feeds Pending requests, and optionally stale requests to refresh, to a fixed pool of worker threads.
+
+    Requests are split into priority lanes (interactive, bulk and refresh). Workers pick the next lane
+    by weighted fair queueing on the lane weights, and within a lane serve clients round-robin, so an
+    interactive request does not queue behind a bulk load and a large bulk client does not starve a small one.
+
+    A feeder thread fills each Pending lane up to its window with keyset pagination, fetching only ids and
+    domains, an equal share of the free room per client, so memory stays flat whatever the size of the
+    backlog. Once a lane has caught up it is polled for new requests every `poll_interval` seconds, and at
+    most every `rescan_interval` seconds its scan restarts from the oldest request, so requests left Pending
+    are retried.
+
+    Refresh work is taken from `refresh` (a RefreshQueue) and may occupy at most `refresh_share` of the
+    workers, so refreshes never exceed a fixed share of the upstream budget.
+
+    `resolve` is called as resolve(request_id, domain, refresh, created_at), created_at being None for refreshes.
+    It returns whether it handed a result to the writer; such a request stays in flight, and is not fetched
+    again while it is still Pending in the database, until the writer reports it done with `release`.
+    """
+
+    def __init__(self, resolve, workers: int = RESOLVER_WORKERS, window: int = RESOLVER_WINDOW,
+                 page_size: int = RESOLVER_PAGE_SIZE, poll_interval: float = RESOLVER_POLL_SECONDS,
+                 rescan_interval: float = RESOLVER_RESCAN_SECONDS, refresh=None, refresh_share: float = REFRESH_SHARE):
+        self.resolve = resolve
+        self.page_size = min(page_size, window)
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.refresh = refresh
+        self.fetched = 0
+        self.processed = 0
+        self.refreshed = 0
+        self.lanes = {
+            RequestPriority.INTERACTIVE: Lane(RequestPriority.INTERACTIVE, RESOLVER_WEIGHT_INTERACTIVE, window),
+            RequestPriority.BULK: Lane(RequestPriority.BULK, RESOLVER_WEIGHT_BULK, window),
+        }
+        if refresh is not None:
+            slots = math.ceil(workers * refresh_share)
+            self.lanes[RequestPriority.REFRESH] = Lane(RequestPriority.REFRESH, RESOLVER_WEIGHT_REFRESH, 2 * slots, slots)
+        self._virtual_time = 0.0
+        self._in_flight = {}
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._feeder = threading.Thread(target=self._feed, name="pending-scanner", daemon=True)
+        self._workers = [
+            threading.Thread(target=self._work, name=f"resolver-{i}", daemon=True) for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in [self._feeder, *self._workers]:
+            thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Stop fetching, drop the requests not started yet (they stay as they are) and wait for the workers.
+        """
+        self._stopped.set()
+        with self._condition:
+            for lane in self.lanes.values():
+                for request_id, _ in lane.clear():
+                    self._in_flight.pop(request_id, None)
+            self._condition.notify_all()
+
+        deadline = time.monotonic() + timeout
+        for thread in [self._feeder, *self._workers]:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _enqueue(self, lane: Lane, client: str, request_id: str, domain: str, created_at=None):
+        """
+        Queue a request on a lane, unless it is already in flight. The caller holds the condition.
+        """
+        if request_id in self._in_flight:
+            return
+        if not lane.in_flight:
+            # A lane that was idle starts at the current virtual time instead of spending saved-up credit.
+            lane.finish = max(lane.finish, self._virtual_time)
+        self._in_flight[request_id] = lane
+        lane.push(client, (request_id, domain, created_at))
+
+    def _due(self, lane: Lane):
+        if lane.name == RequestPriority.REFRESH:
+            return lane.in_flight < lane.window and time.monotonic() >= lane.idle_until
+        return lane.in_flight <= lane.window - self.page_size and time.monotonic() >= lane.idle_until
+
+    def _fill(self, lane: Lane):
+        """
+        Fetch Pending requests of a lane into its free room, sharing the room equally between its clients.
+        """
+        room = lane.window - lane.in_flight
+        db = get_session()
+        try:
+            clients = pending_clients(db, lane.name, lane.last_client, self.page_size)
+            if len(clients) < self.page_size and lane.last_client is not None:
+                # Wrap around to the first clients.
+                clients += [
+                    client for client in pending_clients(db, lane.name, None, self.page_size - len(clients))
+                    if client not in clients
+                ]
+            quota = max(1, room // max(1, len(clients)))
+            pages = [
+                (client, next_pending_page(db, lane.name, client, lane.cursors.get(client), quota))
+                for client in clients
+            ]
+        finally:
+            db.close()
+
+        with self._condition:
+            for client, rows in pages:
+                for request_id, domain, created_at in rows:
+                    self._enqueue(lane, client, request_id, domain, created_at)
+                if rows:
+                    lane.cursors[client] = (rows[-1].created_at, rows[-1].id)
+            self._condition.notify_all()
+        self.fetched += sum(len(rows) for _, rows in pages)
+        lane.last_client = clients[-1] if clients else None
+
+        if all(len(rows) < quota for _, rows in pages):
+            # Caught up with the backlog of the lane.
+            if time.monotonic() - lane.pass_started >= self.rescan_interval:
+                lane.cursors.clear()
+                lane.pass_started = time.monotonic()
+            lane.idle_until = time.monotonic() + self.poll_interval
+
+    def _fill_refreshes(self, lane: Lane):
+        wanted = lane.window - lane.in_flight
+        items = self.refresh.take(wanted)
+        with self._condition:
+            for request_id, domain in items:
+                self._enqueue(lane, "", request_id, domain)
+            self._condition.notify_all()
+        if len(items) < wanted:
+            lane.idle_until = time.monotonic() + self.poll_interval
+
+    def _feed(self):
+        while not self._stopped.is_set():
+            for lane in list(self.lanes.values()):
+                if self._stopped.is_set() or not self._due(lane):
+                    continue
+                try:
+                    if lane.name == RequestPriority.REFRESH:
+                        self._fill_refreshes(lane)
+                    else:
+                        self._fill(lane)
+                except Exception as e:
+                    logging.error(f"Failed to fetch {lane.name.value} requests: {e}")
+                    lane.idle_until = time.monotonic() + self.poll_interval
+
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopped.is_set() or any(self._due(lane) for lane in self.lanes.values()),
+                    timeout=self.poll_interval,
+                )
+
+    def _next(self):
+        """
+        Take the next request from the ready lane with the earliest virtual finish time, which gives each
+        lane a share of the dispatches proportional to its weight while several lanes have work.
+        """
+        with self._condition:
+            while not self._stopped.is_set():
+                ready = [lane for lane in self.lanes.values() if lane.ready]
+                if ready:
+                    lane = min(ready, key=lambda lane: lane.finish + 1 / lane.weight)
+                    lane.finish += 1 / lane.weight
+                    self._virtual_time = lane.finish
+                    lane.running += 1
+                    lane.dispatched += 1
+                    return lane, lane.pop()
+                self._condition.wait()
+        return None, None
+
+    def _work(self):
+        while True:
+            lane, item = self._next()
+            if lane is None:
+                return
+            request_id, domain, created_at = item
+            refresh = lane.name == RequestPriority.REFRESH
+            submitted = False
+            try:
+                submitted = self.resolve(request_id, domain, refresh, created_at)
+            except Exception as e:
+                logging.error(f"Failed to resolve request {request_id}: {e}")
+            finally:
+                with self._condition:
+                    if not submitted:
+                        self._in_flight.pop(request_id, None)
+                    lane.running -= 1
+                    if refresh:
+                        self.refreshed += 1
+                    else:
+                        self.processed += 1
+                    self._condition.notify_all()
+
+    def release(self, request_ids):
+        """
+        Forget requests whose result the writer has written, or failed to write, so they can be fetched again.
+
+        Args:
+            request_ids (Iterable[str]): IDs of the requests.
+        """
+        with self._condition:
+            for request_id in request_ids:
+                self._in_flight.pop(request_id, None)
+
+    def stats(self):
+        """
+        Get the scanner counters.
+
+        Returns:
+            dict: Requests fetched, processed and refreshed so far, requests resolved but not written yet,
+                and the state of each lane.
+        """
+        with self._condition:
+            return {
+                "workers": len(self._workers),
+                "fetched": self.fetched,
+                "processed": self.processed,
+                "refreshed": self.refreshed,
+                "awaiting_write": len(self._in_flight) - sum(lane.in_flight for lane in self.lanes.values()),
+                "lanes": {lane.name.value: lane.stats() for lane in self.lanes.values()},
+            }
@@ -0,0 +1,269 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from geolocation_app.utils.consts import (
+    UPSTREAM_CONNECT_TIMEOUT_SECONDS,
+    UPSTREAM_DEADLINE_SECONDS,
+    UPSTREAM_GEO_URL,
+    UPSTREAM_MAX_CONCURRENCY,
+    UPSTREAM_READ_TIMEOUT_SECONDS,
+    UPSTREAM_TARGET_LATENCY_SECONDS,
+)
+
+
+class UpstreamUnavailable(Exception):
+    """
+    The upstream cannot be called right now (circuit open, throttled or deadline exceeded); retry later.
+    """
+
+
+class UpstreamError(Exception):
+    """
+    The upstream answered, but could not geolocate this address.
+    """
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit: grows by about one slot per window of fast successes, halves on errors or slow calls.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = UPSTREAM_MAX_CONCURRENCY,
+                 target_latency: float = UPSTREAM_TARGET_LATENCY_SECONDS):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float):
+        """
+        Wait for a free slot.
+
+        Args:
+            timeout (float): Maximum seconds to wait.
+
+        Returns:
+            bool: Whether a slot was acquired.
+        """
+        with self._condition:
+            acquired = self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout=max(0.0, timeout))
+            if acquired:
+                self.in_flight += 1
+            return acquired
+
+    def release(self, latency: float, overloaded: bool):
+        """
+        Free a slot and adjust the limit from the outcome of the call.
+
+        Args:
+            latency (float): Duration of the call in seconds.
+            overloaded (bool): Whether the call failed in a way that signals upstream overload.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded or latency > self.target_latency:
+                # Decrease at most once per target latency, the calls in flight saw the same overload.
+                if now - self._last_decrease > self.target_latency:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, then lets a single probe through after `reset_timeout`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check whether a call may go through.
+
+        Returns:
+            bool: False while the circuit is open, or while a half-open probe is already in flight.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # Open and cooled down, or half-open with a probe that never reported back.
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"Upstream circuit opened after {self.failures} consecutive failures")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class RateLimitGate:
+    """
+    Honors the upstream's X-Rl (requests left in the window) and X-Ttl (seconds until the window resets) headers.
+    """
+
+    def __init__(self):
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, headers, throttled: bool = False):
+        """
+        Update the gate from the headers of a response.
+
+        Args:
+            headers (Mapping[str, str]): Response headers.
+            throttled (bool): Whether the upstream answered 429.
+        """
+        try:
+            remaining = int(headers.get("X-Rl", 1))
+            ttl = int(headers.get("X-Ttl", 60 if throttled else 0))
+        except ValueError:
+            return
+        if remaining <= 0 or throttled:
+            with self._lock:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + ttl)
+
+    def wait(self, deadline: float):
+        """
+        Sleep until the rate-limit window resets.
+
+        Args:
+            deadline (float): `time.monotonic()` value after which waiting is pointless.
+
+        Raises:
+            UpstreamUnavailable: If the window resets after the deadline.
+        """
+        delay = self.blocked_until - time.monotonic()
+        if delay <= 0:
+            return
+        if time.monotonic() + delay > deadline:
+            raise UpstreamUnavailable(f"Upstream rate limit resets in {delay:.0f}s")
+        time.sleep(delay)
+
+
+class GeoUpstreamClient:
+    """
+    Client for the ip-api geolocation upstream with adaptive concurrency, rate-limit awareness,
+    a circuit breaker, and jittered retries bounded by a deadline.
+    """
+
+    def __init__(self, base_url: str = UPSTREAM_GEO_URL, deadline: float = UPSTREAM_DEADLINE_SECONDS,
+                 timeout=(UPSTREAM_CONNECT_TIMEOUT_SECONDS, UPSTREAM_READ_TIMEOUT_SECONDS),
+                 backoff_base: float = 0.2, backoff_cap: float = 5.0):
+        self.base_url = base_url
+        self.deadline = deadline
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.limiter = AdaptiveConcurrencyLimiter()
+        self.breaker = CircuitBreaker()
+        self.gate = RateLimitGate()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.limiter.maximum)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def lookup(self, ip_address: str):
+        """
+        Geolocate an IP address.
+
+        Args:
+            ip_address (str): Address to look up.
+
+        Returns:
+            dict: Upstream response, with "country", "countryCode" and "regionName" keys.
+
+        Raises:
+            UpstreamUnavailable: If the upstream is unavailable or throttling until the deadline.
+            UpstreamError: If the upstream cannot geolocate this address.
+        """
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+
+        while True:
+            if not self.breaker.allow():
+                raise UpstreamUnavailable("Upstream circuit is open")
+            self.gate.wait(deadline)
+            if not self.limiter.acquire(deadline - time.monotonic()):
+                raise UpstreamUnavailable("No upstream concurrency slot before the deadline")
+
+            started = time.monotonic()
+            response = None
+            overloaded = True
+            try:
+                response = self.session.get(f"{self.base_url}{ip_address}", timeout=self.timeout)
+                overloaded = response.status_code == 429 or response.status_code >= 500
+            except requests.RequestException as e:
+                logging.warning(f"Upstream call for {ip_address} failed: {e}")
+            finally:
+                self.limiter.release(time.monotonic() - started, overloaded)
+
+            if response is not None:
+                self.gate.update(response.headers, throttled=response.status_code == 429)
+
+            # A 429 means the upstream is healthy but throttling, the gate handles it, not the breaker.
+            if response is not None and response.status_code < 500:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+            if response is not None and not overloaded:
+                if response.status_code != 200:
+                    raise UpstreamError(f"Upstream answered {response.status_code} for {ip_address}")
+                data = response.json()
+                if data.get("status") == "fail":
+                    raise UpstreamError(f"Upstream could not locate {ip_address}: {data.get('message')}")
+                return data
+
+            attempt += 1
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            if time.monotonic() + delay >= deadline:
+                raise UpstreamUnavailable(f"Upstream lookup for {ip_address} did not succeed before the deadline")
+            time.sleep(delay)
+
+    def stats(self):
+        """
+        Get the current state of the client.
+
+        Returns:
+            dict: Concurrency limit, calls in flight, circuit state and rate-limit wait.
+        """
+        return {
+            "concurrency_limit": int(self.limiter.limit),
+            "in_flight": self.limiter.in_flight,
+            "circuit": self.breaker.state,
+            "rate_limited_for_seconds": max(0.0, round(self.gate.blocked_until - time.monotonic(), 1)),
+        }
@@ -0,0 +1,308 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Tuple
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.exc import DataError, IntegrityError, InterfaceError, OperationalError
+
+from geolocation_app.utils.callbacks import enqueue_callbacks
+from geolocation_app.utils.consts import CALLBACKS_ENABLED, WRITER_MAX_BATCH, WRITER_MAX_DELAY_SECONDS
+from geolocation_app.utils.db_handler import GeolocationRequestModel, GeolocationRequestVersionModel, get_session
+from geolocation_app.utils.geo_rollup import record_geo_rollups
+from geolocation_app.utils.ip_index import record_server_addresses
+from geolocation_app.utils.latency import CLAIMED, DNS_DONE, GEO_DONE, PERSISTED
+from geolocation_app.utils.location_index import record_locations
+from geolocation_app.utils.popularity_buckets import SERVER, record_hits
+from geolocation_app.utils.status import GeolocationStatus
+
+
+class ResolutionResult(NamedTuple):
+    request_id: str
+    domain: str
+    status: str
+    locations: List[str] = []
+    location_keys: List[Tuple[str, str]] = []
+    servers: List[str] = []
+    refresh: bool = False
+    # Lifecycle timestamps (see geolocation_app.utils.latency), `persisted` is stamped by the writer.
+    timings: Dict[str, datetime] = {}
+    # (server, alpha-2 country code, region) of each geolocated server.
+    server_locations: List[Tuple[str, str, str]] = []
+
+
+_requests = GeolocationRequestModel.__table__
+_versions = GeolocationRequestVersionModel.__table__
+_current_version = func.coalesce(_requests.c.version, 1)
+_UPDATE_REQUEST = (
+    update(_requests)
+    .where(_requests.c.id == bindparam("request_id"))
+    .values(
+        status=bindparam("status"),
+        locations=bindparam("locations"),
+        servers=bindparam("servers"),
+        updated_at=bindparam("updated_at"),
+        version=_current_version + bindparam("bump"),
+        claimed_at=bindparam("claimed_at"),
+        dns_done_at=bindparam("dns_done_at"),
+        geo_done_at=bindparam("geo_done_at"),
+        persisted_at=bindparam("updated_at"),
+    )
+)
+
+
+def archive_versions(db, request_ids):
+    """
+    Copy the current resolution of requests into the versions table, before it is replaced.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        request_ids (list[str]): Requests about to be re-resolved.
+    """
+    if not request_ids:
+        return
+    db.execute(
+        insert(_versions).prefix_with("OR IGNORE").from_select(
+            ["request_id", "version", "domain", "locations", "servers", "status", "resolved_at"],
+            select(
+                _requests.c.id, _current_version, _requests.c.domain, _requests.c.locations,
+                _requests.c.servers, _requests.c.status, _requests.c.updated_at,
+            ).where(_requests.c.id.in_(request_ids)),
+        )
+    )
+
+
+def completion_payload(result: ResolutionResult, resolved_at: datetime):
+    """
+    Body of the completion callback of a request.
+    """
+    return {
+        "request_id": result.request_id,
+        "domain": result.domain,
+        "status": result.status,
+        "locations": list(result.locations),
+        "servers": list(result.servers) if result.status == GeolocationStatus.RESOLVED else [],
+        "resolved_at": resolved_at.isoformat(),
+    }
+
+
+_STOP = object()
+
+# Errors caused by the results themselves: the batch is split to find them, and they are written as Error.
+_BAD_RESULT_ERRORS = (IntegrityError, DataError, ValueError, TypeError)
+# Errors of the database (locked, I/O, connection): the batch is written again, unchanged, after a pause.
+_TRANSIENT_ERRORS = (OperationalError, InterfaceError, OSError)
+_RETRY_DELAY_SECONDS = 0.1
+_RETRY_MAX_DELAY_SECONDS = 5.0
+
+
+def write_results(db, results):
+    """
+    Persist a batch of resolution results in one transaction.
+
+    The request rows are updated with a single executemany UPDATE, and the derived tables
+    (popularity buckets, server address and location indexes, geographic rollups) are written in bulk alongside.
+    Refreshed requests get a new version, the one they replace is kept in the versions table.
+    The lifecycle timestamps of the results are stored on their requests, and `persisted` is added to them.
+    Completion callbacks of new (not refreshed) results are queued in the outbox in the same transaction.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        results (list[ResolutionResult]): Results to persist.
+    """
+    now = datetime.utcnow()
+    archive_versions(db, [result.request_id for result in results if result.refresh])
+    db.execute(_UPDATE_REQUEST, [
+        {
+            "request_id": result.request_id,
+            "status": result.status,
+            "locations": ", ".join(result.locations),
+            "servers": str(list(result.servers)) if result.status == GeolocationStatus.RESOLVED else "",
+            "updated_at": now,
+            "bump": int(result.refresh),
+            "claimed_at": result.timings.get(CLAIMED),
+            "dns_done_at": result.timings.get(DNS_DONE),
+            "geo_done_at": result.timings.get(GEO_DONE),
+        }
+        for result in results
+    ])
+
+    resolved = [result for result in results if result.status == GeolocationStatus.RESOLVED]
+    # A refresh is not a new request, so it does not count towards server popularity.
+    record_hits(db, SERVER, [server for result in resolved if not result.refresh for server in result.servers], now)
+    # A refresh that fails replaces the request's servers and locations with none, so its index rows go too.
+    indexed = resolved + [result._replace(servers=[], location_keys=[]) for result in results
+                          if result.refresh and result.status != GeolocationStatus.RESOLVED]
+    record_server_addresses(db, [(result.request_id, result.domain, result.servers) for result in indexed])
+    record_locations(db, [(result.request_id, result.domain, result.location_keys) for result in indexed])
+    record_geo_rollups(db, [(result.domain, result.location_keys, result.server_locations) for result in resolved], now)
+    if CALLBACKS_ENABLED:
+        enqueue_callbacks(db, [completion_payload(result, now) for result in results if not result.refresh], now)
+    db.commit()
+    for result in results:
+        if result.timings:
+            result.timings[PERSISTED] = now
+
+
+class ResultWriter:
+    """
+    Single writer thread that group-commits resolution results.
+
+    Resolver tasks hand their results to `submit` and return immediately. The writer flushes
+    whenever `max_batch` results are waiting or the oldest waiting result is `max_delay` seconds old,
+    so the SQLite writer lock is taken once per batch instead of once per request.
+
+    `on_flush` is called with the results written by each flush, and `on_done` with every result of the
+    batch once the flush is over, whether they were written or not.
+    """
+
+    def __init__(self, max_batch: int = WRITER_MAX_BATCH, max_delay: float = WRITER_MAX_DELAY_SECONDS,
+                 on_flush=None, on_done=None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self.on_done = on_done
+        self.flushed_batches = 0
+        self.flushed_results = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, result: ResolutionResult):
+        """
+        Queue a result for the next flush.
+
+        Args:
+            result (ResolutionResult): Result to persist.
+        """
+        self._queue.put(result)
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Flush everything queued so far and stop the writer thread.
+        """
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                self._flush(batch)
+            except Exception:
+                # Keep the thread alive, otherwise `submit` would queue results that are never written.
+                logging.exception(f"Unexpected error flushing a batch of {len(batch)} resolution results")
+            if self.on_done:
+                try:
+                    self.on_done(batch)
+                except Exception:
+                    logging.exception("Failed to run the post-batch hook")
+
+    def _flush(self, batch):
+        written = self._write(batch)
+        if not written:
+            return
+
+        self.flushed_batches += 1
+        self.flushed_results += len(written)
+        if self.on_flush:
+            try:
+                self.on_flush(written)
+            except Exception:
+                logging.exception("Failed to run the post-flush hook")
+
+    def _commit(self, batch):
+        """
+        Write a batch in one transaction, waiting and trying again for as long as the database is unavailable.
+
+        Raises:
+            Exception: Any error other than a transient database error.
+        """
+        delay = _RETRY_DELAY_SECONDS
+        while True:
+            db = get_session()
+            try:
+                write_results(db, batch)
+                return
+            except _TRANSIENT_ERRORS as e:
+                db.rollback()
+                logging.warning(f"Database unavailable writing {len(batch)} resolution results, "
+                                f"retrying in {delay:.1f}s: {e}")
+            except BaseException:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+            time.sleep(delay)
+            delay = min(delay * 2, _RETRY_MAX_DELAY_SECONDS)
+
+    def _write(self, batch):
+        """
+        Write a batch, splitting it in halves on failure to isolate the results that cannot be written.
+
+        Only errors caused by the results (integrity, data, conversion) split the batch; a locked or failing
+        database is waited for instead. A result that cannot be written on its own is written as a bare Error,
+        so a deterministic failure does not send the request back to the upstream forever.
+
+        Args:
+            batch (list[ResolutionResult]): Results to persist.
+
+        Returns:
+            list[ResolutionResult]: Results written, with Error in place of the failed ones.
+        """
+        try:
+            self._commit(batch)
+            return batch
+        except _BAD_RESULT_ERRORS as e:
+            error = e
+
+        if len(batch) > 1:
+            logging.warning(f"Failed to write a batch of {len(batch)} resolution results, retrying in halves: {error}")
+            middle = len(batch) // 2
+            return self._write(batch[:middle]) + self._write(batch[middle:])
+
+        result = batch[0]
+        fallback = ResolutionResult(
+            result.request_id, result.domain, GeolocationStatus.ERROR, refresh=result.refresh, timings=result.timings
+        )
+        if result == fallback:
+            # The request keeps its current state, Pending requests are picked up again by the scanner.
+            logging.error(f"Failed to write the result of request {result.request_id}: {error}")
+            return []
+        logging.error(f"Failed to write the result of request {result.request_id}, recording it as Error: {error}")
+        return self._write([fallback])
+
+    def stats(self):
+        """
+        Get the writer counters.
+
+        Returns:
+            dict: Queued results, flushed batches and flushed results.
+        """
+        return {
+            "queued": self._queue.qsize(),
+            "flushed_batches": self.flushed_batches,
+            "flushed_results": self.flushed_results,
+        }
@@ -1,31 +1,36 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from geolocation_app.utils.consts import HOST
-from geolocation_app.utils.db_handler import GeolocationRequestModel, get_db
+from geolocation_app.utils.ip_index import domains_in_network
+from geolocation_app.utils.logging_setup import use_structured_logging
+from geolocation_app.utils.snapshot import get_read_db, use_read_snapshot
+from geolocation_app.utils.startup import report_startup_time
 
 app = FastAPI()
 
 
 @app.get("/get_domains_by_server/", response_model=list)
-async def get_domains_by_server(ip_address: str, db: Session = Depends(get_db)):
+async def get_domains_by_server(ip_address: str, db: Session = Depends(get_read_db)):
     """
-    Get domains associated with a given server IP address.
+    Get domains associated with a given server IP address or CIDR block.
 
     Args:
-        ip_address (str): IP address of the server.
+        ip_address (str): IP address of the server, or a CIDR block such as "203.0.113.0/24" or "2001:db8::/32".
         db (Session): SQLAlchemy database session.
 
     Returns:
-        list: List of domain names associated with the server.
+        list: List of domain names associated with the server(s).
     """
-    matching_domains = db.query(GeolocationRequestModel).filter(
-        GeolocationRequestModel.servers.contains(ip_address)
-    ).all()
+    try:
+        return domains_in_network(db, ip_address)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid IP address or CIDR block: {ip_address}")
 
-    domains = [domain.domain for domain in matching_domains]
 
-    return domains
+use_structured_logging(app, "server_app")
+use_read_snapshot(app)
+report_startup_time(app, "server_app")
 
 
 if __name__ == "__main__":
@@ -3,13 +3,35 @@ from sqlalchemy.orm import Session
 from starlette.responses import JSONResponse
 
 from geolocation_app.utils.consts import HOST
-from geolocation_app.utils.db_handler import GeolocationRequestModel, get_db
+from geolocation_app.utils.db_handler import GeolocationRequestModel, GeolocationRequestVersionModel, get_session
+from geolocation_app.utils.logging_setup import use_structured_logging
+from geolocation_app.utils.retention import archived_segment
+from geolocation_app.utils.snapshot import get_read_db, use_read_snapshot
+from geolocation_app.utils.startup import report_startup_time
+from geolocation_app.utils.status import GeolocationStatus
 
 app = FastAPI()
 
 
+def find_archived(request_id: str):
+    """
+    Get the archive segment of a request that is not in the database, read from the database file.
+
+    Raises:
+        HTTPException: 404 when the request was never archived either.
+    """
+    db = get_session()
+    try:
+        segment = archived_segment(db, request_id)
+    finally:
+        db.close()
+    if segment is None:
+        raise HTTPException(status_code=404, detail="Request ID not found")
+    return segment
+
+
 @app.get("/geolocation/status/{request_id}", response_model=dict)
-async def get_status(request_id: str, db: Session = Depends(get_db)):
+async def get_status(request_id: str, db: Session = Depends(get_read_db)):
     """
     Get the status and locations of a geolocation request.
 
@@ -18,13 +40,15 @@ async def get_status(request_id: str, db: Session = Depends(get_db)):
         db (Session): SQLAlchemy database session.
 
     Returns:
-        dict: Dictionary containing the status and locations of the geolocation request.
+        dict: Dictionary containing the status and locations of the geolocation request. Requests moved out by
+            retention have the Archived status, no locations and the name of their archive segment.
     """
 
     geolocation_request = db.query(GeolocationRequestModel).filter(GeolocationRequestModel.id == request_id).first()
 
     if not geolocation_request:
-        raise HTTPException(status_code=404, detail="Request ID not found")
+        segment = find_archived(request_id)
+        return JSONResponse(content={"status": GeolocationStatus.ARCHIVED, "locations": [], "archive_segment": segment})
 
     status = geolocation_request.status
     locations = geolocation_request.locations.split(", ") if geolocation_request.locations else []
@@ -33,6 +57,47 @@ async def get_status(request_id: str, db: Session = Depends(get_db)):
     return JSONResponse(content=response_data)
 
 
+@app.get("/geolocation/status/{request_id}/versions", response_model=list)
+async def get_versions(request_id: str, db: Session = Depends(get_read_db)):
+    """
+    Get the resolutions a request had before it was last refreshed, newest first.
+
+    Args:
+        request_id (str): Unique ID of the geolocation request.
+        db (Session): SQLAlchemy database session.
+
+    Returns:
+        list: Dictionaries with the version, status, locations and resolution time of each previous version.
+
+    Raises:
+        HTTPException: 404 for an unknown request, 410 for an archived one (its versions are in the segment).
+    """
+    if not db.query(GeolocationRequestModel.id).filter(GeolocationRequestModel.id == request_id).first():
+        segment = find_archived(request_id)
+        raise HTTPException(status_code=410, detail=f"Request was archived to segment {segment}")
+
+    versions = (
+        db.query(GeolocationRequestVersionModel)
+        .filter(GeolocationRequestVersionModel.request_id == request_id)
+        .order_by(GeolocationRequestVersionModel.version.desc())
+        .all()
+    )
+    return [
+        {
+            "version": version.version,
+            "status": version.status,
+            "locations": version.locations.split(", ") if version.locations else [],
+            "resolved_at": version.resolved_at.isoformat() if version.resolved_at else None,
+        }
+        for version in versions
+    ]
+
+
+use_structured_logging(app, "status_app")
+use_read_snapshot(app)
+report_startup_time(app, "status_app")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=HOST, port=8005)
@@ -3,7 +3,8 @@ from fastapi import FastAPI, HTTPException, Form
 from fastapi.responses import HTMLResponse
 
 from geolocation_app.utils import consts
-from tests import (
+from geolocation_app.utils.logging_setup import use_structured_logging
+from geolocation_app.test_app.tests import (
     test_create_geolocation_request,
     test_read_geolocation_status,
     test_get_most_popular_servers,
@@ -352,6 +353,9 @@ async def login(username: str = Form(...), password: str = Form(...)):
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
+use_structured_logging(app, "test_app")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8008)
@@ -15,13 +15,13 @@ def test_create_geolocation_request(domain):
 
         if response.status_code == status.HTTP_200_OK:
             response_data = GeolocationResponse(**response.json())
-            logging.info(f"Geolocation request created successfully. Request ID: {response_data.request_id}")
+            logging.info("Geolocation request created successfully. Request ID: %s", response_data.request_id)
             return response_data.request_id
         elif response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY:
             logging.info("Domain already exists. Test passed.")
             return None
     except requests.RequestException as e:
-        logging.error(f"Error creating geolocation request: {e}")
+        logging.error("Error creating geolocation request: %s", e)
         raise
 
 
@@ -33,13 +33,13 @@ def test_read_geolocation_status(request_id):
 
         assert response.status_code == 200
         response_data = GeolocationStatusResponseModel(**response.json())
-        logging.critical(f"Geolocation status retrieved successfully for Request ID: {request_id}, "
-                         f"Status: {response_data.status}, Locations: {response_data.locations}")
+        logging.info("Geolocation status retrieved successfully for Request ID: %s, Status: %s, Locations: %s",
+                     request_id, response_data.status, response_data.locations)
 
         return response_data.status, response_data.locations
 
     except requests.RequestException as e:
-        logging.error(f"Error retrieving geolocation status: {e}")
+        logging.error("Error retrieving geolocation status: %s", e)
         raise
 
 
@@ -50,7 +50,7 @@ def test_get_most_popular_domains(n):
 
     assert response.status_code == 200
     data = response.json()
-    logging.info(f"Most popular domains: {data}")
+    logging.info("Most popular domains: %s", data)
     assert isinstance(data, list)
     assert all("domain" in entry and "request_count" in entry for entry in data)
 
@@ -64,7 +64,7 @@ def test_get_most_popular_servers(n):
 
     assert response.status_code == 200
     data = response.json()
-    logging.info(f"Most popular servers: {data}")
+    logging.info("Most popular servers: %s", data)
     assert isinstance(data, list)
     assert all("server" in entry and "request_count" in entry for entry in data)
 
@@ -80,14 +80,14 @@ def test_get_domains_by_country(country_name):
 
         if response.status_code == status.HTTP_200_OK:
             data = response.json()
-            logging.info(f"Domains in {country_name}: {data}")
+            logging.info("Domains in %s: %s", country_name, data)
             assert isinstance(data, list)
             return data
         elif response.status_code == status.HTTP_404_NOT_FOUND:
             logging.info("Country not found. Test passed.")
             return None
     except requests.RequestException as e:
-        logging.error(f"Error getting domains by country: {e}")
+        logging.error("Error getting domains by country: %s", e)
         raise
 
 
@@ -101,9 +101,9 @@ def test_get_domains_by_server(ip_address):
 
         if response.status_code == status.HTTP_200_OK:
             data = response.json()
-            logging.info(f"Domains mapped to server {ip_address}: {data}")
+            logging.info("Domains mapped to server %s: %s", ip_address, data)
             assert isinstance(data, list)
             return data
     except requests.RequestException as e:
-        logging.error(f"Error getting domains by server: {e}")
+        logging.error("Error getting domains by server: %s", e)
         raise
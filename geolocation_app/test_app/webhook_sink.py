@@ -0,0 +1,61 @@
+import logging
+import random
+from collections import deque
+
+from fastapi import FastAPI, HTTPException, Request
+
+from geolocation_app.utils.consts import WEBHOOK_SINK_FAIL_RATE, WEBHOOK_SINK_KEEP
+from geolocation_app.utils.logging_setup import use_structured_logging
+
+app = FastAPI()
+
+# Most recent results received, and counters of the batches.
+received = deque(maxlen=WEBHOOK_SINK_KEEP)
+counters = {"batches": 0, "results": 0, "rejected": 0}
+
+
+@app.post("/callbacks", response_model=dict)
+async def receive_callbacks(request: Request):
+    """
+    Receive a batch of completion callbacks, as sent by the resolution service.
+
+    A share of the batches (GEO_WEBHOOK_SINK_FAIL_RATE) is rejected with a 503, to exercise the retries.
+
+    Args:
+        request (Request): Callback batch, {"results": [...]}.
+
+    Returns:
+        dict: Number of results accepted.
+    """
+    if random.random() < WEBHOOK_SINK_FAIL_RATE:
+        counters["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Rejected by the sink")
+
+    results = (await request.json())["results"]
+    received.extend(results)
+    counters["batches"] += 1
+    counters["results"] += len(results)
+    logging.info("Received %d completion callbacks.", len(results))
+    return {"accepted": len(results)}
+
+
+@app.get("/callbacks", response_model=dict)
+async def list_callbacks(limit: int = 100):
+    """
+    Get the most recent completion callbacks received.
+
+    Args:
+        limit (int): Maximum number of results to return.
+
+    Returns:
+        dict: Batch counters and the most recent results, newest last.
+    """
+    return {**counters, "received": list(received)[-limit:] if limit > 0 else []}
+
+
+use_structured_logging(app, "webhook_sink")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8011)
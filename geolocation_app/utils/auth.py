@@ -0,0 +1,27 @@
+from geolocation_app.utils.consts import TOKEN_ALGORITHM, TOKEN_SECRET_KEY
+
+
+def token_subject(authorization: str = None):
+    """
+    Get the user an Authorization header was issued to by the login service.
+
+    Args:
+        authorization (str, optional): Value of the Authorization header, "Bearer <access token>".
+
+    Returns:
+        str | None: User name, None when there is no token or it is invalid or expired.
+    """
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+
+    from jose import JWTError, jwt
+
+    try:
+        payload = jwt.decode(token.strip(), TOKEN_SECRET_KEY, algorithms=[TOKEN_ALGORITHM])
+    except JWTError:
+        return None
+    subject = payload.get("sub")
+    return subject if isinstance(subject, str) and subject else None
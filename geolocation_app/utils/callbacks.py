@@ -0,0 +1,166 @@
+import ipaddress
+import json
+import socket
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from geolocation_app.utils.consts import CALLBACK_ALLOWED_HOSTS
+from geolocation_app.utils.db_handler import CallbackOutboxModel, CallbackSubscriptionModel, GeolocationRequestModel
+
+_ID_CHUNK = 500
+
+
+def check_callback_url(url: str, allowed_hosts=CALLBACK_ALLOWED_HOSTS):
+    """
+    Check that a callback URL points to a public address, so clients cannot make the resolver call internal
+    services.
+
+    Every address the host resolves to must be public: loopback, private, link-local, multicast and reserved
+    addresses are refused, unless the host (or host:port) is in `allowed_hosts`.
+
+    Args:
+        url (str): Callback URL.
+        allowed_hosts (set[str]): Hosts allowed whatever they resolve to, as "host" or "host:port".
+
+    Raises:
+        ValueError: If the URL is not http(s), does not resolve, or resolves to a non-public address.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Callback URL {url} must be an http or https URL")
+    host = parts.hostname.lower()
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    if is_allowed_host(host, port, allowed_hosts):
+        return
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"Callback host {host} does not resolve: {e}")
+    for address in addresses:
+        check_callback_address(host, port, address, allowed_hosts)
+
+
+def is_allowed_host(host: str, port: int, allowed_hosts=CALLBACK_ALLOWED_HOSTS):
+    """
+    Whether a callback host is allowed whatever it resolves to.
+    """
+    host = host.lower()
+    return host in allowed_hosts or f"{host}:{port}" in allowed_hosts
+
+
+def check_callback_address(host: str, port: int, address: str, allowed_hosts=CALLBACK_ALLOWED_HOSTS):
+    """
+    Check an address a callback host resolved to, or a callback connection is connected to, is public.
+
+    Args:
+        host (str): Callback host.
+        port (int): Callback port.
+        address (str): IP address.
+        allowed_hosts (set[str]): Hosts allowed whatever they resolve to, as "host" or "host:port".
+
+    Raises:
+        ValueError: If the address is not public and the host is not allowed.
+    """
+    if is_allowed_host(host, port, allowed_hosts):
+        return
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    if not ip.is_global or ip.is_multicast:
+        raise ValueError(f"Callback host {host} resolves to the non-public address {ip}")
+
+
+def callback_destinations(db: Session, request_ids):
+    """
+    Find where the completion of each request must be delivered.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        request_ids (list[str]): Completed requests.
+
+    Returns:
+        dict[str, set[str]]: Destination URLs per request, for requests with a callback URL or whose client
+            has a subscription.
+    """
+    destinations = {}
+    for start in range(0, len(request_ids), _ID_CHUNK):
+        rows = db.execute(
+            select(GeolocationRequestModel.id, GeolocationRequestModel.callback_url, CallbackSubscriptionModel.url)
+            .outerjoin(CallbackSubscriptionModel, CallbackSubscriptionModel.client_id == GeolocationRequestModel.client_id)
+            .where(GeolocationRequestModel.id.in_(request_ids[start:start + _ID_CHUNK]))
+        ).all()
+        for request_id, callback_url, subscription_url in rows:
+            urls = {url for url in (callback_url, subscription_url) if url}
+            if urls:
+                destinations[request_id] = urls
+    return destinations
+
+
+def enqueue_callbacks(db: Session, completions, now: datetime):
+    """
+    Add the completion notifications of a batch of requests to the outbox.
+
+    The caller commits, so a notification is stored if and only if the result it announces is.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        completions (list[dict]): Payloads with at least a "request_id" key.
+        now (datetime): Completion time (UTC), the notifications are due immediately.
+
+    Returns:
+        int: Number of notifications queued.
+    """
+    destinations = callback_destinations(db, [completion["request_id"] for completion in completions])
+    rows = [
+        {
+            "destination": url,
+            "request_id": completion["request_id"],
+            "payload": json.dumps(completion),
+            "created_at": now,
+            "attempts": 0,
+            "next_attempt_at": now,
+        }
+        for completion in completions
+        for url in sorted(destinations.get(completion["request_id"], ()))
+    ]
+    if rows:
+        db.execute(insert(CallbackOutboxModel), rows)
+    return len(rows)
+
+
+def set_subscription(db: Session, client: str, url: str):
+    """
+    Subscribe a client to the completion of all its requests, replacing its previous subscription.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        client (str): Client key.
+        url (str): Destination URL.
+    """
+    db.merge(CallbackSubscriptionModel(client_id=client, url=url))
+    db.commit()
+
+
+def get_subscription(db: Session, client: str):
+    """
+    Get the destination URL a client is subscribed with, None if it is not subscribed.
+    """
+    return db.execute(
+        select(CallbackSubscriptionModel.url).where(CallbackSubscriptionModel.client_id == client)
+    ).scalar()
+
+
+def delete_subscription(db: Session, client: str):
+    """
+    Unsubscribe a client.
+
+    Returns:
+        bool: Whether the client was subscribed.
+    """
+    deleted = db.execute(delete(CallbackSubscriptionModel).where(CallbackSubscriptionModel.client_id == client))
+    db.commit()
+    return deleted.rowcount > 0
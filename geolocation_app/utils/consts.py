@@ -1,4 +1,4 @@
-
+import os
 
 HOST = "localhost"
 BASE_URL_GEORESOLVE = f"http://{HOST}:8000"
@@ -9,3 +9,119 @@ BASE_URL_POPULARITY = f"http://{HOST}:8006"
 BASE_URL_COUNTRY = f"http://{HOST}:8007"
 BASE_URL_TESTS = f"http://{HOST}:8008"
 BASE_URL_LOGIN = f"http://{HOST}:8009"
+BASE_URL_EXPORT = f"http://{HOST}:8010"
+BASE_URL_WEBHOOK = f"http://{HOST}:8011"
+
+# Access tokens issued by the login service, verified by the other services
+TOKEN_SECRET_KEY = os.getenv("GEO_TOKEN_SECRET_KEY", "secret-key")
+TOKEN_ALGORITHM = "HS256"
+
+# Approximate popularity (Space-Saving heavy hitters)
+HEAVY_HITTERS_ENABLED = os.getenv("GEO_HEAVY_HITTERS_ENABLED", "1") == "1"
+HEAVY_HITTERS_CAPACITY = int(os.getenv("GEO_HEAVY_HITTERS_CAPACITY", "10000"))
+HEAVY_HITTERS_CHECKPOINT_SECONDS = float(os.getenv("GEO_HEAVY_HITTERS_CHECKPOINT_SECONDS", "30"))
+HEAVY_HITTERS_DIR = os.getenv("GEO_HEAVY_HITTERS_DIR", "./sketches")
+HEAVY_HITTERS_COMPACT_SECONDS = float(os.getenv("GEO_HEAVY_HITTERS_COMPACT_SECONDS", "300"))
+
+# Admission control on request creation
+RATE_LIMIT_PER_SECOND = float(os.getenv("GEO_RATE_LIMIT_PER_SECOND", "5"))
+RATE_LIMIT_BURST = int(os.getenv("GEO_RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_SHARED = os.getenv("GEO_RATE_LIMIT_SHARED", "0") == "1"
+PENDING_BACKLOG_LIMIT = int(os.getenv("GEO_PENDING_BACKLOG_LIMIT", "100000"))
+BACKPRESSURE_RETRY_AFTER_SECONDS = int(os.getenv("GEO_BACKPRESSURE_RETRY_AFTER_SECONDS", "30"))
+
+# Upstream geolocation API
+UPSTREAM_GEO_URL = os.getenv("GEO_UPSTREAM_URL", "http://ip-api.com/json/")
+UPSTREAM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("GEO_UPSTREAM_CONNECT_TIMEOUT_SECONDS", "3.05"))
+UPSTREAM_READ_TIMEOUT_SECONDS = float(os.getenv("GEO_UPSTREAM_READ_TIMEOUT_SECONDS", "5"))
+UPSTREAM_DEADLINE_SECONDS = float(os.getenv("GEO_UPSTREAM_DEADLINE_SECONDS", "20"))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("GEO_UPSTREAM_MAX_CONCURRENCY", "16"))
+UPSTREAM_TARGET_LATENCY_SECONDS = float(os.getenv("GEO_UPSTREAM_TARGET_LATENCY_SECONDS", "1"))
+
+# Resolver result writer (group commit)
+WRITER_MAX_BATCH = int(os.getenv("GEO_WRITER_MAX_BATCH", "500"))
+WRITER_MAX_DELAY_SECONDS = float(os.getenv("GEO_WRITER_MAX_DELAY_SECONDS", "0.05"))
+
+# Pending-request scanner
+RESOLVER_WORKERS = int(os.getenv("GEO_RESOLVER_WORKERS", str(UPSTREAM_MAX_CONCURRENCY)))
+RESOLVER_WINDOW = int(os.getenv("GEO_RESOLVER_WINDOW", "1000"))
+RESOLVER_PAGE_SIZE = int(os.getenv("GEO_RESOLVER_PAGE_SIZE", "200"))
+RESOLVER_POLL_SECONDS = float(os.getenv("GEO_RESOLVER_POLL_SECONDS", "1"))
+RESOLVER_RESCAN_SECONDS = float(os.getenv("GEO_RESOLVER_RESCAN_SECONDS", "60"))
+# Relative shares of the resolver workers per priority lane when several lanes have work
+RESOLVER_WEIGHT_INTERACTIVE = float(os.getenv("GEO_RESOLVER_WEIGHT_INTERACTIVE", "8"))
+RESOLVER_WEIGHT_BULK = float(os.getenv("GEO_RESOLVER_WEIGHT_BULK", "2"))
+RESOLVER_WEIGHT_REFRESH = float(os.getenv("GEO_RESOLVER_WEIGHT_REFRESH", "1"))
+
+# In-memory read snapshot for the query services
+SNAPSHOT_ENABLED = os.getenv("GEO_READ_SNAPSHOT", "0") == "1"
+SNAPSHOT_REFRESH_SECONDS = float(os.getenv("GEO_SNAPSHOT_REFRESH_SECONDS", "2"))
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("GEO_SNAPSHOT_MAX_AGE_SECONDS", "10"))
+SNAPSHOT_RESEED_SECONDS = float(os.getenv("GEO_SNAPSHOT_RESEED_SECONDS", "300"))
+
+# Refresh of stale resolutions
+REFRESH_ENABLED = os.getenv("GEO_REFRESH_ENABLED", "1") == "1"
+REFRESH_SHARE = float(os.getenv("GEO_REFRESH_SHARE", "0.1"))
+REFRESH_MIN_AGE_HOURS = float(os.getenv("GEO_REFRESH_MIN_AGE_HOURS", "24"))
+REFRESH_POPULARITY_WINDOW = os.getenv("GEO_REFRESH_POPULARITY_WINDOW", "week")
+REFRESH_CANDIDATES = int(os.getenv("GEO_REFRESH_CANDIDATES", "1000"))
+REFRESH_RELOAD_SECONDS = float(os.getenv("GEO_REFRESH_RELOAD_SECONDS", "300"))
+
+# DNS resolution (empty nameserver list: use /etc/resolv.conf)
+DNS_NAMESERVERS = [server for server in os.getenv("GEO_DNS_NAMESERVERS", "").split(",") if server]
+DNS_HEDGE_DELAY_SECONDS = float(os.getenv("GEO_DNS_HEDGE_DELAY_SECONDS", "0.1"))
+DNS_TIMEOUT_SECONDS = float(os.getenv("GEO_DNS_TIMEOUT_SECONDS", "3"))
+DNS_NEGATIVE_TTL_SECONDS = float(os.getenv("GEO_DNS_NEGATIVE_TTL_SECONDS", "300"))
+DNS_SERVFAIL_TTL_SECONDS = float(os.getenv("GEO_DNS_SERVFAIL_TTL_SECONDS", "30"))
+DNS_MAX_TTL_SECONDS = float(os.getenv("GEO_DNS_MAX_TTL_SECONDS", "86400"))
+DNS_CACHE_SIZE = int(os.getenv("GEO_DNS_CACHE_SIZE", "100000"))
+
+# Request lifecycle latency histograms
+LATENCY_RETENTION_MINUTES = int(os.getenv("GEO_LATENCY_RETENTION_MINUTES", "1440"))
+LATENCY_DEFAULT_WINDOW = os.getenv("GEO_LATENCY_DEFAULT_WINDOW", "15m")
+
+# Logging (records are queued and written by a background thread)
+LOG_LEVEL = os.getenv("GEO_LOG_LEVEL", "INFO")
+LOG_DIR = os.getenv("GEO_LOG_DIR", ".")
+LOG_MAX_BYTES = int(os.getenv("GEO_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("GEO_LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("GEO_LOG_QUEUE_SIZE", "10000"))
+# Per call site: records per second and burst before sampling, then one record kept in LOG_SAMPLE_EVERY
+LOG_RATE_PER_SECOND = float(os.getenv("GEO_LOG_RATE_PER_SECOND", "10"))
+LOG_RATE_BURST = int(os.getenv("GEO_LOG_RATE_BURST", "50"))
+LOG_SAMPLE_EVERY = int(os.getenv("GEO_LOG_SAMPLE_EVERY", "100"))
+
+# Retention of old requests (archived to gzip NDJSON segments, counts kept in archived_counts), opt-in as it
+# removes requests from the database
+RETENTION_ENABLED = os.getenv("GEO_RETENTION_ENABLED", "0") == "1"
+RETENTION_DAYS = int(os.getenv("GEO_RETENTION_DAYS", "90"))
+RETENTION_DIR = os.getenv("GEO_RETENTION_DIR", "./archive")
+RETENTION_BATCH_SIZE = int(os.getenv("GEO_RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("GEO_RETENTION_BATCH_PAUSE_SECONDS", "0.05"))
+ARCHIVE_RETENTION_DAYS = int(os.getenv("GEO_ARCHIVE_RETENTION_DAYS", "365"))
+RETENTION_INTERVAL_MINUTES = float(os.getenv("GEO_RETENTION_INTERVAL_MINUTES", "60"))
+# Daily geographic rollup slices are kept this long, the all-time slice is kept for good
+GEO_ROLLUP_RETENTION_DAYS = int(os.getenv("GEO_ROLLUP_RETENTION_DAYS", str(RETENTION_DAYS)))
+# Incremental VACUUM and ANALYZE
+MAINTENANCE_INTERVAL_MINUTES = float(os.getenv("GEO_MAINTENANCE_INTERVAL_MINUTES", "360"))
+VACUUM_PAGES_PER_STEP = int(os.getenv("GEO_VACUUM_PAGES_PER_STEP", "1000"))
+ANALYZE_ROWS_LIMIT = int(os.getenv("GEO_ANALYZE_ROWS_LIMIT", "1000"))
+
+# Completion callbacks (outbox delivered by the resolution service)
+CALLBACKS_ENABLED = os.getenv("GEO_CALLBACKS_ENABLED", "1") == "1"
+CALLBACK_BATCH_SIZE = int(os.getenv("GEO_CALLBACK_BATCH_SIZE", "100"))
+CALLBACK_FETCH_SIZE = int(os.getenv("GEO_CALLBACK_FETCH_SIZE", "1000"))
+CALLBACK_CONCURRENCY = int(os.getenv("GEO_CALLBACK_CONCURRENCY", "8"))
+CALLBACK_POLL_SECONDS = float(os.getenv("GEO_CALLBACK_POLL_SECONDS", "1"))
+CALLBACK_TIMEOUT_SECONDS = float(os.getenv("GEO_CALLBACK_TIMEOUT_SECONDS", "5"))
+CALLBACK_BACKOFF_BASE_SECONDS = float(os.getenv("GEO_CALLBACK_BACKOFF_BASE_SECONDS", "1"))
+CALLBACK_BACKOFF_CAP_SECONDS = float(os.getenv("GEO_CALLBACK_BACKOFF_CAP_SECONDS", "3600"))
+CALLBACK_MAX_ATTEMPTS = int(os.getenv("GEO_CALLBACK_MAX_ATTEMPTS", "15"))
+# Given-up notifications are kept this long for inspection
+CALLBACK_GIVEN_UP_RETENTION_DAYS = float(os.getenv("GEO_CALLBACK_GIVEN_UP_RETENTION_DAYS", "7"))
+# Callback URLs must resolve to public addresses, except these "host" or "host:port" entries (comma-separated)
+CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("GEO_CALLBACK_ALLOWED_HOSTS", "").split(",")
+                          if host.strip()}
+# Local webhook sink, to receive callbacks in development (fails this share of batches to exercise retries)
+WEBHOOK_SINK_KEEP = int(os.getenv("GEO_WEBHOOK_SINK_KEEP", "1000"))
+WEBHOOK_SINK_FAIL_RATE = float(os.getenv("GEO_WEBHOOK_SINK_FAIL_RATE", "0"))
@@ -1,17 +1,64 @@
+import logging
+import os
+import threading
 from datetime import datetime
 
-from sqlalchemy import create_engine, Column, String, DateTime, Integer
+from sqlalchemy import create_engine, event, inspect, literal, text, Column, String, DateTime, Float, Index, Integer
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+# Bound to the engine by `get_engine`, which is only called on first use, so importing this module
+# (or any model) never opens the database.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Put every connection in WAL mode so readers (exports, query services) never block the writers.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def get_engine():
+    """
+    Get the shared engine, creating it on first use.
+
+    Returns:
+        Engine: SQLAlchemy engine for DATABASE_URL.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(DATABASE_URL)
+                event.listen(engine, "connect", set_sqlite_pragmas)
+                SessionLocal.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+
+def get_session():
+    """
+    Open a new session on the shared engine.
+
+    Returns:
+        Session: SQLAlchemy database session, to be closed by the caller.
+    """
+    get_engine()
+    return SessionLocal()
+
 
 def get_db():
-    db = SessionLocal()
+    db = get_session()
     try:
         yield db
     finally:
@@ -20,12 +67,161 @@ def get_db():
 
 class GeolocationRequestModel(Base):
     __tablename__ = "geolocation_requests"
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    id = Column(String, primary_key=True, index=True)
     domain = Column(String, index=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     locations = Column(String, nullable=True)
     servers = Column(String, nullable=True)
-    status = Column(String, default="Pending")
+    status = Column(String, default="Pending", index=True)
+    version = Column(Integer, default=1)
+    priority = Column(String, default="bulk")
+    client_id = Column(String, default="")
+    # Lifecycle of the latest resolution: picked up by a resolver worker, DNS answered, geolocated, written.
+    claimed_at = Column(DateTime, nullable=True)
+    dns_done_at = Column(DateTime, nullable=True)
+    geo_done_at = Column(DateTime, nullable=True)
+    persisted_at = Column(DateTime, nullable=True)
+    # URL notified when the request is resolved, in addition to the client's subscription.
+    callback_url = Column(String, nullable=True)
+
+    # Pending requests of a lane per client in keyset order, so the scanner's client skip-scan
+    # and each client page are single index range scans.
+    __table_args__ = (
+        Index("ix_geolocation_requests_pending", "status", "priority", "client_id", "created_at", "id"),
+    )
+
+
+class GeolocationRequestVersionModel(Base):
+    __tablename__ = "geolocation_request_versions"
+    request_id = Column(String, primary_key=True)
+    version = Column(Integer, primary_key=True)
+    domain = Column(String, nullable=False)
+    locations = Column(String, nullable=True)
+    servers = Column(String, nullable=True)
+    status = Column(String, nullable=False)
+    resolved_at = Column(DateTime, nullable=True)
+
+
+class PopularityBucketModel(Base):
+    __tablename__ = "popularity_buckets"
+    kind = Column(String, primary_key=True)
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    key = Column(String, primary_key=True)
+    hits = Column(Integer, nullable=False, default=0)
+
+
+class ServerAddressModel(Base):
+    __tablename__ = "server_addresses"
+    request_id = Column(String, primary_key=True)
+    ip_version = Column(Integer, primary_key=True)
+    ip_high = Column(Integer, primary_key=True)
+    ip_low = Column(Integer, primary_key=True)
+    domain = Column(String, nullable=False)
+
+    # Covering index, so a CIDR lookup is a single range scan that never touches the table.
+    __table_args__ = (Index("ix_server_addresses_ip", "ip_version", "ip_high", "ip_low", "domain"),)
+
+
+class LocationIndexModel(Base):
+    __tablename__ = "location_index"
+    request_id = Column(String, primary_key=True)
+    country_code = Column(String, primary_key=True)
+    region_key = Column(String, primary_key=True)
+    region = Column(String, nullable=False)
+    domain = Column(String, nullable=False)
+
+    # Covering index for country and region lookups and for region prefix search.
+    __table_args__ = (Index("ix_location_index_country_region", "country_code", "region_key", "domain"),)
+
+
+class GeoRollupMemberModel(Base):
+    __tablename__ = "geo_rollup_members"
+    # "YYYY-MM-DD" day of resolution, "" for all time.
+    day = Column(String, primary_key=True)
+    country_code = Column(String, primary_key=True)
+    # Normalized region, "*" for the country as a whole.
+    region_key = Column(String, primary_key=True)
+    kind = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    region = Column(String, nullable=False)
+
+
+class GeoRollupModel(Base):
+    __tablename__ = "geo_rollups"
+    day = Column(String, primary_key=True)
+    country_code = Column(String, primary_key=True)
+    region_key = Column(String, primary_key=True)
+    region = Column(String, nullable=False)
+    domains = Column(Integer, nullable=False, default=0)
+    servers = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class MaintenanceStateModel(Base):
+    __tablename__ = "maintenance_state"
+    # Progress of one-off and periodic maintenance tasks, e.g. the cursor of a backfill.
+    name = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ArchivedCountModel(Base):
+    __tablename__ = "archived_counts"
+    # All-time request counts per domain and per server of the requests moved to archive segments.
+    kind = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    requests = Column(Integer, nullable=False, default=0)
+
+
+class ArchivedRequestModel(Base):
+    __tablename__ = "archived_requests"
+    # Requests moved to archive segments, so their IDs are reported as archived rather than unknown,
+    # until the segment expires.
+    id = Column(String, primary_key=True)
+    segment = Column(String, nullable=False, index=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchiveSegmentModel(Base):
+    __tablename__ = "archive_segments"
+    name = Column(String, primary_key=True)
+    rows = Column(Integer, nullable=False, default=0)
+    first_created_at = Column(DateTime, nullable=True)
+    last_created_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CallbackSubscriptionModel(Base):
+    __tablename__ = "callback_subscriptions"
+    # URL notified of every request of a client when it is resolved.
+    client_id = Column(String, primary_key=True)
+    url = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class CallbackOutboxModel(Base):
+    __tablename__ = "callback_outbox"
+    # Completion notifications waiting for delivery, written in the transaction that resolves the request.
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    destination = Column(String, nullable=False)
+    request_id = Column(String, nullable=False)
+    payload = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    attempts = Column(Integer, nullable=False, default=0)
+    # None once delivery was given up, the row is kept for inspection.
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+
+    __table_args__ = (Index("ix_callback_outbox_due", "next_attempt_at", "id"),)
+
+
+class RateLimitBucketModel(Base):
+    __tablename__ = "rate_limit_buckets"
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
 
 
 class User(Base):
@@ -36,4 +232,73 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
-Base.metadata.create_all(bind=engine)
+# Indexes dropped from the models, removed from existing databases by `init_db`.
+OBSOLETE_INDEXES = ("ix_geolocation_requests_status_created",)
+
+
+def add_missing_columns(bind):
+    """
+    Add columns declared on the models but missing from an existing database file.
+
+    `create_all` only creates missing tables, so databases created by an older version
+    of the models are brought up to date here with `ALTER TABLE ... ADD COLUMN`. Scalar
+    defaults are declared on the new column, so existing rows get them too.
+
+    Args:
+        bind (Engine): Engine of the database to upgrade.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    if column.default is not None and column.default.is_scalar:
+                        default = literal(column.default.arg).compile(
+                            dialect=bind.dialect, compile_kwargs={"literal_binds": True}
+                        )
+                        column_type = f"{column_type} DEFAULT {default}"
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+        for name in OBSOLETE_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def enable_incremental_vacuum(bind):
+    """
+    Switch the database file to incremental auto-vacuum, so pages freed by retention can be returned to
+    the file system a few at a time instead of by a full VACUUM.
+
+    Switching an existing file takes one full VACUUM, run here once.
+
+    Args:
+        bind (Engine): Engine of the database to upgrade.
+    """
+    # VACUUM cannot run inside a transaction.
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return
+        connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+    logging.info("Enabled incremental auto-vacuum.")
+
+
+def init_db():
+    """
+    Create missing tables, columns and indexes.
+
+    This is an explicit deployment step (run this module before starting the services), services
+    never issue DDL themselves.
+    """
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    enable_incremental_vacuum(engine)
+    logging.info(f"Database schema at {DATABASE_URL} is up to date.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    init_db()
@@ -0,0 +1,332 @@
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import case, delete, func, literal, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from geolocation_app.utils.consts import GEO_ROLLUP_RETENTION_DAYS
+from geolocation_app.utils.countries import COUNTRIES, normalize
+from geolocation_app.utils.db_handler import (
+    GeoRollupMemberModel,
+    GeoRollupModel,
+    GeolocationRequestModel,
+    MaintenanceStateModel,
+)
+from geolocation_app.utils.ip_index import parse_servers
+from geolocation_app.utils.location_index import parse_locations
+from geolocation_app.utils.popularity_buckets import DOMAIN, SERVER
+from geolocation_app.utils.status import GeolocationStatus
+
+# Day of the all-time slice, and region key of a country as a whole.
+ALL_TIME = ""
+COUNTRY_TOTAL = "*"
+
+# Maintenance state holding the backfill cursor (last request ID added), then BACKFILL_DONE.
+BACKFILL_STATE = "geo_rollups_backfill"
+BACKFILL_DONE = "done"
+
+_members = GeoRollupMemberModel.__table__
+# Executed as a batched executemany, RETURNING only the memberships that were not there yet.
+_INSERT_NEW_MEMBERS = insert(_members).on_conflict_do_nothing().returning(
+    _members.c.day, _members.c.country_code, _members.c.region_key, _members.c.region, _members.c.kind
+)
+
+
+def day_key(when):
+    """
+    Key of the daily slice a time falls in.
+    """
+    return when.strftime("%Y-%m-%d")
+
+
+def rollup_members(day: str, domain: str, location_keys, server_locations):
+    """
+    Rollup memberships of one resolution, in its day and in the all-time slice.
+
+    Args:
+        day (str): Day of the resolution, None to add it to the all-time slice only.
+        domain (str): Resolved domain.
+        location_keys (Iterable[tuple[str, str]]): (alpha-2 country code, region) pairs of the domain.
+        server_locations (Iterable[tuple[str, str, str]]): (server, alpha-2 country code, region) triples.
+
+    Returns:
+        dict: Member rows keyed by their primary key.
+    """
+    members = {}
+    located = [(DOMAIN, domain, code, region) for code, region in location_keys]
+    located += [(SERVER, server, code, region) for server, code, region in server_locations]
+    for kind, value, code, region in located:
+        code = code.upper()
+        for slice_day in (day, ALL_TIME) if day else (ALL_TIME,):
+            for region_key, region_name in ((COUNTRY_TOTAL, ""), (normalize(region or ""), region or "")):
+                members[(slice_day, code, region_key, kind, value)] = {
+                    "day": slice_day,
+                    "country_code": code,
+                    "region_key": region_key,
+                    "kind": kind,
+                    "value": value,
+                    "region": region_name,
+                }
+    return members
+
+
+def record_geo_rollups(db: Session, entries, when: datetime):
+    """
+    Add a batch of resolutions to the geographic rollups.
+
+    Memberships are inserted with ON CONFLICT DO NOTHING ... RETURNING, so only the domains and servers new
+    to a slice increment its counters. The caller commits.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        entries (Iterable[tuple[str, Iterable[tuple[str, str]], Iterable[tuple[str, str, str]]]]): (domain,
+            (country code, region) pairs, (server, country code, region) triples) of resolved requests.
+        when (datetime): Time of the resolutions (UTC).
+    """
+    members = {}
+    day = day_key(when)
+    for domain, location_keys, server_locations in entries:
+        members.update(rollup_members(day, domain, location_keys, server_locations))
+    if not members:
+        return
+
+    inserted = db.execute(_INSERT_NEW_MEMBERS, list(members.values())).all()
+    counts = {}
+    for slice_day, code, region_key, region, kind in inserted:
+        entry = counts.setdefault((slice_day, code, region_key), {"region": region, DOMAIN: 0, SERVER: 0})
+        entry[kind] += 1
+    if not counts:
+        return
+
+    statement = insert(GeoRollupModel)
+    statement = statement.on_conflict_do_update(
+        index_elements=["day", "country_code", "region_key"],
+        set_={
+            "domains": GeoRollupModel.domains + statement.excluded["domains"],
+            "servers": GeoRollupModel.servers + statement.excluded["servers"],
+            "updated_at": statement.excluded["updated_at"],
+        },
+    )
+    db.execute(statement, [
+        {
+            "day": slice_day, "country_code": code, "region_key": region_key, "region": entry["region"],
+            "domains": entry[DOMAIN], "servers": entry[SERVER], "updated_at": when,
+        }
+        for (slice_day, code, region_key), entry in counts.items()
+    ])
+
+
+def rebuild_geo_rollup_counts(db: Session):
+    """
+    Recompute the rollup counters from the memberships, one day slice per transaction.
+
+    Each slice is aggregated by a single GROUP BY over its memberships.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+
+    Returns:
+        int: Number of slices rebuilt.
+    """
+    days = db.execute(select(GeoRollupMemberModel.day).distinct()).scalars().all()
+    for slice_day in days:
+        now = datetime.utcnow()
+        db.execute(delete(GeoRollupModel).where(GeoRollupModel.day == slice_day))
+        db.execute(insert(GeoRollupModel).from_select(
+            ["day", "country_code", "region_key", "region", "domains", "servers", "updated_at"],
+            select(
+                GeoRollupMemberModel.day,
+                GeoRollupMemberModel.country_code,
+                GeoRollupMemberModel.region_key,
+                func.max(GeoRollupMemberModel.region),
+                func.sum(case((GeoRollupMemberModel.kind == DOMAIN, 1), else_=0)),
+                func.sum(case((GeoRollupMemberModel.kind == SERVER, 1), else_=0)),
+                literal(now),
+            )
+            .where(GeoRollupMemberModel.day == slice_day)
+            .group_by(GeoRollupMemberModel.country_code, GeoRollupMemberModel.region_key),
+        ))
+        db.commit()
+    return len(days)
+
+
+def _backfill_state(db: Session):
+    return db.execute(
+        select(MaintenanceStateModel.value).where(MaintenanceStateModel.name == BACKFILL_STATE)
+    ).scalar()
+
+
+def backfill_geo_rollups(db: Session, batch_size: int = 1000, retention_days: int = GEO_ROLLUP_RETENTION_DAYS):
+    """
+    Build the rollups from the requests resolved before they existed, then compute their counters.
+
+    The cursor is saved with each batch, so an interrupted backfill resumes where it stopped, and the backfill
+    is marked done at the end, after which this returns immediately. Requests resolved before the daily
+    slices are kept only go to the all-time slice. The requests do not record which server is in which
+    location, so the servers of a domain with several locations are counted in each of them.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        batch_size (int): Number of requests read per transaction.
+        retention_days (int): Days the daily slices are kept.
+
+    Returns:
+        int: Number of requests added to the rollups.
+    """
+    last_id = _backfill_state(db)
+    if last_id == BACKFILL_DONE:
+        return 0
+    last_id = last_id or ""
+    oldest_day = day_key(datetime.utcnow() - timedelta(days=retention_days))
+    added = 0
+    while True:
+        batch = db.execute(
+            select(
+                GeolocationRequestModel.id, GeolocationRequestModel.domain, GeolocationRequestModel.locations,
+                GeolocationRequestModel.servers, GeolocationRequestModel.updated_at,
+            )
+            .where(GeolocationRequestModel.id > last_id, GeolocationRequestModel.status == GeolocationStatus.RESOLVED)
+            .order_by(GeolocationRequestModel.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+
+        members = {}
+        for _, domain, locations, servers, updated_at in batch:
+            location_keys = parse_locations(locations)
+            server_locations = [(server, code, region) for server in parse_servers(servers)
+                                for code, region in location_keys]
+            day = day_key(updated_at or datetime.utcnow())
+            members.update(rollup_members(day if day >= oldest_day else None, domain, location_keys,
+                                          server_locations))
+        if members:
+            db.execute(insert(_members).on_conflict_do_nothing(), list(members.values()))
+        last_id = batch[-1].id
+        db.merge(MaintenanceStateModel(name=BACKFILL_STATE, value=last_id))
+        db.commit()
+        added += len(batch)
+
+    rebuild_geo_rollup_counts(db)
+    db.merge(MaintenanceStateModel(name=BACKFILL_STATE, value=BACKFILL_DONE))
+    db.commit()
+    return added
+
+
+def prune_geo_rollups(db: Session, now: datetime = None, retention_days: int = GEO_ROLLUP_RETENTION_DAYS):
+    """
+    Delete the daily slices older than the retention period, one day per transaction.
+
+    The all-time slice is kept, so all-time counts are unchanged; ranges reaching past the retention period
+    only count the days still kept.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        now (datetime, optional): Current time (UTC).
+        retention_days (int): Days the daily slices are kept.
+
+    Returns:
+        int: Number of day slices deleted.
+    """
+    oldest_day = day_key((now or datetime.utcnow()) - timedelta(days=retention_days))
+    days = db.execute(
+        select(GeoRollupMemberModel.day).distinct()
+        .where(GeoRollupMemberModel.day != ALL_TIME, GeoRollupMemberModel.day < oldest_day)
+    ).scalars().all()
+    for slice_day in days:
+        db.execute(delete(GeoRollupMemberModel).where(GeoRollupMemberModel.day == slice_day))
+        db.execute(delete(GeoRollupModel).where(GeoRollupModel.day == slice_day))
+        db.commit()
+    return len(days)
+
+
+def _group_by_country(rows, regions: bool):
+    countries = {}
+    for code, region_key, region, domains, servers in rows:
+        country = countries.setdefault(code, {
+            "country_code": code,
+            "country": COUNTRIES[code][0] if code in COUNTRIES else code,
+            "domains": 0,
+            "servers": 0,
+        })
+        if regions:
+            country.setdefault("regions", [])
+        if region_key == COUNTRY_TOTAL:
+            country["domains"], country["servers"] = domains, servers
+        elif regions:
+            country["regions"].append({"region": region, "domains": domains, "servers": servers})
+
+    for country in countries.values():
+        country.get("regions", []).sort(key=lambda region: (-region["domains"], region["region"]))
+    return sorted(countries.values(), key=lambda country: (-country["domains"], country["country_code"]))
+
+
+def geo_rollup(db: Session, code: str = None, day: date = None, regions: bool = True):
+    """
+    Get the domain and distinct server counts per country and region, from the precomputed counters.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        code (str, optional): Alpha-2 code of a single country.
+        day (date, optional): Day of resolution, all time if omitted.
+        regions (bool): Include the per-region breakdown of each country.
+
+    Returns:
+        list[dict]: Countries by domain count, each with its regions by domain count.
+    """
+    conditions = [GeoRollupModel.day == (day.isoformat() if day else ALL_TIME)]
+    if code:
+        conditions.append(GeoRollupModel.country_code == code)
+    if not regions:
+        conditions.append(GeoRollupModel.region_key == COUNTRY_TOTAL)
+
+    rows = db.execute(select(
+        GeoRollupModel.country_code, GeoRollupModel.region_key, GeoRollupModel.region,
+        GeoRollupModel.domains, GeoRollupModel.servers,
+    ).where(*conditions)).all()
+    return _group_by_country(rows, regions)
+
+
+def geo_rollup_range(db: Session, since: date, until: date, code: str = None, regions: bool = True):
+    """
+    Get the distinct domain and server counts per country and region over several days.
+
+    Distinct counts do not add up across days, so they are counted from the daily memberships.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        since (date): First day, inclusive.
+        until (date): Last day, inclusive.
+        code (str, optional): Alpha-2 code of a single country.
+        regions (bool): Include the per-region breakdown of each country.
+
+    Returns:
+        list[dict]: Countries by domain count, each with its regions by domain count.
+    """
+    member = GeoRollupMemberModel
+    conditions = [member.day >= since.isoformat(), member.day <= until.isoformat()]
+    if code:
+        conditions.append(member.country_code == code)
+    if not regions:
+        conditions.append(member.region_key == COUNTRY_TOTAL)
+
+    rows = db.execute(
+        select(
+            member.country_code, member.region_key, func.max(member.region), member.kind,
+            func.count(member.value.distinct()),
+        )
+        .where(*conditions)
+        .group_by(member.country_code, member.region_key, member.kind)
+    ).all()
+
+    counts = {}
+    for code, region_key, region, kind, count in rows:
+        entry = counts.setdefault((code, region_key), [region, Counter()])
+        entry[0] = max(entry[0], region)
+        entry[1][kind] = count
+    return _group_by_country(
+        [(code, region_key, region, kinds[DOMAIN], kinds[SERVER])
+         for (code, region_key), (region, kinds) in counts.items()],
+        regions,
+    )
@@ -0,0 +1,385 @@
+import fcntl
+import glob
+import heapq
+import itertools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from geolocation_app.utils.consts import (
+    HEAVY_HITTERS_CAPACITY,
+    HEAVY_HITTERS_CHECKPOINT_SECONDS,
+    HEAVY_HITTERS_COMPACT_SECONDS,
+    HEAVY_HITTERS_DIR,
+)
+
+# Instance name of the checkpoint holding the merged checkpoints of the trackers that stopped.
+COMPACTED = "compacted"
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitters summary holding at most `capacity` counters.
+
+    Every estimated count overestimates the true count by at most its `error`, and every error
+    is at most `total / capacity`, so any key seen more often than that is guaranteed to be tracked.
+    """
+
+    def __init__(self, capacity: int = HEAVY_HITTERS_CAPACITY):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        # Min-heap of (count, key) with lazy deletion: entries whose count no longer matches are stale.
+        self._heap = []
+
+    def add(self, key: str, count: int = 1):
+        """
+        Count `count` occurrences of `key`.
+
+        Args:
+            key (str): Key that was seen.
+            count (int): Number of occurrences.
+        """
+        self.total += count
+
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            min_count, min_key = self._pop_min()
+            del self.counts[min_key]
+            del self.errors[min_key]
+            self.counts[key] = min_count + count
+            self.errors[key] = min_count
+
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return count, key
+
+    def _rebuild_heap(self):
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    @property
+    def min_count(self):
+        """
+        Count that any untracked key may have reached, zero while the summary is not full.
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    @property
+    def max_error(self):
+        """
+        Upper bound on the overestimation of any count.
+        """
+        return self.total // self.capacity if self.capacity else 0
+
+    def top(self, n: int):
+        """
+        Get the N keys with the highest estimated counts.
+
+        Args:
+            n (int): Number of keys to return.
+
+        Returns:
+            list[tuple[str, int, int]]: (key, estimated count, max overestimation) triples.
+        """
+        keys = heapq.nlargest(n, self.counts, key=self.counts.__getitem__)
+        return [(key, self.counts[key], self.errors[key]) for key in keys]
+
+    def to_dict(self):
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "items": [[key, count, self.errors[key]] for key, count in self.counts.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, capacity: int = None):
+        sketch = cls(capacity or data["capacity"])
+        sketch.total = data["total"]
+        items = sorted(data["items"], key=lambda item: item[1], reverse=True)[:sketch.capacity]
+        for key, count, error in items:
+            sketch.counts[key] = count
+            sketch.errors[key] = error
+        sketch._rebuild_heap()
+        return sketch
+
+    @classmethod
+    def merge(cls, sketches, capacity: int = None):
+        """
+        Merge summaries built on disjoint streams, keeping the error guarantees.
+
+        Args:
+            sketches (list[SpaceSaving]): Summaries to merge.
+            capacity (int, optional): Capacity of the result, defaults to the largest input capacity.
+
+        Returns:
+            SpaceSaving: Merged summary.
+        """
+        capacity = capacity or max((sketch.capacity for sketch in sketches), default=HEAVY_HITTERS_CAPACITY)
+        # A key missing from a sketch may have reached its minimum there, computed once per sketch.
+        minimums = [sketch.min_count for sketch in sketches]
+        missing = sum(minimums)
+        merged = {key: [missing, missing] for key in set().union(*(sketch.counts for sketch in sketches))}
+        for sketch, minimum in zip(sketches, minimums):
+            errors = sketch.errors
+            for key, count in sketch.counts.items():
+                entry = merged[key]
+                entry[0] += count - minimum
+                entry[1] += errors[key] - minimum
+        items = [[key, count, error] for key, (count, error) in merged.items()]
+
+        return cls.from_dict({
+            "capacity": capacity,
+            "total": sum(sketch.total for sketch in sketches),
+            "items": items,
+        })
+
+
+def checkpoint_path(kind: str, instance: str = None):
+    """
+    Path of the checkpoint file written by one tracker.
+
+    Args:
+        kind (str): What is counted, e.g. "domain" or "server".
+        instance (str, optional): Name of the checkpoint. Defaults to GEO_SKETCH_INSTANCE, or the host name.
+
+    Returns:
+        str: Checkpoint file path.
+    """
+    instance = instance or os.getenv("GEO_SKETCH_INSTANCE") or socket.gethostname()
+    return os.path.join(HEAVY_HITTERS_DIR, f"{kind}.{instance}.json")
+
+
+def _try_lock(path: str):
+    """
+    Open a lock file and lock it exclusively, without waiting.
+
+    Returns:
+        file | None: The open lock file, released when closed, None if another process holds it.
+    """
+    lock = open(path, "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def claim_checkpoint(kind: str, instance: str = None):
+    """
+    Claim the first checkpoint of this host that no running tracker holds.
+
+    Slots are named after the instance, then "<instance>-1", "<instance>-2" and so on, and are held with a lock
+    file for as long as the tracker runs. A restarted process claims the slot it had, warm-starting from its
+    checkpoint, and the number of checkpoint files stays bounded by the number of trackers running at once.
+
+    Args:
+        kind (str): What is counted, e.g. "domain" or "server".
+        instance (str, optional): Name of the first slot, see `checkpoint_path`.
+
+    Returns:
+        tuple[str, file]: Checkpoint file path and its held lock file.
+    """
+    instance = instance or os.getenv("GEO_SKETCH_INSTANCE") or socket.gethostname()
+    os.makedirs(HEAVY_HITTERS_DIR, exist_ok=True)
+    for slot in itertools.count():
+        path = checkpoint_path(kind, instance if slot == 0 else f"{instance}-{slot}")
+        lock = _try_lock(f"{path}.lock")
+        if lock is not None:
+            return path, lock
+
+
+def _read_checkpoint(path: str, capacity: int = None):
+    with open(path) as checkpoint:
+        return SpaceSaving.from_dict(json.load(checkpoint), capacity)
+
+
+def _write_checkpoint(path: str, data: dict):
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as checkpoint:
+        json.dump(data, checkpoint)
+    os.replace(temporary_path, path)
+
+
+def compact_checkpoints(kind: str):
+    """
+    Merge the checkpoints that no running tracker holds into the compacted checkpoint, and delete them.
+
+    Their counts stay in the merged view, and the number of files to read no longer grows with restarts.
+    Lock files are kept, they may be open in a process about to claim the slot.
+
+    Args:
+        kind (str): What is counted, e.g. "domain" or "server".
+
+    Returns:
+        int: Number of checkpoints merged.
+    """
+    compacted_path = checkpoint_path(kind, COMPACTED)
+    os.makedirs(HEAVY_HITTERS_DIR, exist_ok=True)
+    guard = _try_lock(f"{compacted_path}.lock")
+    if guard is None:
+        # Another reader is compacting.
+        return 0
+
+    held = []
+    try:
+        for path in sorted(glob.glob(checkpoint_path(kind, "*"))):
+            if path != compacted_path:
+                lock = _try_lock(f"{path}.lock")
+                if lock is not None:
+                    held.append((path, lock))
+        if not held:
+            return 0
+
+        sketches = []
+        for path in [compacted_path, *(path for path, _ in held)]:
+            try:
+                sketches.append(_read_checkpoint(path))
+            except FileNotFoundError:
+                pass
+            except (ValueError, KeyError) as e:
+                logging.error(f"Dropping unreadable heavy-hitters checkpoint {path}: {e}")
+        if sketches:
+            _write_checkpoint(compacted_path, SpaceSaving.merge(sketches).to_dict())
+        for path, _ in held:
+            os.remove(path)
+        logging.info(f"Compacted {len(held)} {kind} heavy-hitters checkpoints into {compacted_path}")
+        return len(held)
+    finally:
+        for _, lock in held:
+            lock.close()
+        guard.close()
+
+
+class HeavyHitterTracker:
+    """
+    Thread-safe Space-Saving summary that checkpoints itself to disk and warm-starts from its checkpoint.
+
+    The checkpoint is the first slot of this host not held by another tracker, see `claim_checkpoint`.
+    """
+
+    def __init__(self, kind: str, capacity: int = HEAVY_HITTERS_CAPACITY,
+                 checkpoint_seconds: float = HEAVY_HITTERS_CHECKPOINT_SECONDS, instance: str = None):
+        self.path, self._slot_lock = claim_checkpoint(kind, instance)
+        self.checkpoint_seconds = checkpoint_seconds
+        self._lock = threading.Lock()
+        self._last_checkpoint = time.monotonic()
+        self._dirty = False
+        self.sketch = self._load(capacity)
+
+    def _load(self, capacity: int):
+        try:
+            sketch = _read_checkpoint(self.path, capacity)
+            logging.info(f"Loaded heavy-hitters checkpoint {self.path} ({len(sketch.counts)} keys)")
+            return sketch
+        except FileNotFoundError:
+            return SpaceSaving(capacity)
+        except (ValueError, KeyError) as e:
+            logging.error(f"Ignoring unreadable heavy-hitters checkpoint {self.path}: {e}")
+            return SpaceSaving(capacity)
+
+    def add(self, keys):
+        """
+        Count one occurrence of each key, checkpointing if the last checkpoint is old enough.
+
+        Args:
+            keys (Iterable[str]): Keys that were seen.
+        """
+        with self._lock:
+            for key in keys:
+                self.sketch.add(key)
+            self._dirty = True
+            due = time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds
+        if due:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Atomically write the summary to its checkpoint file.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            data = self.sketch.to_dict()
+            self._dirty = False
+            self._last_checkpoint = time.monotonic()
+
+        try:
+            _write_checkpoint(self.path, data)
+        except OSError as e:
+            logging.error(f"Failed to write heavy-hitters checkpoint {self.path}: {e}")
+
+    def close(self):
+        """
+        Write a last checkpoint and release the slot.
+        """
+        self.checkpoint()
+        self._slot_lock.close()
+
+
+class HeavyHitterReader:
+    """
+    Read-side view merging the checkpoints of every writer, reloaded when a checkpoint changes.
+
+    Every `compact_interval` seconds the checkpoints of trackers that stopped are compacted into one.
+    """
+
+    def __init__(self, kind: str, compact_interval: float = HEAVY_HITTERS_COMPACT_SECONDS):
+        self.kind = kind
+        self.pattern = checkpoint_path(kind, "*")
+        self.compact_interval = compact_interval
+        self._compacted_at = None
+        self._versions = None
+        self._sketch = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Get the merged summary, or None if no checkpoint exists yet.
+
+        Returns:
+            SpaceSaving | None: Merged summary.
+        """
+        if self._compacted_at is None or time.monotonic() - self._compacted_at >= self.compact_interval:
+            self._compacted_at = time.monotonic()
+            try:
+                compact_checkpoints(self.kind)
+            except OSError as e:
+                logging.error(f"Failed to compact the {self.kind} heavy-hitters checkpoints: {e}")
+
+        paths = sorted(glob.glob(self.pattern))
+        versions = []
+        for path in paths:
+            try:
+                versions.append((path, os.stat(path).st_mtime_ns))
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            if versions != self._versions:
+                sketches = []
+                for path, _ in versions:
+                    try:
+                        sketches.append(_read_checkpoint(path))
+                    except (OSError, ValueError, KeyError) as e:
+                        logging.error(f"Skipping unreadable heavy-hitters checkpoint {path}: {e}")
+                self._sketch = SpaceSaving.merge(sketches) if sketches else None
+                self._versions = versions
+            return self._sketch
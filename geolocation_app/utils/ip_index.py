@@ -0,0 +1,165 @@
+import ast
+import ipaddress
+import logging
+
+from sqlalchemy import delete, exists, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from geolocation_app.utils.db_handler import GeolocationRequestModel, ServerAddressModel
+from geolocation_app.utils.status import GeolocationStatus
+
+# SQLite integers are signed 64-bit, so the unsigned halves of an IPv6 address are shifted
+# down by 2**63. The shift keeps the ordering, so a CIDR block is still one contiguous range.
+_HALF_OFFSET = 1 << 63
+_HALF_MASK = (1 << 64) - 1
+
+
+def address_key(address):
+    """
+    Convert an IP address to its (ip_version, ip_high, ip_low) index columns.
+
+    IPv4 addresses are stored as a plain integer in `ip_low`, IPv6 addresses as two 64-bit halves.
+
+    Args:
+        address (str | IPv4Address | IPv6Address): IP address.
+
+    Returns:
+        tuple[int, int, int]: Index columns.
+    """
+    address = ipaddress.ip_address(address)
+    value = int(address)
+    if address.version == 4:
+        return 4, 0, value
+    return 6, (value >> 64) - _HALF_OFFSET, (value & _HALF_MASK) - _HALF_OFFSET
+
+
+def network_bounds(network):
+    """
+    Get the first and last index keys of a CIDR block.
+
+    Args:
+        network (str | IPv4Network | IPv6Network): CIDR block or single address.
+
+    Returns:
+        tuple[int, tuple[int, int], tuple[int, int]]: IP version, first (high, low) and last (high, low).
+    """
+    network = ipaddress.ip_network(network, strict=False)
+    version, first_high, first_low = address_key(network.network_address)
+    _, last_high, last_low = address_key(network.broadcast_address)
+    return version, (first_high, first_low), (last_high, last_low)
+
+
+def parse_servers(servers: str):
+    """
+    Parse the legacy `servers` column, a stringified Python list of IP addresses.
+
+    Args:
+        servers (str): Column value.
+
+    Returns:
+        list[str]: Valid IP addresses.
+    """
+    if not servers:
+        return []
+    try:
+        candidates = ast.literal_eval(servers)
+    except (ValueError, SyntaxError):
+        return []
+
+    addresses = []
+    for candidate in candidates if isinstance(candidates, (list, tuple, set)) else []:
+        try:
+            addresses.append(str(ipaddress.ip_address(candidate)))
+        except ValueError:
+            logging.warning(f"Skipping invalid server address {candidate!r}")
+    return addresses
+
+
+def record_server_addresses(db: Session, entries):
+    """
+    Replace the indexed server addresses of a batch of requests.
+
+    The caller commits, so the index changes in the same transaction as the request rows.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        entries (Iterable[tuple[str, str, Iterable[str]]]): (request ID, domain, resolved server IPs) triples.
+    """
+    entries = list(entries)
+    if not entries:
+        return
+    db.execute(delete(ServerAddressModel).where(
+        ServerAddressModel.request_id.in_([request_id for request_id, _, _ in entries])
+    ))
+
+    rows = []
+    for request_id, domain, servers in entries:
+        for server in set(servers):
+            ip_version, ip_high, ip_low = address_key(server)
+            rows.append({
+                "request_id": request_id,
+                "ip_version": ip_version,
+                "ip_high": ip_high,
+                "ip_low": ip_low,
+                "domain": domain,
+            })
+    if rows:
+        db.execute(insert(ServerAddressModel), rows)
+
+
+def domains_in_network(db: Session, network):
+    """
+    Get the domains hosted on any address of a CIDR block, as a range scan on the address index.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        network (str | IPv4Network | IPv6Network): CIDR block or single address.
+
+    Returns:
+        list[str]: Distinct domain names, sorted.
+    """
+    ip_version, first, last = network_bounds(network)
+    address = tuple_(ServerAddressModel.ip_high, ServerAddressModel.ip_low)
+
+    return db.execute(
+        select(ServerAddressModel.domain)
+        .where(ServerAddressModel.ip_version == ip_version, address.between(tuple_(*first), tuple_(*last)))
+        .distinct()
+        .order_by(ServerAddressModel.domain)
+    ).scalars().all()
+
+
+def backfill_server_addresses(db: Session, batch_size: int = 1000):
+    """
+    Index the servers of resolved requests stored before the address index existed.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        batch_size (int): Number of requests indexed per transaction.
+
+    Returns:
+        int: Number of requests indexed.
+    """
+    indexed = 0
+    last_id = ""
+    while True:
+        batch = db.execute(
+            select(GeolocationRequestModel.id, GeolocationRequestModel.domain, GeolocationRequestModel.servers)
+            .where(
+                GeolocationRequestModel.id > last_id,
+                GeolocationRequestModel.status == GeolocationStatus.RESOLVED,
+                GeolocationRequestModel.servers != "",
+                ~exists().where(ServerAddressModel.request_id == GeolocationRequestModel.id),
+            )
+            .order_by(GeolocationRequestModel.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return indexed
+
+        entries = [(request_id, domain, parse_servers(servers)) for request_id, domain, servers in batch]
+        entries = [entry for entry in entries if entry[2]]
+        record_server_addresses(db, entries)
+        db.commit()
+        indexed += len(entries)
+        last_id = batch[-1].id
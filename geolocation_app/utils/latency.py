@@ -0,0 +1,148 @@
+import math
+import threading
+import time
+from collections import Counter, deque
+from datetime import timedelta
+
+from geolocation_app.utils.consts import LATENCY_RETENTION_MINUTES
+
+# Lifecycle timestamps of a request, in order.
+CREATED = "created"
+CLAIMED = "claimed"
+DNS_DONE = "dns_done"
+GEO_DONE = "geo_done"
+PERSISTED = "persisted"
+
+# Stage name, candidate start timestamps (the first present one is used) and end timestamp.
+STAGES = (
+    ("queue", (CREATED,), CLAIMED),
+    ("dns", (CLAIMED,), DNS_DONE),
+    ("geo", (DNS_DONE,), GEO_DONE),
+    ("write", (GEO_DONE, DNS_DONE), PERSISTED),
+    ("end_to_end", (CREATED,), PERSISTED),
+)
+
+# Buckets grow by 10%, so a percentile is reported within 10% of the exact value.
+GROWTH = 1.1
+_LOG_GROWTH = math.log(GROWTH)
+
+
+def bucket_index(milliseconds: float):
+    """
+    Index of the log-scale bucket holding a duration; bucket 0 holds everything up to 1 ms.
+    """
+    if milliseconds <= 1:
+        return 0
+    return math.ceil(math.log(milliseconds) / _LOG_GROWTH)
+
+
+def bucket_upper_bound(index: int):
+    """
+    Largest duration in milliseconds held by a bucket.
+    """
+    return GROWTH ** index
+
+
+def stage_durations(timings):
+    """
+    Compute the duration of each lifecycle stage.
+
+    Args:
+        timings (dict[str, datetime]): Lifecycle timestamps, stages whose timestamps are missing are skipped.
+
+    Returns:
+        dict[str, float]: Duration of each stage in milliseconds.
+    """
+    durations = {}
+    for stage, starts, end in STAGES:
+        start = next((timings[name] for name in starts if timings.get(name)), None)
+        if start and timings.get(end):
+            durations[stage] = max(0.0, (timings[end] - start).total_seconds() * 1000)
+    return durations
+
+
+class _Slice:
+    __slots__ = ("minute", "counts", "totals", "maxima")
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.counts = {stage: Counter() for stage, _, _ in STAGES}
+        self.totals = Counter()
+        self.maxima = Counter()
+
+
+class LatencyHistograms:
+    """
+    Rolling per-stage latency histograms with log-scale buckets, kept in one slice per minute.
+
+    Memory is bounded by the retention (in minutes) times the number of distinct buckets, which is
+    about 25 per decade of latency.
+    """
+
+    def __init__(self, retention_minutes: int = LATENCY_RETENTION_MINUTES):
+        self.retention_minutes = retention_minutes
+        self._slices = deque()
+        self._lock = threading.Lock()
+
+    def record(self, timings):
+        """
+        Record the stage durations of one request.
+
+        Args:
+            timings (dict[str, datetime]): Lifecycle timestamps of the request.
+        """
+        durations = stage_durations(timings)
+        minute = int(time.time() // 60)
+        with self._lock:
+            if not self._slices or self._slices[-1].minute != minute:
+                self._slices.append(_Slice(minute))
+                while self._slices[0].minute <= minute - self.retention_minutes:
+                    self._slices.popleft()
+            current = self._slices[-1]
+            for stage, milliseconds in durations.items():
+                current.counts[stage][bucket_index(milliseconds)] += 1
+                current.totals[stage] += milliseconds
+                current.maxima[stage] = max(current.maxima[stage], milliseconds)
+
+    def summary(self, window: timedelta, percentiles=(50, 90, 99)):
+        """
+        Summarize the latencies of the requests persisted over a trailing window.
+
+        Args:
+            window (timedelta): Length of the window, rounded up to whole minutes.
+            percentiles (Iterable[float]): Percentiles to report.
+
+        Returns:
+            dict: Per stage, the request count, mean, requested percentiles and maximum, in milliseconds.
+        """
+        since = int(time.time() // 60) - math.ceil(window.total_seconds() / 60)
+        counts = {stage: Counter() for stage, _, _ in STAGES}
+        totals = Counter()
+        maxima = Counter()
+        with self._lock:
+            for current in self._slices:
+                if current.minute <= since:
+                    continue
+                for stage in counts:
+                    counts[stage].update(current.counts[stage])
+                    maxima[stage] = max(maxima[stage], current.maxima[stage])
+                totals.update(current.totals)
+
+        summary = {}
+        for stage, buckets in counts.items():
+            count = sum(buckets.values())
+            entry = {"count": count}
+            if count:
+                entry["mean_ms"] = round(totals[stage] / count, 1)
+                ordered = sorted(buckets.items())
+                for percentile in percentiles:
+                    rank = math.ceil(count * percentile / 100)
+                    seen = 0
+                    for index, bucket_count in ordered:
+                        seen += bucket_count
+                        if seen >= rank:
+                            entry[f"p{percentile:g}_ms"] = round(min(bucket_upper_bound(index), maxima[stage]), 1)
+                            break
+                entry["max_ms"] = round(maxima[stage], 1)
+            summary[stage] = entry
+        return summary
@@ -0,0 +1,147 @@
+from sqlalchemy import delete, exists, insert, select
+from sqlalchemy.orm import Session
+
+from geolocation_app.utils.countries import country_code, normalize
+from geolocation_app.utils.db_handler import GeolocationRequestModel, LocationIndexModel
+from geolocation_app.utils.status import GeolocationStatus
+
+
+def parse_locations(locations: str):
+    """
+    Parse the `locations` column, a ", "-separated list of "country/region" entries.
+
+    Args:
+        locations (str): Column value.
+
+    Returns:
+        list[tuple[str, str]]: (alpha-2 country code, region) pairs, skipping unknown countries.
+    """
+    parsed = []
+    for location in (locations or "").split(", "):
+        country, _, region = location.partition("/")
+        code = country_code(country) if country else None
+        if code:
+            parsed.append((code, region))
+    return parsed
+
+
+def record_locations(db: Session, entries):
+    """
+    Replace the indexed locations of a batch of requests.
+
+    The caller commits, so the index changes in the same transaction as the request rows.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        entries (Iterable[tuple[str, str, Iterable[tuple[str, str]]]]): (request ID, domain,
+            (alpha-2 country code, region) pairs) triples.
+    """
+    entries = list(entries)
+    if not entries:
+        return
+    db.execute(delete(LocationIndexModel).where(
+        LocationIndexModel.request_id.in_([request_id for request_id, _, _ in entries])
+    ))
+
+    rows = {}
+    for request_id, domain, locations in entries:
+        for code, region in locations:
+            region_key = normalize(region or "")
+            rows[(request_id, code.upper(), region_key)] = {
+                "request_id": request_id,
+                "country_code": code.upper(),
+                "region_key": region_key,
+                "region": region or "",
+                "domain": domain,
+            }
+    if rows:
+        db.execute(insert(LocationIndexModel), list(rows.values()))
+
+
+def _prefix_range(column, prefix: str):
+    # Range form of `LIKE 'prefix%'` that SQLite can always answer from the index.
+    return column >= prefix, column < prefix + "\U0010ffff"
+
+
+def domains_in_location(db: Session, code: str, region: str = None, region_prefix: bool = False):
+    """
+    Get the domains located in a country, or in a region of a country.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        code (str): Alpha-2 country code.
+        region (str, optional): Region name, matched case- and accent-insensitively.
+        region_prefix (bool): Match regions starting with `region` instead of equal to it.
+
+    Returns:
+        list[str]: Distinct domain names, sorted.
+    """
+    conditions = [LocationIndexModel.country_code == code]
+    if region:
+        region_key = normalize(region)
+        if region_prefix:
+            conditions.extend(_prefix_range(LocationIndexModel.region_key, region_key))
+        else:
+            conditions.append(LocationIndexModel.region_key == region_key)
+
+    return db.execute(
+        select(LocationIndexModel.domain).where(*conditions).distinct().order_by(LocationIndexModel.domain)
+    ).scalars().all()
+
+
+def suggest_regions(db: Session, code: str, prefix: str = "", limit: int = 10):
+    """
+    Autocomplete the regions of a country by prefix.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        code (str): Alpha-2 country code.
+        prefix (str): Beginning of the region name.
+        limit (int): Maximum number of suggestions.
+
+    Returns:
+        list[str]: Region names.
+    """
+    rows = db.execute(
+        select(LocationIndexModel.region_key, LocationIndexModel.region)
+        .where(LocationIndexModel.country_code == code, *_prefix_range(LocationIndexModel.region_key, normalize(prefix)))
+        .group_by(LocationIndexModel.region_key)
+        .order_by(LocationIndexModel.region_key)
+        .limit(limit)
+    ).all()
+    return [region for _, region in rows]
+
+
+def backfill_location_index(db: Session, batch_size: int = 1000):
+    """
+    Index the locations of resolved requests stored before the location index existed.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        batch_size (int): Number of requests indexed per transaction.
+
+    Returns:
+        int: Number of requests indexed.
+    """
+    indexed = 0
+    last_id = ""
+    while True:
+        batch = db.execute(
+            select(GeolocationRequestModel.id, GeolocationRequestModel.domain, GeolocationRequestModel.locations)
+            .where(
+                GeolocationRequestModel.id > last_id,
+                GeolocationRequestModel.status == GeolocationStatus.RESOLVED,
+                ~exists().where(LocationIndexModel.request_id == GeolocationRequestModel.id),
+            )
+            .order_by(GeolocationRequestModel.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return indexed
+
+        entries = [(request_id, domain, parse_locations(locations)) for request_id, domain, locations in batch]
+        entries = [entry for entry in entries if entry[2]]
+        record_locations(db, entries)
+        db.commit()
+        indexed += len(entries)
+        last_id = batch[-1].id
@@ -0,0 +1,265 @@
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from geolocation_app.utils.consts import (
+    LOG_BACKUP_COUNT,
+    LOG_DIR,
+    LOG_LEVEL,
+    LOG_MAX_BYTES,
+    LOG_QUEUE_SIZE,
+    LOG_RATE_BURST,
+    LOG_RATE_PER_SECOND,
+    LOG_SAMPLE_EVERY,
+)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# ID of the HTTP request or geolocation request being handled, attached to every record logged for it.
+request_id_var = ContextVar("request_id", default=None)
+
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(request_id: str):
+    """
+    Attach a request ID to the records logged inside the block.
+    """
+    token = request_id_var.set(request_id)
+    try:
+        yield
+    finally:
+        request_id_var.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the service name, request ID and suppressed record count when set.
+    """
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for field in ("request_id", "suppressed"):
+            if getattr(record, field, None):
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Rate-limit records per call site (logger, file and line) with a token bucket.
+
+    Past `burst` records at more than `rate` per second, only one record in `sample_every` is kept and
+    carries the number of records dropped before it, so a flood of per-IP failures costs a few lines.
+    CRITICAL records are never dropped.
+    """
+
+    def __init__(self, rate: float = LOG_RATE_PER_SECOND, burst: int = LOG_RATE_BURST,
+                 sample_every: int = LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample_every = sample_every
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.CRITICAL:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, dropped = self._sites.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                keep = True
+            else:
+                dropped += 1
+                keep = dropped >= self.sample_every
+                if keep:
+                    dropped -= 1
+            if keep:
+                record.suppressed = dropped
+                dropped = 0
+            self._sites[key] = (tokens, now, dropped)
+        return keep
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copy the current request ID onto the record, in the thread that logs it.
+    """
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler that drops records instead of blocking when the writer thread falls behind.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the arguments and render the traceback here, the writer thread does the formatting.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = _TRACEBACK_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(service: str, level: str = LOG_LEVEL, log_dir: str = LOG_DIR):
+    """
+    Route the root logger through a bounded queue to a background writer thread.
+
+    The logging thread only formats the message and enqueues it. The writer prints it to the console and
+    appends it as JSON to `<log_dir>/<service>.log`, rotated by size. Calling this again is a no-op.
+
+    Args:
+        service (str): Service name, used for the log file and the `service` field.
+        level (str): Root log level.
+        log_dir (str): Directory of the log file.
+
+    Returns:
+        QueueListener: Running writer.
+    """
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return _listener
+
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] - %(message)s"))
+        log_file = RotatingFileHandler(
+            os.path.join(log_dir, f"{service}.log"), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+            encoding="utf-8", delay=True,
+        )
+        log_file.setFormatter(JsonFormatter(service))
+
+        _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _handler.addFilter(RateLimitFilter())
+        _handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level)
+
+        _listener = QueueListener(_handler.queue, console, log_file)
+        _listener.start()
+        return _listener
+
+
+def stop_logging():
+    """
+    Write the queued records and stop the writer thread.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def logging_stats():
+    """
+    Get the state of the logging queue.
+
+    Returns:
+        dict: Records waiting to be written and records dropped because the queue was full.
+    """
+    if _handler is None:
+        return {"configured": False}
+    return {"configured": True, "queued": _handler.queue.qsize(), "dropped": _handler.dropped}
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware that takes the request ID from the X-Request-ID header, or generates one, sets it for the
+    records logged while handling the request, and returns it in the response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = REQUEST_ID_HEADER.lower().encode()
+        request_id = next(
+            (value.decode("latin-1") for name, value in scope["headers"] if name == header), None
+        ) or uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (header, request_id.encode("latin-1"))]
+            await send(message)
+
+        with log_context(request_id):
+            await self.app(scope, receive, send_with_request_id)
+
+
+def use_structured_logging(app, service: str):
+    """
+    Configure the logging pipeline when a service starts, correlate its records by request ID, and expose
+    the logging queue state at GET /logging/stats.
+
+    Args:
+        app (FastAPI): Service application.
+        service (str): Service name.
+    """
+    async def get_logging_stats():
+        """
+        Get the number of queued and dropped log records.
+        """
+        return logging_stats()
+
+    app.add_middleware(RequestIdMiddleware)
+    app.add_event_handler("startup", lambda: configure_logging(service))
+    app.add_event_handler("shutdown", stop_logging)
+    app.add_api_route("/logging/stats", get_logging_stats, methods=["GET"], response_model=dict)
@@ -1,5 +1,7 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import AnyHttpUrl, BaseModel
+from typing import List, Literal, Optional
+
+from geolocation_app.utils.status import RequestPriority
 
 
 class GeolocationResponse(BaseModel):
@@ -8,6 +10,12 @@ class GeolocationResponse(BaseModel):
 
 class GeolocationRequestParams(BaseModel):
     domain: str
+    priority: Literal[RequestPriority.INTERACTIVE, RequestPriority.BULK] = RequestPriority.INTERACTIVE
+    callback_url: Optional[AnyHttpUrl] = None
+
+
+class CallbackSubscriptionParams(BaseModel):
+    url: AnyHttpUrl
 
 
 class GeolocationStatusRequestModel(BaseModel):
@@ -0,0 +1,194 @@
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, desc, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from geolocation_app.utils.db_handler import PopularityBucketModel
+
+DOMAIN = "domain"
+SERVER = "server"
+
+MINUTE = "minute"
+HOUR = "hour"
+DAY = "day"
+
+BUCKET_SIZES = {
+    MINUTE: timedelta(minutes=1),
+    HOUR: timedelta(hours=1),
+    DAY: timedelta(days=1),
+}
+
+# Buckets older than the given age are folded into the next coarser granularity.
+ROLLUPS = (
+    (MINUTE, HOUR, timedelta(hours=2)),
+    (HOUR, DAY, timedelta(days=2)),
+)
+
+# Day buckets older than this are deleted, which is also the longest window that can be answered.
+RETENTION = timedelta(days=35)
+
+NAMED_WINDOWS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+WINDOW_UNITS = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+WINDOW_PATTERN = re.compile(r"^(\d+)([mhdw])$")
+
+
+def parse_window(window: str):
+    """
+    Parse a popularity window such as "hour", "day", "week", "15m", "6h" or "7d".
+
+    Args:
+        window (str): Window expression.
+
+    Returns:
+        timedelta: Length of the window.
+
+    Raises:
+        ValueError: If the expression is invalid or longer than the bucket retention.
+    """
+    if window in NAMED_WINDOWS:
+        return NAMED_WINDOWS[window]
+
+    match = WINDOW_PATTERN.match(window)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid window: {window}")
+
+    length = timedelta(**{WINDOW_UNITS[match.group(2)]: int(match.group(1))})
+    if length > RETENTION:
+        raise ValueError(f"Window {window} is longer than the bucket retention of {RETENTION.days} days")
+    return length
+
+
+def bucket_start(when: datetime, granularity: str):
+    """
+    Truncate a timestamp to the start of its bucket.
+
+    Args:
+        when (datetime): Timestamp to truncate.
+        granularity (str): Bucket granularity.
+
+    Returns:
+        datetime: Start of the bucket containing `when`.
+    """
+    if granularity == MINUTE:
+        return when.replace(second=0, microsecond=0)
+    if granularity == HOUR:
+        return when.replace(minute=0, second=0, microsecond=0)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _upsert_counts(db: Session, granularity: str, counts: Counter):
+    """
+    Add counts to buckets, creating missing buckets.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        granularity (str): Granularity of the buckets.
+        counts (Counter): Counts keyed by (kind, bucket_start, key).
+    """
+    if not counts:
+        return
+
+    statement = insert(PopularityBucketModel)
+    statement = statement.on_conflict_do_update(
+        index_elements=["kind", "granularity", "bucket_start", "key"],
+        set_={"hits": PopularityBucketModel.hits + statement.excluded["hits"]},
+    )
+    db.execute(statement, [
+        {"kind": kind, "granularity": granularity, "bucket_start": start, "key": key, "hits": hits}
+        for (kind, start, key), hits in counts.items()
+    ])
+
+
+def record_hits(db: Session, kind: str, keys, when: datetime = None):
+    """
+    Count one hit for each key in the current minute bucket.
+
+    The caller commits, so the counters are updated in the same transaction as the data they count.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        kind (str): DOMAIN or SERVER.
+        keys (Iterable[str]): Keys that were hit.
+        when (datetime, optional): Time of the hits, defaults to now (UTC).
+    """
+    start = bucket_start(when or datetime.utcnow(), MINUTE)
+    _upsert_counts(db, MINUTE, Counter((kind, start, key) for key in keys))
+
+
+def rollup_buckets(db: Session, now: datetime = None):
+    """
+    Fold old fine-grained buckets into coarser ones and delete buckets past retention.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        now (datetime, optional): Current time (UTC).
+    """
+    now = now or datetime.utcnow()
+
+    for fine, coarse, keep in ROLLUPS:
+        cutoff = bucket_start(now - keep, coarse)
+        old_buckets = (
+            PopularityBucketModel.granularity == fine,
+            PopularityBucketModel.bucket_start < cutoff,
+        )
+        rows = db.execute(
+            select(
+                PopularityBucketModel.kind,
+                PopularityBucketModel.bucket_start,
+                PopularityBucketModel.key,
+                PopularityBucketModel.hits,
+            ).where(*old_buckets)
+        ).all()
+
+        counts = Counter()
+        for kind, start, key, hits in rows:
+            counts[(kind, bucket_start(start, coarse), key)] += hits
+
+        _upsert_counts(db, coarse, counts)
+        db.execute(delete(PopularityBucketModel).where(*old_buckets))
+
+    db.execute(delete(PopularityBucketModel).where(
+        PopularityBucketModel.granularity == DAY,
+        PopularityBucketModel.bucket_start < bucket_start(now - RETENTION, DAY),
+    ))
+    db.commit()
+
+
+def most_popular(db: Session, kind: str, window: timedelta, n: int, now: datetime = None):
+    """
+    Get the keys with the most hits over a trailing window.
+
+    Every hit lives in exactly one bucket, so the window is answered by summing the buckets
+    that start inside it, at the resolution of the oldest bucket granularity it covers.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        kind (str): DOMAIN or SERVER.
+        window (timedelta): Length of the window.
+        n (int): Number of keys to return.
+        now (datetime, optional): End of the window (UTC).
+
+    Returns:
+        list[tuple[str, int]]: (key, hits) pairs, most popular first.
+    """
+    since = (now or datetime.utcnow()) - window
+    hits = func.sum(PopularityBucketModel.hits).label("hits")
+
+    return db.execute(
+        select(PopularityBucketModel.key, hits)
+        .where(
+            PopularityBucketModel.kind == kind,
+            PopularityBucketModel.granularity.in_(BUCKET_SIZES),
+            PopularityBucketModel.bucket_start >= bucket_start(since, MINUTE),
+        )
+        .group_by(PopularityBucketModel.key)
+        .order_by(desc("hits"))
+        .limit(n)
+    ).all()
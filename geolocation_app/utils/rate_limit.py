@@ -0,0 +1,225 @@
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.orm import Session
+
+from geolocation_app.utils.auth import token_subject
+from geolocation_app.utils.db_handler import GeolocationRequestModel, RateLimitBucketModel
+from geolocation_app.utils.status import GeolocationStatus
+
+
+def client_key(authorization: str = None, host: str = None):
+    """
+    Identify the client of a request, by user when it sends a valid access token and by address otherwise.
+
+    An invalid or expired token counts as no token, so made-up tokens cannot be used to get fresh buckets.
+
+    Args:
+        authorization (str, optional): Value of the Authorization header.
+        host (str, optional): Client address.
+
+    Returns:
+        str: Client key, never containing the token itself.
+    """
+    user = token_subject(authorization)
+    if user:
+        return f"user:{user}"
+    return f"ip:{host or 'unknown'}"
+
+
+class TokenBucketLimiter:
+    """
+    In-process token-bucket rate limiter keyed by client.
+
+    Each client may burst `burst` requests and is refilled at `rate` requests per second. Only the
+    `max_clients` most recently seen clients are tracked, so memory stays bounded.
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str):
+        """
+        Take one token from a client's bucket.
+
+        Args:
+            key (str): Client key.
+
+        Returns:
+            tuple[bool, float]: Whether the request is allowed, and seconds until a token is available if not.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+        return allowed, 0.0 if allowed else (1 - tokens) / self.rate
+
+
+class SharedTokenBucketLimiter:
+    """
+    Token-bucket rate limiter whose buckets live in the shared database, for multi-worker deployments.
+
+    Refill and consumption happen in a single atomic UPSERT, so concurrent workers never over-admit.
+    Buckets idle long enough to be full again are the same as no bucket, and are deleted every
+    `prune_interval` seconds.
+    """
+
+    _CONSUME = text(
+        "INSERT INTO rate_limit_buckets (key, tokens, updated_at) VALUES (:key, :burst - 1, :now) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "tokens = MIN(:burst, tokens + (:now - updated_at) * :rate) - 1, updated_at = :now "
+        "WHERE MIN(:burst, tokens + (:now - updated_at) * :rate) >= 1"
+    )
+
+    def __init__(self, session_factory, rate: float, burst: int, prune_interval: float = 60.0):
+        self.session_factory = session_factory
+        self.rate = rate
+        self.burst = burst
+        self.prune_interval = prune_interval
+        self._pruned_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str):
+        """
+        Take one token from a client's bucket.
+
+        Args:
+            key (str): Client key.
+
+        Returns:
+            tuple[bool, float]: Whether the request is allowed, and seconds until a token is available if not.
+        """
+        now = time.time()
+        params = {"key": key, "now": now, "rate": self.rate, "burst": self.burst}
+        db = self.session_factory()
+        try:
+            if self._prune_due():
+                self.prune(db, now)
+            allowed = db.execute(self._CONSUME, params).rowcount == 1
+            db.commit()
+            if allowed:
+                return True, 0.0
+            tokens, updated = db.execute(
+                select(RateLimitBucketModel.tokens, RateLimitBucketModel.updated_at)
+                .where(RateLimitBucketModel.key == key)
+            ).one()
+        finally:
+            db.close()
+
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        return False, max(0.0, (1 - tokens) / self.rate)
+
+    def _prune_due(self):
+        with self._lock:
+            if time.monotonic() - self._pruned_at < self.prune_interval:
+                return False
+            self._pruned_at = time.monotonic()
+            return True
+
+    def prune(self, db: Session, now: float = None):
+        """
+        Delete the buckets that have refilled completely since they were last used.
+
+        Args:
+            db (Session): SQLAlchemy database session.
+            now (float, optional): Current time, in seconds since the epoch.
+
+        Returns:
+            int: Number of buckets deleted.
+        """
+        idle_since = (now or time.time()) - self.burst / self.rate
+        deleted = db.execute(delete(RateLimitBucketModel).where(RateLimitBucketModel.updated_at <= idle_since))
+        db.commit()
+        return deleted.rowcount
+
+
+class PendingBacklogGauge:
+    """
+    Cached count of Pending requests, refreshed at most every `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 1.0):
+        self.ttl = ttl
+        self._value = 0
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, db: Session):
+        """
+        Get the number of Pending requests.
+
+        Args:
+            db (Session): SQLAlchemy database session, only used when the cached value expired.
+
+        Returns:
+            int: Pending backlog size.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._expires:
+                return self._value
+            self._expires = now + self.ttl
+
+        value = db.execute(
+            select(func.count()).where(GeolocationRequestModel.status == GeolocationStatus.PENDING)
+        ).scalar_one()
+        self._value = value
+        return value
+
+    @property
+    def last(self):
+        """
+        Last observed backlog size, without querying.
+        """
+        return self._value
+
+
+class AdmissionStats:
+    """
+    Thread-safe counters of admitted and rejected requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._rejected_clients = Counter()
+
+    def record(self, outcome: str, client: str = None):
+        with self._lock:
+            self._counts[outcome] += 1
+            if client and outcome != "accepted":
+                self._rejected_clients[client] += 1
+                if len(self._rejected_clients) > 10000:
+                    self._rejected_clients = Counter(dict(self._rejected_clients.most_common(1000)))
+
+    def snapshot(self, top: int = 10):
+        with self._lock:
+            return {
+                "accepted": self._counts["accepted"],
+                "rejected_rate_limited": self._counts["rate_limited"],
+                "rejected_backpressure": self._counts["backpressure"],
+                "top_rejected_clients": [
+                    {"client": client, "rejected": count} for client, count in self._rejected_clients.most_common(top)
+                ],
+            }
+
+
+def retry_after_header(seconds: float):
+    """
+    Format a Retry-After header, rounding up to whole seconds.
+    """
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
@@ -0,0 +1,309 @@
+import gzip
+import json
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from geolocation_app.utils.consts import (
+    ANALYZE_ROWS_LIMIT,
+    ARCHIVE_RETENTION_DAYS,
+    RETENTION_BATCH_PAUSE_SECONDS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_DAYS,
+    RETENTION_DIR,
+    VACUUM_PAGES_PER_STEP,
+)
+from geolocation_app.utils.db_handler import (
+    ArchiveSegmentModel,
+    ArchivedCountModel,
+    ArchivedRequestModel,
+    GeolocationRequestModel,
+    GeolocationRequestVersionModel,
+    LocationIndexModel,
+    ServerAddressModel,
+)
+from geolocation_app.utils.ip_index import parse_servers
+from geolocation_app.utils.popularity_buckets import DOMAIN, SERVER
+from geolocation_app.utils.status import GeolocationStatus
+
+# Tables keyed by request, archived or deleted along with the request rows.
+REQUEST_TABLES = (ServerAddressModel.__table__, LocationIndexModel.__table__)
+
+
+def segment_name(when: datetime):
+    """
+    Name of the segment file archived requests are appended to, one per day of archiving.
+    """
+    return f"requests-{when.strftime('%Y-%m-%d')}.ndjson.gz"
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def append_segment(path: str, records):
+    """
+    Append records to a segment as one more gzip member, and fsync it.
+
+    Segments are only ever appended to. A reader sees the concatenated members as one NDJSON stream.
+
+    Args:
+        path (str): Segment file.
+        records (list[dict]): Records to append.
+    """
+    lines = "".join(json.dumps(record, default=_json_value) + "\n" for record in records)
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="ab") as compressed:
+            compressed.write(lines.encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def read_segment(path: str):
+    """
+    Read the records of a segment.
+
+    A request archived again after an interrupted run appears twice, readers should keep one per `id`.
+
+    Args:
+        path (str): Segment file.
+
+    Yields:
+        dict: Archived request rows, with their previous versions under "versions".
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as segment:
+        for line in segment:
+            yield json.loads(line)
+
+
+def archived_segment(db: Session, request_id: str):
+    """
+    Get the segment a request was archived to, None if it was never archived.
+    """
+    return db.execute(select(ArchivedRequestModel.segment).where(ArchivedRequestModel.id == request_id)).scalar()
+
+
+def fold_archived_counts(db: Session, rows):
+    """
+    Add archived requests to the all-time domain and server counts.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        rows (list[dict]): Archived request rows.
+    """
+    counts = Counter((DOMAIN, row["domain"]) for row in rows if row["domain"])
+    counts.update(
+        (SERVER, server) for row in rows if row["status"] == GeolocationStatus.RESOLVED
+        for server in parse_servers(row["servers"])
+    )
+    if not counts:
+        return
+
+    statement = insert(ArchivedCountModel)
+    statement = statement.on_conflict_do_update(
+        index_elements=["kind", "key"],
+        set_={"requests": ArchivedCountModel.requests + statement.excluded["requests"]},
+    )
+    db.execute(statement, [{"kind": kind, "key": key, "requests": requests} for (kind, key), requests in counts.items()])
+
+
+def archive_batch(db: Session, cutoff: datetime, archive_dir: str, cursor=None, batch_size: int = RETENTION_BATCH_SIZE):
+    """
+    Archive and delete one batch of requests created before `cutoff`.
+
+    The rows are appended to today's segment and fsynced first, then their counts are folded, the rows
+    deleted and their IDs recorded in `archived_requests` in one short transaction. If that transaction
+    fails, the rows stay in place and are archived again by the next run.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        cutoff (datetime): Requests created before this time are archived.
+        archive_dir (str): Directory of the segment files.
+        cursor (tuple, optional): (created_at, id) of the last request examined, to continue after it.
+        batch_size (int): Maximum number of requests in the batch.
+
+    Returns:
+        tuple: Number of requests archived and the cursor of the next batch, None when done.
+    """
+    requests_table = GeolocationRequestModel.__table__
+    query = (
+        select(requests_table)
+        .where(requests_table.c.created_at < cutoff, requests_table.c.status != GeolocationStatus.PENDING)
+        .order_by(requests_table.c.created_at, requests_table.c.id)
+        .limit(batch_size)
+    )
+    if cursor is not None:
+        query = query.where(tuple_(requests_table.c.created_at, requests_table.c.id) > tuple_(*cursor))
+    rows = [dict(row) for row in db.execute(query).mappings().all()]
+    if not rows:
+        db.rollback()
+        return 0, None
+
+    ids = [row["id"] for row in rows]
+    versions_table = GeolocationRequestVersionModel.__table__
+    versions = {}
+    for version in db.execute(select(versions_table).where(versions_table.c.request_id.in_(ids))).mappings():
+        versions.setdefault(version["request_id"], []).append(
+            {key: value for key, value in version.items() if key != "request_id"}
+        )
+    db.rollback()
+
+    now = datetime.utcnow()
+    name = segment_name(now)
+    os.makedirs(archive_dir, exist_ok=True)
+    append_segment(os.path.join(archive_dir, name), [{**row, "versions": versions.get(row["id"], [])} for row in rows])
+
+    fold_archived_counts(db, rows)
+    for table in (*REQUEST_TABLES, versions_table):
+        db.execute(delete(table).where(table.c.request_id.in_(ids)))
+    db.execute(delete(requests_table).where(requests_table.c.id.in_(ids)))
+    db.execute(
+        insert(ArchivedRequestModel).on_conflict_do_nothing(),
+        [{"id": request_id, "segment": name, "archived_at": now} for request_id in ids],
+    )
+
+    statement = insert(ArchiveSegmentModel)
+    statement = statement.on_conflict_do_update(
+        index_elements=["name"],
+        set_={
+            "rows": ArchiveSegmentModel.rows + statement.excluded["rows"],
+            "last_created_at": statement.excluded["last_created_at"],
+            "updated_at": statement.excluded["updated_at"],
+        },
+    )
+    db.execute(statement, {
+        "name": name, "rows": len(rows), "first_created_at": rows[0]["created_at"],
+        "last_created_at": rows[-1]["created_at"], "updated_at": now,
+    })
+    db.commit()
+
+    next_cursor = (rows[-1]["created_at"], rows[-1]["id"]) if len(rows) == batch_size else None
+    return len(rows), next_cursor
+
+
+def archive_old_requests(db: Session, now: datetime = None, days: int = RETENTION_DAYS,
+                         archive_dir: str = RETENTION_DIR, batch_size: int = RETENTION_BATCH_SIZE,
+                         pause: float = RETENTION_BATCH_PAUSE_SECONDS):
+    """
+    Move the requests older than the retention period out of the database, batch by batch.
+
+    Each batch is its own short transaction, with a pause between batches so the result writer is never
+    held off the write lock for long. Pending requests are kept whatever their age.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        now (datetime, optional): Current time (UTC).
+        days (int): Retention period in days.
+        archive_dir (str): Directory of the segment files.
+        batch_size (int): Requests per batch.
+        pause (float): Seconds to wait between batches.
+
+    Returns:
+        int: Number of requests archived.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    archived = 0
+    cursor = None
+    while True:
+        count, cursor = archive_batch(db, cutoff, archive_dir, cursor, batch_size)
+        archived += count
+        if cursor is None:
+            return archived
+        time.sleep(pause)
+
+
+def expire_segments(db: Session, now: datetime = None, days: int = ARCHIVE_RETENTION_DAYS,
+                    archive_dir: str = RETENTION_DIR, batch_size: int = RETENTION_BATCH_SIZE,
+                    pause: float = RETENTION_BATCH_PAUSE_SECONDS):
+    """
+    Delete the segments last appended to more than `days` ago, with the `archived_requests` rows pointing
+    to them, so the archive index stays bounded. Their requests are then unknown to the status service.
+
+    The rows are deleted in batches, then the segment is unlisted and its file removed.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        now (datetime, optional): Current time (UTC).
+        days (int): Segment retention period in days.
+        archive_dir (str): Directory of the segment files.
+        batch_size (int): Archived request rows deleted per transaction.
+        pause (float): Seconds to wait between batches.
+
+    Returns:
+        list[str]: Names of the expired segments.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    names = db.execute(
+        select(ArchiveSegmentModel.name)
+        .where(ArchiveSegmentModel.updated_at < cutoff)
+        .order_by(ArchiveSegmentModel.name)
+    ).scalars().all()
+    db.rollback()
+
+    archived = ArchivedRequestModel.__table__
+    for name in names:
+        while True:
+            ids = select(archived.c.id).where(archived.c.segment == name).limit(batch_size)
+            deleted = db.execute(delete(archived).where(archived.c.id.in_(ids))).rowcount
+            db.commit()
+            if deleted < batch_size:
+                break
+            time.sleep(pause)
+        db.execute(delete(ArchiveSegmentModel).where(ArchiveSegmentModel.name == name))
+        db.commit()
+        try:
+            os.remove(os.path.join(archive_dir, name))
+        except FileNotFoundError:
+            pass
+    return names
+
+
+def compact_database(db: Session, pages_per_step: int = VACUUM_PAGES_PER_STEP,
+                     analyze_limit: int = ANALYZE_ROWS_LIMIT, pause: float = RETENTION_BATCH_PAUSE_SECONDS):
+    """
+    Return free pages to the file system with incremental VACUUM, then refresh the planner statistics.
+
+    Vacuuming runs a few pages per transaction. ANALYZE samples at most `analyze_limit` rows per index
+    (PRAGMA analysis_limit), so it stays fast on large tables.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        pages_per_step (int): Pages freed per transaction.
+        analyze_limit (int): Rows sampled per index by ANALYZE.
+        pause (float): Seconds to wait between vacuum steps.
+
+    Returns:
+        int: Number of pages returned to the file system.
+    """
+    connection = db.connection()
+    freed = 0
+    if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+        free_pages = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        while free_pages:
+            cursor = connection.connection.cursor()
+            try:
+                # The pragma frees one page per step, so it has to be stepped to the end.
+                cursor.execute(f"PRAGMA incremental_vacuum({int(pages_per_step)})").fetchall()
+            finally:
+                cursor.close()
+            db.commit()
+            connection = db.connection()
+            remaining = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if remaining >= free_pages:
+                break
+            freed += free_pages - remaining
+            free_pages = remaining
+            time.sleep(pause)
+    else:
+        logging.warning("Incremental auto-vacuum is off, run the schema upgrade to enable it.")
+
+    connection.exec_driver_sql(f"PRAGMA analysis_limit={int(analyze_limit)}")
+    connection.exec_driver_sql("ANALYZE")
+    db.commit()
+    return freed
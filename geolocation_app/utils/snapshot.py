@@ -0,0 +1,298 @@
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import cache
+
+from sqlalchemy import create_engine, delete, insert, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from geolocation_app.utils.consts import (
+    SNAPSHOT_ENABLED,
+    SNAPSHOT_MAX_AGE_SECONDS,
+    SNAPSHOT_REFRESH_SECONDS,
+    SNAPSHOT_RESEED_SECONDS,
+)
+from geolocation_app.utils.db_handler import (
+    DATABASE_URL,
+    ArchivedCountModel,
+    Base,
+    GeoRollupModel,
+    GeolocationRequestModel,
+    GeolocationRequestVersionModel,
+    LocationIndexModel,
+    PopularityBucketModel,
+    ServerAddressModel,
+    get_session,
+)
+from geolocation_app.utils.popularity_buckets import MINUTE, bucket_start
+
+# Writers stamp `updated_at` before they commit, so a refresh re-reads the last few seconds
+# to pick up rows that were not visible yet when the previous refresh ran.
+WATERMARK_LAG = timedelta(seconds=5)
+
+# Tables keyed by request, re-copied for the requests that changed since the watermark.
+REQUEST_TABLES = (
+    ServerAddressModel.__table__, LocationIndexModel.__table__, GeolocationRequestVersionModel.__table__
+)
+
+# Tables the query services read, the only ones copied (never the users table and its password hashes).
+SNAPSHOT_TABLES = (
+    GeolocationRequestModel.__table__,
+    *REQUEST_TABLES,
+    PopularityBucketModel.__table__,
+    GeoRollupModel.__table__,
+    ArchivedCountModel.__table__,
+)
+
+_ID_CHUNK = 500
+_generations = itertools.count()
+
+
+class ReadSnapshot:
+    """
+    In-memory copy of the shared database for read-only query services.
+
+    The copy is seeded with the tables the query services read, then refreshed every `refresh_interval`
+    seconds from the `updated_at` watermark: changed requests are upserted with their server address, location
+    index and version rows, and new minute popularity buckets and changed geographic rollup counters are
+    copied. Every `reseed_interval` seconds the copy is seeded again, which picks up deletes and popularity
+    rollups. Until then the pre-rollup minute buckets stay in memory, so windowed counts remain correct.
+
+    The copy is a named database of SQLite's in-memory VFS (memdb), so each session has its own connection
+    and reads run concurrently; a refresh only holds them off while it commits. A reseed builds a new copy
+    and swaps it in, sessions already open finish on the previous one. memdb databases are limited to 1 GiB,
+    past that seeding fails and reads are served from the database file.
+    """
+
+    def __init__(self, database_url: str = DATABASE_URL, refresh_interval: float = SNAPSHOT_REFRESH_SECONDS,
+                 max_age: float = SNAPSHOT_MAX_AGE_SECONDS, reseed_interval: float = SNAPSHOT_RESEED_SECONDS):
+        self.database_path = make_url(database_url).database
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.reseed_interval = reseed_interval
+        self.watermark = None
+        self.refreshed_at = None
+        self.seeded_at = None
+        self.last_error = None
+        self._engine = None
+        # Keeps the current memdb database alive while no session is open.
+        self._keeper = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="read-snapshot", daemon=True)
+
+    def start(self):
+        if self._thread.ident is None:
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(self.refresh_interval + 5)
+
+    @property
+    def age(self):
+        """
+        Seconds since the data was last read from the disk file, None before the first seed.
+        """
+        return None if self.refreshed_at is None else time.monotonic() - self.refreshed_at
+
+    @property
+    def fresh(self):
+        return self.age is not None and self.age <= self.max_age
+
+    def session(self):
+        """
+        Open a session on the in-memory copy, on a connection of its own.
+        """
+        return Session(bind=self._engine, autoflush=False)
+
+    def seed(self):
+        """
+        Replace the in-memory copy with a fresh copy of the snapshot tables of the database file.
+        """
+        started = time.monotonic()
+        watermark = datetime.utcnow() - WATERMARK_LAG
+
+        uri = f"file:/geo-snapshot-{next(_generations)}?vfs=memdb"
+        keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            engine = create_engine("sqlite://", poolclass=NullPool, creator=lambda: sqlite3.connect(
+                uri, uri=True, check_same_thread=False, timeout=30
+            ))
+            Base.metadata.create_all(engine, tables=SNAPSHOT_TABLES)
+            # The copy is attached to a connection on the file, an attached database uses the VFS of the
+            # connection's main database.
+            source = sqlite3.connect(f"file:{self.database_path}?mode=ro", uri=True)
+            try:
+                source.execute("ATTACH DATABASE ? AS snapshot", (uri,))
+                # One transaction, so all the tables are read from the same state of the file.
+                with source:
+                    for table in SNAPSHOT_TABLES:
+                        columns = ", ".join(f'"{column.name}"' for column in table.columns)
+                        source.execute(
+                            f'INSERT INTO snapshot."{table.name}" ({columns}) SELECT {columns} FROM main."{table.name}"'
+                        )
+            finally:
+                source.close()
+        except BaseException:
+            keeper.close()
+            raise
+
+        previous_engine, previous_keeper = self._engine, self._keeper
+        self._engine, self._keeper = engine, keeper
+        self.watermark = watermark
+        self.refreshed_at = self.seeded_at = started
+        if previous_engine is not None:
+            previous_engine.dispose()
+            previous_keeper.close()
+
+    def refresh(self):
+        """
+        Copy the rows changed since the watermark into the in-memory copy.
+
+        Returns:
+            int: Number of changed requests copied.
+        """
+        started = time.monotonic()
+        watermark = datetime.utcnow() - WATERMARK_LAG
+        requests_table = GeolocationRequestModel.__table__
+        buckets_table = PopularityBucketModel.__table__
+        rollups_table = GeoRollupModel.__table__
+
+        source = get_session()
+        try:
+            requests = source.execute(
+                select(requests_table).where(requests_table.c.updated_at > self.watermark)
+            ).mappings().all()
+            request_ids = [row["id"] for row in requests]
+            request_rows = {table: [] for table in REQUEST_TABLES}
+            for start in range(0, len(request_ids), _ID_CHUNK):
+                chunk = request_ids[start:start + _ID_CHUNK]
+                for table in REQUEST_TABLES:
+                    request_rows[table] += source.execute(
+                        select(table).where(table.c.request_id.in_(chunk))
+                    ).mappings().all()
+            buckets = source.execute(
+                select(buckets_table).where(
+                    buckets_table.c.granularity == MINUTE,
+                    buckets_table.c.bucket_start >= bucket_start(self.watermark, MINUTE),
+                )
+            ).mappings().all()
+            rollups = source.execute(
+                select(rollups_table).where(rollups_table.c.updated_at > self.watermark)
+            ).mappings().all()
+        finally:
+            source.close()
+
+        with self._engine.begin() as connection:
+            if requests:
+                connection.execute(insert(requests_table).prefix_with("OR REPLACE"), requests)
+            for start in range(0, len(request_ids), _ID_CHUNK):
+                chunk = request_ids[start:start + _ID_CHUNK]
+                for table in REQUEST_TABLES:
+                    connection.execute(delete(table).where(table.c.request_id.in_(chunk)))
+            for table, rows in request_rows.items():
+                if rows:
+                    connection.execute(insert(table), rows)
+            if buckets:
+                connection.execute(insert(buckets_table).prefix_with("OR REPLACE"), buckets)
+            if rollups:
+                connection.execute(insert(rollups_table).prefix_with("OR REPLACE"), rollups)
+        self.watermark = watermark
+        self.refreshed_at = started
+        return len(requests)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if self.seeded_at is None or time.monotonic() - self.seeded_at >= self.reseed_interval:
+                    self.seed()
+                else:
+                    self.refresh()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error(f"Failed to refresh the read snapshot: {e}")
+            self._stopped.wait(self.refresh_interval)
+
+    def stats(self):
+        """
+        Get the state of the snapshot.
+
+        Returns:
+            dict: Snapshot age, freshness bound, whether reads are served from it, and the last refresh error.
+        """
+        age = self.age
+        return {
+            "enabled": True,
+            "age_seconds": None if age is None else round(age, 3),
+            "max_age_seconds": self.max_age,
+            "serving": self.fresh,
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "last_error": self.last_error,
+        }
+
+
+@cache
+def get_snapshot():
+    """
+    Get the read snapshot of this process, None unless GEO_READ_SNAPSHOT=1.
+    """
+    return ReadSnapshot() if SNAPSHOT_ENABLED else None
+
+
+def get_read_db():
+    """
+    Session for read-only query services.
+
+    Served from the in-memory snapshot while it is within its freshness bound, and from the
+    database file otherwise (snapshot disabled, still seeding, or refreshes failing).
+    """
+    snapshot = get_snapshot()
+    if snapshot is not None and snapshot.fresh:
+        db = snapshot.session()
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+
+    db = get_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def use_read_snapshot(app):
+    """
+    Run the read snapshot alongside a query service and expose its age at GET /snapshot/stats.
+
+    Args:
+        app (FastAPI): Service application.
+    """
+    def start_snapshot():
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            snapshot.start()
+
+    def stop_snapshot():
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            snapshot.stop()
+
+    async def get_snapshot_stats():
+        """
+        Get the age and state of the in-memory read snapshot.
+        """
+        snapshot = get_snapshot()
+        return snapshot.stats() if snapshot is not None else {"enabled": False}
+
+    app.add_event_handler("startup", start_snapshot)
+    app.add_event_handler("shutdown", stop_snapshot)
+    app.add_api_route("/snapshot/stats", get_snapshot_stats, methods=["GET"], response_model=dict)
@@ -0,0 +1,73 @@
+import logging
+import os
+import subprocess
+import sys
+import time
+
+_IMPORTED_AT = time.monotonic()
+
+SERVICE_MODULES = (
+    "geolocation_app.country_app.country_app",
+    "geolocation_app.export_app.export_app",
+    "geolocation_app.login_app.login_app",
+    "geolocation_app.popularity_app.popularity_app",
+    "geolocation_app.request_app.geolocation_request_app",
+    "geolocation_app.resolution_app.geolocation_resolve_app",
+    "geolocation_app.server_app.server_app",
+    "geolocation_app.status_app.status_app",
+)
+
+
+def process_uptime():
+    """
+    Seconds since this process started, read from /proc where available.
+
+    Returns:
+        float: Process age, or the time since this module was imported on platforms without /proc.
+    """
+    try:
+        with open("/proc/self/stat") as stat:
+            # The command name may contain spaces, the fields after it are fixed.
+            started_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime:
+            system_uptime = float(uptime.read().split()[0])
+        return system_uptime - started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED_AT
+
+
+def report_startup_time(app, name: str):
+    """
+    Log how long a service took from process start until it is ready to serve.
+
+    Args:
+        app (FastAPI): Service application.
+        name (str): Service name used in the log line.
+    """
+    def log_startup_time():
+        logging.info(f"{name} ready in {process_uptime() * 1000:.0f} ms")
+
+    app.add_event_handler("startup", log_startup_time)
+
+
+def measure_import_time(module: str):
+    """
+    Measure the cold import time of a service module in a fresh interpreter.
+
+    Args:
+        module (str): Dotted module name.
+
+    Returns:
+        float: Import time in seconds.
+    """
+    code = (
+        "import time; started = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - started)"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    for service in SERVICE_MODULES:
+        print(f"{service:<60} {measure_import_time(service) * 1000:8.1f} ms")
@@ -5,3 +5,11 @@ class GeolocationStatus(str, Enum):
     PENDING = "Pending"
     RESOLVED = "Resolved"
     ERROR = "Error"
+    # Moved out of the database by retention, see geolocation_app.utils.retention.
+    ARCHIVED = "Archived"
+
+
+class RequestPriority(str, Enum):
+    INTERACTIVE = "interactive"
+    BULK = "bulk"
+    REFRESH = "refresh"
@@ -2,6 +2,9 @@
 
 export PYTHONPATH=/home/sidney/code/geo_fast
 
+# Create or upgrade the database schema before any service starts
+python geolocation_app/utils/db_handler.py
+
 # Run each app in the background
 python geolocation_app/country_app/country_app.py &
 python geolocation_app/login_app/login_app.py &
@@ -11,6 +14,8 @@ python geolocation_app/resolution_app/geolocation_resolve_app.py &
 python geolocation_app/server_app/server_app.py &
 python geolocation_app/status_app/status_app.py &
 python geolocation_app/test_app/test_app.py &
+python geolocation_app/test_app/webhook_sink.py &
+python geolocation_app/export_app/export_app.py &
 
 
 echo "All apps started."
\ No newline at end of file
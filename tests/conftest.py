@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+import pytest
+
+# Point the services at a throwaway database and directories before geolocation_app reads its settings.
+_TEST_DIR = tempfile.mkdtemp(prefix="geo-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_TEST_DIR}/test.db"
+os.environ["GEO_HEAVY_HITTERS_DIR"] = os.path.join(_TEST_DIR, "sketches")
+os.environ["GEO_RETENTION_DIR"] = os.path.join(_TEST_DIR, "archive")
+
+from geolocation_app.utils.db_handler import Base, get_engine, get_session, init_db  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    init_db()
+
+
+@pytest.fixture
+def db():
+    """
+    Session on an empty database, emptied again after the test.
+    """
+    session = get_session()
+    try:
+        yield session
+    finally:
+        session.close()
+        with get_engine().begin() as connection:
+            for table in reversed(Base.metadata.sorted_tables):
+                connection.execute(table.delete())
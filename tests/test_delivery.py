@@ -0,0 +1,148 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sqlalchemy import select
+
+from geolocation_app.resolution_app import delivery
+from geolocation_app.resolution_app.delivery import CallbackDeliveryWorker, retry_delay
+from geolocation_app.utils.consts import CALLBACK_ALLOWED_HOSTS, CALLBACK_BACKOFF_BASE_SECONDS
+from geolocation_app.utils.db_handler import CallbackOutboxModel
+
+
+@pytest.mark.parametrize("attempts", range(1, 12))
+def test_retry_delay_is_jittered_and_capped(attempts):
+    delays = [retry_delay(attempts, base=2, cap=300).total_seconds() for _ in range(200)]
+    assert all(0 <= delay <= min(300, 2 * 2 ** (attempts - 1)) for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def add_notifications(db, destination, count, attempts=0):
+    now = datetime.utcnow()
+    db.add_all(
+        CallbackOutboxModel(destination=destination, request_id=f"{destination}-{i}",
+                            payload=json.dumps({"request_id": i}), created_at=now, attempts=attempts,
+                            next_attempt_at=now)
+        for i in range(count)
+    )
+    db.commit()
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    worker = CallbackDeliveryWorker(batch_size=2, max_attempts=3)
+    posted = []
+
+    def post(destination, rows):
+        posted.append((destination, len(rows)))
+        return None if destination.endswith("/ok") else "HTTP 500: failing"
+
+    monkeypatch.setattr(worker, "_post", post)
+    worker.posted = posted
+    yield worker
+    worker._pool.shutdown(wait=True)
+
+
+def deliver(worker):
+    return [future.result() for future in worker.deliver_due()]
+
+
+def outbox(db):
+    db.expire_all()
+    return db.execute(select(CallbackOutboxModel).order_by(CallbackOutboxModel.id)).scalars().all()
+
+
+def test_delivered_batches_are_deleted(db, worker):
+    add_notifications(db, "http://hooks.example/ok", 5)
+
+    assert deliver(worker) == [5]
+    assert worker.posted == [("http://hooks.example/ok", 2)] * 2 + [("http://hooks.example/ok", 1)]
+    assert outbox(db) == []
+    assert worker.stats()["delivered"] == 5
+
+
+def test_failed_destination_is_rescheduled_with_backoff(db, worker):
+    add_notifications(db, "http://hooks.example/ok", 2)
+    add_notifications(db, "http://hooks.example/failing", 3)
+    before = datetime.utcnow()
+
+    deliver(worker)
+
+    # The failing destination stops at its first batch, the other one is delivered regardless.
+    assert worker.posted.count(("http://hooks.example/failing", 2)) == 1
+    rows = outbox(db)
+    assert {row.destination for row in rows} == {"http://hooks.example/failing"}
+    # Only the batch that was sent is charged an attempt, the notification after it was never sent.
+    assert [(row.attempts, row.last_error) for row in rows] == [(1, "HTTP 500: failing")] * 2 + [(0, None)]
+    assert len({row.next_attempt_at for row in rows}) == 1
+    assert before <= rows[0].next_attempt_at <= datetime.utcnow() + timedelta(seconds=CALLBACK_BACKOFF_BASE_SECONDS)
+    assert deliver(worker) == []
+    assert worker.stats()["postponed"] == 1
+
+
+def test_delivery_is_given_up_after_max_attempts(db, worker):
+    add_notifications(db, "http://hooks.example/failing", 1, attempts=2)
+
+    deliver(worker)
+
+    row, = outbox(db)
+    assert row.attempts == 3 and row.next_attempt_at is None
+    assert worker.stats()["given_up"] == 1
+    assert worker.purge_given_up(datetime.utcnow()) == 0
+    assert worker.purge_given_up(datetime.utcnow() + worker.given_up_retention + timedelta(seconds=1)) == 1
+    assert outbox(db) == []
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.received.append(self.path)
+        self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/redirect":
+            self.send_response(307)
+            self.send_header("Location", "/internal")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordingHandler)
+    server.received = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_redirects_are_not_followed(local_server):
+    host = f"127.0.0.1:{local_server.server_port}"
+    CALLBACK_ALLOWED_HOSTS.add(host)
+    worker = CallbackDeliveryWorker()
+    try:
+        error = worker._post(f"http://{host}/redirect", [])
+    finally:
+        CALLBACK_ALLOWED_HOSTS.discard(host)
+        worker._pool.shutdown()
+
+    assert error.startswith("HTTP 307")
+    assert local_server.received == ["/redirect"]
+
+
+def test_connections_to_internal_addresses_are_refused(local_server, monkeypatch):
+    # The host resolved to a public address when checked, and to a loopback one when connecting.
+    monkeypatch.setattr(delivery, "check_callback_url", lambda url: None)
+    worker = CallbackDeliveryWorker()
+    try:
+        error = worker._post(f"http://127.0.0.1:{local_server.server_port}/hook", [])
+    finally:
+        worker._pool.shutdown()
+
+    assert "non-public address 127.0.0.1" in error
+    assert local_server.received == []
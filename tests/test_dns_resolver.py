@@ -0,0 +1,128 @@
+import threading
+import time
+
+import dns.exception
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+import pytest
+
+from geolocation_app.resolution_app.dns_resolver import DnsResolutionError, DnsUnavailable, HedgedResolver
+
+SOA = "ns1.example.com. admin.example.com. 1 7200 3600 1209600 {minimum}"
+
+
+def answer(query, *addresses, ttl=300):
+    response = dns.message.make_response(query)
+    rdtype = query.question[0].rdtype
+    records = [address for address in addresses if (":" in address) == (rdtype == dns.rdatatype.AAAA)]
+    if records:
+        response.answer.append(dns.rrset.from_text(query.question[0].name, ttl, "IN", rdtype, *records))
+    return response
+
+
+def negative(query, rcode=dns.rcode.NOERROR, minimum=60, soa_ttl=3600):
+    response = dns.message.make_response(query)
+    response.set_rcode(rcode)
+    response.authority.append(dns.rrset.from_text("example.com.", soa_ttl, "IN", "SOA", SOA.format(minimum=minimum)))
+    return response
+
+
+def stub_resolver(respond, **kwargs):
+    """
+    Resolver whose queries are answered by respond(query, nameserver), recording (time, nameserver, type).
+    """
+    resolver = HedgedResolver(nameservers=["ns1", "ns2"], **{"timeout": 1.0, **kwargs})
+    resolver.sent = []
+
+    def query(query, nameserver, timeout, port):
+        resolver.sent.append((time.monotonic(), nameserver, query.question[0].rdtype))
+        return respond(query, nameserver), False
+
+    resolver._query = query
+    return resolver
+
+
+def cached_for(resolver, domain, rdtype):
+    expires, result = resolver._cache[(dns.name.from_text(domain), rdtype)]
+    return expires - time.monotonic(), result
+
+
+def test_fast_nameserver_is_not_hedged():
+    resolver = stub_resolver(lambda query, nameserver: answer(query, "1.2.3.4", "2001:db8::1"), hedge_delay=0.2)
+
+    assert resolver.resolve("example.com") == ["1.2.3.4", "2001:db8::1"]
+    assert {nameserver for _, nameserver, _ in resolver.sent} == {"ns1"}
+    assert "hedged_queries" not in resolver.stats()
+
+
+def test_slow_nameserver_is_hedged_after_the_delay():
+    release = threading.Event()
+
+    def respond(query, nameserver):
+        if nameserver == "ns1":
+            release.wait(2)
+        return answer(query, "1.2.3.4")
+
+    resolver = stub_resolver(respond, hedge_delay=0.1)
+    try:
+        started = time.monotonic()
+        assert resolver.resolve("example.com") == ["1.2.3.4"]
+    finally:
+        release.set()
+
+    hedges = [sent_at - started for sent_at, nameserver, _ in resolver.sent if nameserver == "ns2"]
+    assert len(hedges) == 2
+    assert all(0.1 <= delay < 0.5 for delay in hedges)
+    assert resolver.stats()["hedged_queries"] == 2
+
+
+def test_nxdomain_is_cached_for_the_soa_minimum():
+    resolver = stub_resolver(lambda query, nameserver: negative(query, dns.rcode.NXDOMAIN, minimum=60))
+
+    for _ in range(2):
+        with pytest.raises(DnsResolutionError, match="NXDOMAIN"):
+            resolver.resolve("missing.example.com")
+
+    assert len(resolver.sent) == 2
+    ttl, result = cached_for(resolver, "missing.example.com", dns.rdatatype.A)
+    assert result == "NXDOMAIN" and 59 < ttl <= 60
+
+
+def test_nodata_is_cached_for_the_soa_ttl_when_lower():
+    resolver = stub_resolver(lambda query, nameserver: negative(query, minimum=600, soa_ttl=30))
+
+    with pytest.raises(DnsResolutionError, match="no address records"):
+        resolver.resolve("empty.example.com")
+
+    ttl, result = cached_for(resolver, "empty.example.com", dns.rdatatype.AAAA)
+    assert result == [] and 29 < ttl <= 30
+    assert resolver.stats()["cached"] == 2
+
+
+def test_timeouts_make_dns_unavailable_and_are_not_cached():
+    def respond(query, nameserver):
+        raise dns.exception.Timeout()
+
+    resolver = stub_resolver(respond)
+
+    with pytest.raises(DnsUnavailable):
+        resolver.resolve("example.com")
+    # Both record types were tried on both nameservers.
+    assert len(resolver.sent) == 4
+    assert resolver.stats()["cached"] == 0
+
+
+def test_malformed_response_is_servfail():
+    def respond(query, nameserver):
+        raise dns.message.TrailingJunk()
+
+    resolver = stub_resolver(respond, servfail_ttl=30)
+
+    with pytest.raises(DnsResolutionError, match="SERVFAIL"):
+        resolver.resolve("example.com")
+    assert resolver.stats()["malformed_responses"] == 4
+    ttl, result = cached_for(resolver, "example.com", dns.rdatatype.A)
+    assert result == "SERVFAIL" and 29 < ttl <= 30
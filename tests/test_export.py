@@ -0,0 +1,45 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+
+from geolocation_app.export_app.export_app import app
+from geolocation_app.utils.db_handler import GeolocationRequestModel
+from geolocation_app.utils.status import GeolocationStatus
+
+NOW = datetime.utcnow()
+
+
+def add_requests(db):
+    for request_id, created_at in (("before", NOW - timedelta(days=2)), ("legacy", NOW - timedelta(hours=1)),
+                                   ("current", NOW - timedelta(days=3))):
+        db.add(GeolocationRequestModel(id=request_id, domain=f"{request_id}.com", status=GeolocationStatus.RESOLVED,
+                                       created_at=created_at, updated_at=NOW - timedelta(minutes=30)))
+    db.commit()
+    # Rows written before the column existed.
+    db.execute(update(GeolocationRequestModel).where(GeolocationRequestModel.id.in_(["before", "legacy"]))
+               .values(updated_at=None))
+    db.commit()
+
+
+def test_incremental_export_includes_rows_without_updated_at(db):
+    add_requests(db)
+
+    response = TestClient(app).get("/export", params={"since": (NOW - timedelta(days=1)).isoformat()})
+
+    assert response.status_code == 200
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["legacy", "current"]
+
+
+def test_gzip_export_is_a_gzip_file(db):
+    add_requests(db)
+
+    response = TestClient(app).get("/export", params={"compression": "gzip"})
+
+    assert response.headers["content-type"] == "application/gzip"
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-disposition"] == 'attachment; filename="geolocation_requests.ndjson.gz"'
+    rows = [json.loads(line) for line in gzip.decompress(response.content).decode().splitlines()]
+    assert [row["id"] for row in rows] == ["current", "before", "legacy"]
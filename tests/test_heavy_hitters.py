@@ -0,0 +1,111 @@
+import random
+from collections import Counter
+
+import pytest
+
+from geolocation_app.utils import heavy_hitters
+from geolocation_app.utils.heavy_hitters import (
+    HeavyHitterReader,
+    HeavyHitterTracker,
+    SpaceSaving,
+    compact_checkpoints,
+)
+
+
+def zipf_stream(seed, length, keys=2000):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, keys + 1)]
+    return rng.choices([f"key-{rank}" for rank in range(keys)], weights=weights, k=length)
+
+
+def sketch_of(stream, capacity):
+    sketch = SpaceSaving(capacity)
+    for key in stream:
+        sketch.add(key)
+    return sketch
+
+
+def assert_bounds(sketch, truth):
+    assert sketch.total == sum(truth.values())
+    assert len(sketch.counts) <= sketch.capacity
+    for key, count in sketch.counts.items():
+        error = sketch.errors[key]
+        assert count - error <= truth[key] <= count
+        assert error <= sketch.max_error
+
+
+def test_add_keeps_error_bounds():
+    stream = zipf_stream(1, 20000)
+    assert_bounds(sketch_of(stream, 100), Counter(stream))
+
+
+def test_merge_keeps_error_bounds():
+    streams = [zipf_stream(seed, length) for seed, length in ((1, 20000), (2, 5000), (3, 12000))]
+    merged = SpaceSaving.merge([sketch_of(stream, 100) for stream in streams])
+
+    truth = Counter()
+    for stream in streams:
+        truth.update(stream)
+    assert_bounds(merged, truth)
+    # Keys seen more often than total / capacity are guaranteed to be tracked.
+    assert all(key in merged.counts for key, count in truth.items() if count > merged.max_error)
+
+
+def test_merge_of_sketches_that_are_not_full_is_exact():
+    first, second = SpaceSaving(10), SpaceSaving(10)
+    for key in "aabbbc":
+        first.add(key)
+    for key in "bcd":
+        second.add(key)
+
+    merged = SpaceSaving.merge([first, second])
+
+    assert merged.counts == {"a": 2, "b": 4, "c": 2, "d": 1}
+    assert set(merged.errors.values()) == {0}
+
+
+@pytest.fixture
+def sketch_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(heavy_hitters, "HEAVY_HITTERS_DIR", str(tmp_path))
+    return tmp_path
+
+
+def checkpoints(directory):
+    return sorted(path.name for path in directory.glob("*.json"))
+
+
+def test_trackers_of_one_host_get_their_own_stable_checkpoint(sketch_dir):
+    first = HeavyHitterTracker("domain", instance="host")
+    second = HeavyHitterTracker("domain", instance="host")
+    first.add(["a", "a"])
+    second.add(["b"])
+    first.close()
+    second.close()
+    assert checkpoints(sketch_dir) == ["domain.host-1.json", "domain.host.json"]
+
+    # A restarted tracker claims the first free slot and warm-starts from it.
+    restarted = HeavyHitterTracker("domain", instance="host")
+    try:
+        assert restarted.sketch.counts == {"a": 2}
+    finally:
+        restarted.close()
+
+
+def test_reader_compacts_checkpoints_of_stopped_trackers(sketch_dir):
+    running = HeavyHitterTracker("domain", instance="running")
+    running.add(["a"])
+    running.checkpoint()
+    for restart in range(5):
+        tracker = HeavyHitterTracker("domain", instance=f"stopped-{restart}")
+        tracker.add(["a", "b"])
+        tracker.close()
+
+    merged = HeavyHitterReader("domain").get()
+
+    assert merged.counts == {"a": 6, "b": 5}
+    assert checkpoints(sketch_dir) == ["domain.compacted.json", "domain.running.json"]
+    # The checkpoint of the running tracker is left alone, and compacting again changes nothing.
+    assert compact_checkpoints("domain") == 0
+    running.close()
+    assert compact_checkpoints("domain") == 1
+    assert HeavyHitterReader("domain").get().counts == {"a": 6, "b": 5}
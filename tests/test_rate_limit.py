@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from geolocation_app.login_app.login_app import create_access_token
+from geolocation_app.utils.rate_limit import TokenBucketLimiter, client_key
+
+
+def test_client_key_uses_the_user_of_a_valid_token():
+    token = create_access_token({"sub": "alice"}, timedelta(minutes=5))
+
+    assert client_key(f"Bearer {token}", "10.0.0.1") == "user:alice"
+    assert client_key(f"Bearer {create_access_token({'sub': 'alice'})}", "10.0.0.2") == "user:alice"
+
+
+def test_client_key_ignores_invalid_tokens():
+    expired = create_access_token({"sub": "alice"}, timedelta(minutes=-1))
+
+    for authorization in (None, "", "Bearer made-up", f"Bearer {expired}", "Basic YWxpY2U6cHc="):
+        assert client_key(authorization, "10.0.0.1") == "ip:10.0.0.1"
+
+
+def test_made_up_tokens_share_the_address_bucket():
+    limiter = TokenBucketLimiter(rate=0.001, burst=3)
+
+    allowed = [limiter.acquire(client_key(f"Bearer random-{i}", "10.0.0.1"))[0] for i in range(5)]
+
+    assert allowed == [True, True, True, False, False]
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from geolocation_app.resolution_app.refresh import stale_candidates
+from geolocation_app.utils.db_handler import GeolocationRequestModel
+from geolocation_app.utils.status import GeolocationStatus
+
+NOW = datetime.utcnow()
+
+
+def add_request(db, request_id, domain, updated_at, created_at=None, status=GeolocationStatus.RESOLVED):
+    db.add(GeolocationRequestModel(id=request_id, domain=domain, status=status, created_at=created_at or updated_at,
+                                   updated_at=updated_at))
+
+
+def candidates(db):
+    return [(request_id, domain) for _, request_id, domain in
+            stale_candidates(db, NOW, timedelta(hours=24), timedelta(hours=1), 10)]
+
+
+def test_one_candidate_per_domain_from_its_latest_request(db):
+    for i in range(5):
+        add_request(db, f"old-{i}", "example.com", NOW - timedelta(days=10 - i))
+    add_request(db, "fresh", "fresh.com", NOW - timedelta(hours=1))
+    add_request(db, "pending", "pending.com", NOW - timedelta(days=5), status=GeolocationStatus.PENDING)
+    db.commit()
+
+    assert candidates(db) == [("old-4", "example.com")]
+
+
+def test_requests_without_updated_at_are_refreshed_by_creation_time(db):
+    add_request(db, "legacy", "legacy.com", NOW, created_at=NOW - timedelta(days=30))
+    add_request(db, "legacy-new", "new.com", NOW, created_at=NOW - timedelta(hours=1))
+    db.commit()
+    # As left by the ALTER TABLE that added the column.
+    db.execute(update(GeolocationRequestModel).values(updated_at=None))
+    db.commit()
+
+    assert candidates(db) == [("legacy", "legacy.com")]
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from geolocation_app.login_app.login_app import create_access_token
+from geolocation_app.request_app import geolocation_request_app
+
+
+@pytest.fixture
+def client():
+    return TestClient(geolocation_request_app.app)
+
+
+@pytest.fixture
+def checked_urls(monkeypatch):
+    """
+    Replace the callback URL check, recording each URL and whether it ran on the event loop.
+    """
+    checked = []
+
+    def check_callback_url(url):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop = True
+        except RuntimeError:
+            on_event_loop = False
+        checked.append((url, on_event_loop))
+
+    monkeypatch.setattr(geolocation_request_app, "check_callback_url", check_callback_url)
+    return checked
+
+
+def test_callback_url_is_checked_off_the_event_loop(db, client, checked_urls):
+    response = client.post("/geolocation/request",
+                           params={"domain": "example.com", "callback_url": "http://hooks.example/results"})
+
+    assert response.status_code == 200
+    assert checked_urls == [("http://hooks.example/results", False)]
+
+
+def bearer(user):
+    return {"Authorization": f"Bearer {create_access_token({'sub': user}, timedelta(minutes=5))}"}
+
+
+def test_subscriptions_require_a_valid_token(db, client, checked_urls):
+    subscription = {"url": "http://hooks.example/results"}
+
+    for headers in ({}, {"Authorization": "Bearer made-up"}):
+        assert client.put("/geolocation/subscription", json=subscription, headers=headers).status_code == 401
+        assert client.get("/geolocation/subscription", headers=headers).status_code == 401
+    assert checked_urls == []
+
+
+def test_subscriptions_belong_to_their_user(db, client, checked_urls):
+    subscription = {"url": "http://hooks.example/alice"}
+
+    assert client.put("/geolocation/subscription", json=subscription, headers=bearer("alice")).status_code == 200
+
+    assert client.get("/geolocation/subscription", headers=bearer("alice")).json() == subscription
+    assert client.get("/geolocation/subscription", headers=bearer("bob")).status_code == 404
+    assert client.delete("/geolocation/subscription", headers=bearer("bob")).status_code == 404
@@ -0,0 +1,96 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from geolocation_app.utils.db_handler import (
+    ArchivedCountModel,
+    ArchivedRequestModel,
+    ArchiveSegmentModel,
+    GeolocationRequestModel,
+    GeolocationRequestVersionModel,
+)
+from geolocation_app.utils.popularity_buckets import DOMAIN, SERVER
+from geolocation_app.utils.retention import (
+    archive_batch,
+    archived_segment,
+    expire_segments,
+    read_segment,
+    segment_name,
+)
+from geolocation_app.utils.status import GeolocationStatus
+
+NOW = datetime.utcnow()
+OLD = NOW - timedelta(days=60)
+
+
+def add_request(db, request_id, created_at, status=GeolocationStatus.RESOLVED, servers="['1.2.3.4']"):
+    db.add(GeolocationRequestModel(id=request_id, domain="example.com", status=status, servers=servers,
+                                   created_at=created_at, updated_at=created_at))
+
+
+def test_archive_batch_moves_old_requests_to_a_segment(db, tmp_path):
+    for i in range(3):
+        add_request(db, f"old-{i}", OLD + timedelta(seconds=i))
+    add_request(db, "old-pending", OLD, status=GeolocationStatus.PENDING)
+    add_request(db, "new", NOW)
+    db.add(GeolocationRequestVersionModel(request_id="old-0", version=1, domain="example.com",
+                                          status=GeolocationStatus.ERROR, locations="", servers="", resolved_at=OLD))
+    db.commit()
+
+    archived, cursor = archive_batch(db, NOW - timedelta(days=30), str(tmp_path))
+
+    assert (archived, cursor) == (3, None)
+    remaining = set(db.execute(select(GeolocationRequestModel.id)).scalars())
+    assert remaining == {"old-pending", "new"}
+    assert db.execute(select(GeolocationRequestVersionModel)).first() is None
+
+    name = segment_name(datetime.utcnow())
+    records = list(read_segment(os.path.join(tmp_path, name)))
+    assert [record["id"] for record in records] == ["old-0", "old-1", "old-2"]
+    assert [version["version"] for version in records[0]["versions"]] == [1]
+    assert archived_segment(db, "old-1") == name
+    assert archived_segment(db, "new") is None
+
+    counts = dict(db.execute(select(ArchivedCountModel.kind, ArchivedCountModel.requests)
+                             .where(ArchivedCountModel.key.in_(["example.com", "1.2.3.4"]))).all())
+    assert counts == {DOMAIN: 3, SERVER: 3}
+
+
+def test_archive_batch_continues_from_its_cursor(db, tmp_path):
+    for i in range(5):
+        add_request(db, f"old-{i}", OLD + timedelta(seconds=i))
+    db.commit()
+    cutoff = NOW - timedelta(days=30)
+
+    archived, cursor = archive_batch(db, cutoff, str(tmp_path), batch_size=2)
+    assert archived == 2 and cursor is not None
+    archived, cursor = archive_batch(db, cutoff, str(tmp_path), cursor=cursor, batch_size=2)
+    assert archived == 2 and cursor is not None
+    archived, cursor = archive_batch(db, cutoff, str(tmp_path), cursor=cursor, batch_size=2)
+    assert (archived, cursor) == (1, None)
+
+    assert db.execute(select(GeolocationRequestModel)).first() is None
+    records = list(read_segment(os.path.join(tmp_path, segment_name(datetime.utcnow()))))
+    assert sorted(record["id"] for record in records) == [f"old-{i}" for i in range(5)]
+
+
+def test_expire_segments_deletes_old_segments_and_their_request_ids(db, tmp_path):
+    for i in range(5):
+        add_request(db, f"old-{i}", OLD + timedelta(seconds=i))
+    db.commit()
+    archive_batch(db, NOW - timedelta(days=30), str(tmp_path))
+    name = segment_name(datetime.utcnow())
+
+    assert expire_segments(db, NOW + timedelta(days=364), days=365, archive_dir=str(tmp_path)) == []
+    assert archived_segment(db, "old-0") == name
+
+    expired = expire_segments(db, NOW + timedelta(days=366), days=365, archive_dir=str(tmp_path), batch_size=2,
+                              pause=0)
+
+    assert expired == [name]
+    assert not os.path.exists(os.path.join(tmp_path, name))
+    assert db.execute(select(ArchivedRequestModel)).first() is None
+    assert db.execute(select(ArchiveSegmentModel)).first() is None
+    # The counts folded from the archived requests stay.
+    assert db.execute(select(ArchivedCountModel.requests).where(ArchivedCountModel.key == "example.com")).scalar() == 5
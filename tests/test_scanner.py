@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from geolocation_app.resolution_app.scanner import PendingScanner
+from geolocation_app.utils.db_handler import GeolocationRequestModel
+from geolocation_app.utils.status import GeolocationStatus, RequestPriority
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_submitted_requests_stay_in_flight_until_released(db):
+    db.add_all(
+        GeolocationRequestModel(id=f"request-{i}", domain=f"domain-{i}.com", status=GeolocationStatus.PENDING,
+                                priority=RequestPriority.INTERACTIVE, client_id="client", created_at=datetime.utcnow())
+        for i in range(5)
+    )
+    db.commit()
+    resolved = Counter()
+    lock = threading.Lock()
+
+    def resolve(request_id, domain, refresh, created_at):
+        with lock:
+            resolved[request_id] += 1
+        # The result is only queued for the writer, the rows stay Pending.
+        return True
+
+    scanner = PendingScanner(resolve, workers=2, window=10, page_size=5, poll_interval=0.01,
+                             rescan_interval=0.01).start()
+    try:
+        wait_for(lambda: len(resolved) == 5)
+        # Several rescans of the still Pending rows.
+        time.sleep(0.2)
+        assert set(resolved.values()) == {1}
+        assert scanner.stats()["awaiting_write"] == 5
+
+        scanner.release(["request-0"])
+        wait_for(lambda: resolved["request-0"] == 2)
+        assert sum(resolved.values()) == 6
+    finally:
+        scanner.stop()
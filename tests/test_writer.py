@@ -0,0 +1,114 @@
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from geolocation_app.resolution_app import writer
+from geolocation_app.resolution_app.writer import ResolutionResult, ResultWriter
+from geolocation_app.utils.db_handler import GeolocationRequestModel
+from geolocation_app.utils.status import GeolocationStatus
+
+POISON = "request-7"
+
+
+def add_requests(db, count):
+    db.add_all(
+        GeolocationRequestModel(id=f"request-{i}", domain=f"domain-{i}.com", status=GeolocationStatus.PENDING,
+                                created_at=datetime.utcnow())
+        for i in range(count)
+    )
+    db.commit()
+
+
+def resolved(i):
+    return ResolutionResult(f"request-{i}", f"domain-{i}.com", GeolocationStatus.RESOLVED, locations=["Tel Aviv"],
+                            location_keys=[("IL", "Tel Aviv")], servers=["1.2.3.4"])
+
+
+def fail_on_poison(monkeypatch, calls=None):
+    write_results = writer.write_results
+
+    def failing_write_results(db, results):
+        if calls is not None:
+            calls.append(len(results))
+        if any(result.request_id == POISON and result.status == GeolocationStatus.RESOLVED for result in results):
+            raise ValueError("cannot write this result")
+        write_results(db, results)
+
+    monkeypatch.setattr(writer, "write_results", failing_write_results)
+
+
+def statuses(db):
+    db.expire_all()
+    return dict(db.execute(select(GeolocationRequestModel.id, GeolocationRequestModel.status)).all())
+
+
+def test_poison_result_is_written_as_error(db, monkeypatch):
+    add_requests(db, 20)
+    calls = []
+    fail_on_poison(monkeypatch, calls)
+
+    written = ResultWriter()._write([resolved(i) for i in range(20)])
+
+    assert len(written) == 20
+    assert {result.request_id: result.status for result in written}[POISON] == GeolocationStatus.ERROR
+    found = statuses(db)
+    assert found.pop(POISON) == GeolocationStatus.ERROR
+    assert set(found.values()) == {GeolocationStatus.RESOLVED}
+    # Halving isolates the poison row in about log2(20) levels, not one write per result.
+    assert len(calls) < 20
+
+
+def test_result_that_cannot_be_written_at_all_is_dropped(db, monkeypatch):
+    add_requests(db, 2)
+
+    def broken_write_results(db, results):
+        raise ValueError("database is broken")
+
+    monkeypatch.setattr(writer, "write_results", broken_write_results)
+
+    assert ResultWriter()._write([resolved(0), resolved(1)]) == []
+    assert set(statuses(db).values()) == {GeolocationStatus.PENDING}
+
+
+def test_writer_survives_failing_hook(db, monkeypatch):
+    add_requests(db, 20)
+    fail_on_poison(monkeypatch)
+    flushed = []
+
+    def on_flush(results):
+        flushed.append(len(results))
+        raise RuntimeError("hook failed")
+
+    result_writer = ResultWriter(max_batch=10, max_delay=0.01, on_flush=on_flush).start()
+    for i in range(10):
+        result_writer.submit(resolved(i))
+    for i in range(10, 20):
+        result_writer.submit(resolved(i))
+    result_writer.stop()
+
+    assert sum(flushed) == 20
+    assert result_writer.stats()["flushed_results"] == 20
+    assert statuses(db)[POISON] == GeolocationStatus.ERROR
+
+
+def test_locked_database_is_waited_for_without_splitting(db, monkeypatch):
+    add_requests(db, 4)
+    write_results = writer.write_results
+    calls = []
+
+    def locked_write_results(db, results):
+        calls.append(len(results))
+        if len(calls) <= 2:
+            raise OperationalError("UPDATE", {}, sqlite3.OperationalError("database is locked"))
+        write_results(db, results)
+
+    monkeypatch.setattr(writer, "write_results", locked_write_results)
+    monkeypatch.setattr(writer.time, "sleep", lambda seconds: None)
+
+    written = ResultWriter()._write([resolved(i) for i in range(4)])
+
+    assert calls == [4, 4, 4]
+    assert [result.status for result in written] == [GeolocationStatus.RESOLVED] * 4
+    assert set(statuses(db).values()) == {GeolocationStatus.RESOLVED}